@@ -0,0 +1,41 @@
+"""Primary key and reverse index on user_chat_association
+
+Revision ID: 0d80fb619203
+Revises: e2c62b12caaf
+Create Date: 2026-10-18 11:26:52.904117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0d80fb619203'
+down_revision: Union[str, None] = 'e2c62b12caaf'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Deduplikacja: niepełne wiersze i powtórzone pary (zostaje jeden wiersz)
+    op.execute("DELETE FROM user_chat_association WHERE user_id IS NULL OR chat_id IS NULL")
+    op.execute(
+        """
+        DELETE FROM user_chat_association a
+        USING user_chat_association b
+        WHERE a.ctid < b.ctid AND a.chat_id = b.chat_id AND a.user_id = b.user_id
+        """
+    )
+    op.alter_column('user_chat_association', 'user_id', existing_type=sa.String(), nullable=False)
+    op.alter_column('user_chat_association', 'chat_id', existing_type=sa.Integer(), nullable=False)
+    op.create_primary_key('user_chat_association_pkey', 'user_chat_association', ['chat_id', 'user_id'])
+    op.create_index('ix_user_chat_association_user_id_chat_id', 'user_chat_association', ['user_id', 'chat_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_user_chat_association_user_id_chat_id', table_name='user_chat_association')
+    op.drop_constraint('user_chat_association_pkey', 'user_chat_association', type_='primary')
+    op.alter_column('user_chat_association', 'chat_id', existing_type=sa.Integer(), nullable=True)
+    op.alter_column('user_chat_association', 'user_id', existing_type=sa.String(), nullable=True)
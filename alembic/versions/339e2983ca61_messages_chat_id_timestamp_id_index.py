@@ -0,0 +1,41 @@
+"""Composite index on messages (chat_id, timestamp, id)
+
+Revision ID: 339e2983ca61
+Revises: 2fe809208503
+Create Date: 2026-10-18 09:12:40.118503
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '339e2983ca61'
+down_revision: Union[str, None] = '2fe809208503'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY - bez blokowania zapisów do dużej tabeli messages
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_messages_chat_id_timestamp_id',
+            'messages',
+            ['chat_id', 'timestamp', 'id'],
+            unique=False,
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_messages_chat_id_timestamp_id',
+            table_name='messages',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
@@ -0,0 +1,131 @@
+"""Monthly range partitioning of messages by timestamp
+
+Revision ID: 6681817aa5b7
+Revises: bba5c2ab5ae4
+Create Date: 2026-10-18 14:22:41.913504
+
+Istniejąca tabela nie jest kopiowana - zostaje podpięta jako partycja
+`messages_legacy` (MINVALUE .. początek przyszłego miesiąca, a jeśli są nowsze
+wiadomości - początek miesiąca po najnowszej). Przy bardzo dużej
+tabeli warto wcześniej zbudować indeks bez blokowania zapisów:
+
+    CREATE UNIQUE INDEX CONCURRENTLY messages_legacy_id_timestamp_idx ON messages (id, "timestamp");
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6681817aa5b7'
+down_revision: Union[str, None] = 'bba5c2ab5ae4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+
+
+def _month_start(value: datetime) -> datetime:
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _add_months(value: datetime, months: int) -> datetime:
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    sequence = bind.scalar(sa.text("SELECT pg_get_serial_sequence('messages', 'id')"))
+    # Wiadomości z bieżącego miesiąca (i ewentualnie późniejsze) muszą zmieścić się w starej partycji
+    latest = bind.scalar(sa.text('SELECT max("timestamp") FROM messages')) or datetime.utcnow()
+    boundary = _add_months(_month_start(max(latest, datetime.utcnow())), 1)
+
+    op.execute('ALTER TABLE messages RENAME TO messages_legacy')
+    op.execute('ALTER INDEX messages_pkey RENAME TO messages_legacy_pkey')
+    op.execute('ALTER INDEX IF EXISTS ix_messages_id RENAME TO messages_legacy_id_idx')
+    op.execute('ALTER INDEX IF EXISTS ix_messages_sender RENAME TO messages_legacy_sender_idx')
+    op.execute('ALTER INDEX IF EXISTS ix_messages_chat_id_timestamp_id RENAME TO messages_legacy_chat_id_timestamp_id_idx')
+    # Klucz partycjonowania jest częścią klucza głównego, więc nie może być NULL
+    op.execute('UPDATE messages_legacy SET "timestamp" = \'1970-01-01\' WHERE "timestamp" IS NULL')
+    op.execute('ALTER TABLE messages_legacy ALTER COLUMN "timestamp" SET NOT NULL')
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+
+    op.execute(
+        f"""
+        CREATE TABLE messages (
+            id integer NOT NULL DEFAULT nextval('{sequence}'::regclass),
+            chat_id integer REFERENCES chats (id),
+            sender varchar,
+            content varchar,
+            "timestamp" timestamp without time zone NOT NULL,
+            CONSTRAINT messages_pkey PRIMARY KEY (id, "timestamp")
+        ) PARTITION BY RANGE ("timestamp")
+        """
+    )
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY messages.id")
+    op.create_index('ix_messages_id', 'messages', ['id'], unique=False)
+    op.create_index('ix_messages_sender', 'messages', ['sender'], unique=False)
+    op.create_index('ix_messages_chat_id_timestamp_id', 'messages', ['chat_id', 'timestamp', 'id'], unique=False)
+
+    # Indeksy starej tabeli pasują do indeksów partycjonowanych - brakuje tylko (id, timestamp).
+    # CHECK zwalidowany przed ATTACH pozwala pominąć skanowanie tabeli pod blokadą wyłączną
+    op.execute('CREATE UNIQUE INDEX IF NOT EXISTS messages_legacy_id_timestamp_idx ON messages_legacy (id, "timestamp")')
+    # ATTACH podpina pod klucz główny rodzica tylko indeks, za którym stoi ograniczenie -
+    # zwykły indeks UNIQUE zostałby pominięty i zbudowany od nowa pod blokadą.
+    # Klucz główny (id) zastępujemy kluczem (id, timestamp) na gotowym indeksie
+    op.execute('ALTER TABLE messages_legacy DROP CONSTRAINT messages_legacy_pkey')
+    op.execute(
+        'ALTER TABLE messages_legacy ADD CONSTRAINT messages_legacy_id_timestamp_pkey '
+        'PRIMARY KEY USING INDEX messages_legacy_id_timestamp_idx'
+    )
+    op.execute(
+        f'ALTER TABLE messages_legacy ADD CONSTRAINT messages_legacy_range '
+        f'CHECK ("timestamp" < \'{boundary.isoformat()}\') NOT VALID'
+    )
+    op.execute('ALTER TABLE messages_legacy VALIDATE CONSTRAINT messages_legacy_range')
+    op.execute(
+        f"ALTER TABLE messages ATTACH PARTITION messages_legacy "
+        f"FOR VALUES FROM (MINVALUE) TO ('{boundary.isoformat()}')"
+    )
+    op.execute('ALTER TABLE messages_legacy DROP CONSTRAINT messages_legacy_range')
+
+    # Kolejne miesiące zakłada app.partitions.ensure_partitions (pomija miesiące starej partycji)
+    month = boundary
+    for _ in range(MONTHS_AHEAD):
+        op.execute(
+            f"CREATE TABLE messages_p{month:%Y%m} PARTITION OF messages "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+        )
+        month = _add_months(month, 1)
+
+
+def downgrade() -> None:
+    sequence = op.get_bind().scalar(sa.text("SELECT pg_get_serial_sequence('messages', 'id')"))
+    op.execute('ALTER TABLE messages RENAME TO messages_partitioned')
+    op.execute('ALTER INDEX messages_pkey RENAME TO messages_partitioned_pkey')
+    op.execute('ALTER INDEX ix_messages_id RENAME TO messages_partitioned_id_idx')
+    op.execute('ALTER INDEX ix_messages_sender RENAME TO messages_partitioned_sender_idx')
+    op.execute('ALTER INDEX ix_messages_chat_id_timestamp_id RENAME TO messages_partitioned_chat_id_timestamp_id_idx')
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+
+    op.execute(
+        f"""
+        CREATE TABLE messages (
+            id integer NOT NULL DEFAULT nextval('{sequence}'::regclass) PRIMARY KEY,
+            chat_id integer REFERENCES chats (id),
+            sender varchar,
+            content varchar,
+            "timestamp" timestamp without time zone
+        )
+        """
+    )
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY messages.id")
+    # Wiadomości z odłączonych (zarchiwizowanych) partycji nie wracają do tabeli
+    op.execute('INSERT INTO messages SELECT id, chat_id, sender, content, "timestamp" FROM messages_partitioned')
+    op.execute('DROP TABLE messages_partitioned CASCADE')
+    op.create_index('ix_messages_id', 'messages', ['id'], unique=False)
+    op.create_index('ix_messages_sender', 'messages', ['sender'], unique=False)
+    op.create_index('ix_messages_chat_id_timestamp_id', 'messages', ['chat_id', 'timestamp', 'id'], unique=False)
@@ -0,0 +1,26 @@
+"""Per-user read cursor on user_chat_association
+
+Revision ID: bba5c2ab5ae4
+Revises: 0d80fb619203
+Create Date: 2026-10-18 12:03:18.447920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'bba5c2ab5ae4'
+down_revision: Union[str, None] = '0d80fb619203'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('user_chat_association', sa.Column('last_read_message_id', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('user_chat_association', 'last_read_message_id')
@@ -0,0 +1,51 @@
+"""Canonical (dm_user_a, dm_user_b) key for 1:1 chats
+
+Revision ID: e2c62b12caaf
+Revises: 339e2983ca61
+Create Date: 2026-10-18 10:41:07.530216
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2c62b12caaf'
+down_revision: Union[str, None] = '339e2983ca61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('chats', sa.Column('dm_user_a', sa.String(), sa.ForeignKey('users.id'), nullable=True))
+    op.add_column('chats', sa.Column('dm_user_b', sa.String(), sa.ForeignKey('users.id'), nullable=True))
+
+    # Backfill: czat z dokładnie dwoma uczestnikami to czat 1:1; przy duplikatach
+    # klucz dostaje najstarszy czat pary (ten, który zwracało dotąd get-or-create)
+    op.execute(
+        """
+        WITH pairs AS (
+            SELECT chat_id, min(user_id) AS user_a, max(user_id) AS user_b
+            FROM user_chat_association
+            GROUP BY chat_id
+            HAVING count(DISTINCT user_id) = 2
+        ), canonical AS (
+            SELECT DISTINCT ON (user_a, user_b) chat_id, user_a, user_b
+            FROM pairs
+            ORDER BY user_a, user_b, chat_id
+        )
+        UPDATE chats
+        SET dm_user_a = canonical.user_a, dm_user_b = canonical.user_b
+        FROM canonical
+        WHERE chats.id = canonical.chat_id
+        """
+    )
+    op.create_unique_constraint('uq_chats_dm_pair', 'chats', ['dm_user_a', 'dm_user_b'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_chats_dm_pair', 'chats', type_='unique')
+    op.drop_column('chats', 'dm_user_b')
+    op.drop_column('chats', 'dm_user_a')
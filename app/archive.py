@@ -0,0 +1,225 @@
+"""Archiwum zimnych partycji wiadomości na dysku lokalnym.
+
+Każda partycja trafia do jednego pliku posortowanego po (chat_id, timestamp, id):
+- NDJSON: wiadomości czatu tworzą osobny człon gzip, a obok leży indeks
+  chat_id -> (offset, długość, liczba), więc odczyt jednego czatu nie rozpakowuje pliku;
+- Parquet (wymaga pyarrow): grupy wierszy po chat_id, filtrowane przy odczycie.
+
+`manifest.json` w katalogu archiwum opisuje zarchiwizowane zakresy czasu.
+"""
+import gzip
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.partitions import Partition
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet jest opcjonalny - NDJSON działa bez dodatkowych zależności
+    pyarrow = None
+
+MESSAGES_ARCHIVE_DIR = os.getenv("MESSAGES_ARCHIVE_DIR", "/var/lib/chat/archive")
+ARCHIVE_FORMATS = ("ndjson", "parquet")
+PARQUET_ROW_GROUP_SIZE = 50_000
+
+Position = Tuple[datetime, int]
+
+_lock = threading.Lock()
+_manifest_cache: Dict[str, Tuple[float, List[dict]]] = {}
+_index_cache: Dict[str, Tuple[float, Dict[str, list]]] = {}
+
+
+def manifest_path(archive_dir: str = MESSAGES_ARCHIVE_DIR) -> str:
+    return os.path.join(archive_dir, "manifest.json")
+
+
+def load_manifest(archive_dir: str = MESSAGES_ARCHIVE_DIR) -> List[dict]:
+    """Wpisy archiwum (od najstarszego); wczytywane ponownie tylko po zmianie pliku"""
+    path = manifest_path(archive_dir)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return []
+    with _lock:
+        cached = _manifest_cache.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path) as f:
+                entries = json.load(f)
+            entries.sort(key=lambda e: e["to"])
+            _manifest_cache[path] = cached = (mtime, entries)
+    return cached[1]
+
+
+def _save_manifest(entries: List[dict], archive_dir: str):
+    path = manifest_path(archive_dir)
+    with open(path + ".tmp", "w") as f:
+        json.dump(entries, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+async def export_partition(
+    conn: AsyncConnection, partition: Partition, fmt: str = "ndjson", archive_dir: str = MESSAGES_ARCHIVE_DIR
+) -> dict:
+    """Zapisuje partycję do pliku i dopisuje ją do manifestu; zwraca wpis manifestu"""
+    if fmt == "parquet" and pyarrow is None:
+        raise RuntimeError("Format parquet wymaga pakietu pyarrow")
+    os.makedirs(archive_dir, exist_ok=True)
+    rows = await conn.stream(text(
+        f'SELECT id, chat_id, sender, content, "timestamp" FROM "{partition.name}" ORDER BY chat_id, "timestamp", id'
+    ))
+    filename = f"{partition.name}.{'ndjson.gz' if fmt == 'ndjson' else 'parquet'}"
+    path = os.path.join(archive_dir, filename)
+    if fmt == "ndjson":
+        count = await _write_ndjson(rows, path)
+    else:
+        count = await _write_parquet(rows, path)
+
+    entry = {
+        "partition": partition.name,
+        "from": partition.start.isoformat() if partition.start else None,
+        "to": partition.end.isoformat(),
+        "format": fmt,
+        "file": filename,
+        "rows": count,
+    }
+    entries = [e for e in load_manifest(archive_dir) if e["partition"] != partition.name]
+    _save_manifest(entries + [entry], archive_dir)
+    return entry
+
+
+async def _write_ndjson(rows, path: str) -> int:
+    index, count, offset = {}, 0, 0
+    chat_id, lines = None, []
+    with open(path + ".tmp", "wb") as f:
+
+        def write_chat():
+            nonlocal offset
+            block = gzip.compress(b"".join(lines))
+            f.write(block)
+            index[str(chat_id)] = [offset, len(block), len(lines)]
+            offset += len(block)
+
+        async for row in rows:
+            if row.chat_id != chat_id and lines:
+                write_chat()
+                lines = []
+            chat_id = row.chat_id
+            lines.append(orjson.dumps(_message(row)) + b"\n")
+            count += 1
+        if lines:
+            write_chat()
+    with open(path + ".index.json.tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(path + ".tmp", path)
+    os.replace(path + ".index.json.tmp", path + ".index.json")
+    return count
+
+
+async def _write_parquet(rows, path: str) -> int:
+    schema = pyarrow.schema([
+        ("id", pyarrow.int64()),
+        ("chat_id", pyarrow.int64()),
+        ("sender", pyarrow.string()),
+        ("content", pyarrow.string()),
+        ("timestamp", pyarrow.timestamp("us")),
+    ])
+    count, batch = 0, []
+    with pq.ParquetWriter(path + ".tmp", schema, compression="zstd") as writer:
+        async for row in rows:
+            batch.append(dict(row._mapping))
+            if len(batch) >= PARQUET_ROW_GROUP_SIZE:
+                writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+                count, batch = count + len(batch), []
+        if batch:
+            writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+            count += len(batch)
+    os.replace(path + ".tmp", path)
+    return count
+
+
+def archived_until(archive_dir: str = MESSAGES_ARCHIVE_DIR) -> Optional[datetime]:
+    """Koniec najnowszego zarchiwizowanego zakresu (starsze wiadomości mogą być tylko w archiwum)"""
+    entries = load_manifest(archive_dir)
+    return datetime.fromisoformat(entries[-1]["to"]) if entries else None
+
+
+def read_history(
+    chat_id: int,
+    limit: int,
+    before: Optional[Position] = None,
+    after: Optional[Position] = None,
+    archive_dir: str = MESSAGES_ARCHIVE_DIR,
+) -> List[dict]:
+    """Okno historii czatu z archiwum, od najnowszej wiadomości (jak `_load_history`).
+
+    Z `after` - `limit` najstarszych wiadomości nowszych niż `after`; w przeciwnym
+    razie `limit` najnowszych starszych niż `before`. Funkcja blokująca (pliki).
+    """
+    entries = load_manifest(archive_dir)
+    found: List[dict] = []
+    if after is not None:
+        for entry in entries:
+            if datetime.fromisoformat(entry["to"]) <= after[0]:
+                continue
+            found += [m for m in _read_chat(entry, chat_id, archive_dir) if _position(m) > after]
+            if len(found) >= limit:
+                break
+        return list(reversed(found[:limit]))
+    for entry in reversed(entries):
+        if entry["from"] and before is not None and datetime.fromisoformat(entry["from"]) > before[0]:
+            continue
+        older = [m for m in _read_chat(entry, chat_id, archive_dir) if before is None or _position(m) < before]
+        found += reversed(older)
+        if len(found) >= limit:
+            break
+    return found[:limit]
+
+
+def _read_chat(entry: dict, chat_id: int, archive_dir: str) -> List[dict]:
+    """Wiadomości jednego czatu z pliku archiwum, od najstarszej"""
+    path = os.path.join(archive_dir, entry["file"])
+    if entry["format"] == "parquet":
+        table = pq.read_table(path, filters=[("chat_id", "=", chat_id)])
+        return [_message_from_parquet(row) for row in table.to_pylist()]
+    block = _load_index(path).get(str(chat_id))
+    if block is None:
+        return []
+    offset, length, _ = block
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = gzip.decompress(f.read(length))
+    return [orjson.loads(line) for line in data.splitlines()]
+
+
+def _load_index(path: str) -> Dict[str, list]:
+    """Indeks pliku NDJSON; wczytywany ponownie po nadpisaniu (np. ponowne archive-messages)"""
+    index_path = path + ".index.json"
+    mtime = os.path.getmtime(index_path)
+    with _lock:
+        cached = _index_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(index_path) as f:
+            cached = (mtime, json.load(f))
+        with _lock:
+            _index_cache[path] = cached
+    return cached[1]
+
+
+def _message(row) -> dict:
+    return {"id": row.id, "sender": row.sender, "content": row.content, "timestamp": row.timestamp.isoformat()}
+
+
+def _message_from_parquet(row: dict) -> dict:
+    return {"id": row["id"], "sender": row["sender"], "content": row["content"], "timestamp": row["timestamp"].isoformat()}
+
+
+def _position(message: dict) -> Position:
+    return datetime.fromisoformat(message["timestamp"]), message["id"]
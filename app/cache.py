@@ -0,0 +1,37 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class TTLCache:
+    """Lokalny cache LRU z czasem życia wpisów (bezpieczny także w wątkach threadpoola)"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
@@ -0,0 +1,167 @@
+"""Polecenia administracyjne serwisu czatu.
+
+    python -m app.cli reindex-messages
+    python -m app.cli sync-users
+    python -m app.cli archive-messages --older-than-months 12 --format ndjson
+"""
+import argparse
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import select
+
+from app import archive
+from app.database import SessionLocal, engine
+from app.models import Message, User
+from app.partitions import add_months, detach_partition, list_partitions, month_start
+from app.search import (
+    MESSAGES_ALIAS,
+    USERS_ALIAS,
+    bulk_indexer,
+    es_client,
+    ensure_messages_index,
+    ensure_users_index,
+    index_message,
+    index_user,
+    legacy_messages_index_exists,
+    legacy_users_index_exists,
+    messages_index_body,
+    users_index_body,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def reindex_messages(
+    alias: str = MESSAGES_ALIAS, batch_size: int = 5000, catch_up_overlap: timedelta = timedelta(minutes=5)
+):
+    """Buduje indeks wiadomości od nowa z tabeli `messages` i przełącza na niego alias.
+
+    Zastępuje zarówno stary indeks z dynamicznym mapowaniem, jak i istniejące
+    indeksy czasowe - po przełączeniu aliasu poprzednie indeksy są usuwane.
+
+    Id wiadomości są rezerwowane blokami na workerach, więc nie rosną w czasie -
+    zapisane w trakcie przebudowy dogrywamy po znaczniku czasu, z zapasem
+    `catch_up_overlap` na wiadomości czekające w buforze zapisu. Dokumenty mają
+    id wiadomości, więc powtórnie zaindeksowane tylko się nadpisują.
+    """
+    await ensure_messages_index(alias)
+    legacy = await legacy_messages_index_exists(alias)
+    if legacy:
+        target, previous = f"{alias}-000001", [alias]
+    else:
+        target = f"{alias}-{int(time.time()):06d}"
+        previous = list(await es_client.indices.get_alias(name=alias))
+    await es_client.indices.create(index=target, **messages_index_body())
+
+    started = datetime.utcnow()
+    bulk_indexer.start()
+    indexed = await _index_messages(None, target, batch_size)
+    await bulk_indexer.stop()
+    await es_client.indices.refresh(index=target)
+
+    actions = [{"remove_index": {"index": index}} for index in previous]
+    actions.append({"add": {"index": target, "alias": alias, "is_write_index": True}})
+    await es_client.indices.update_aliases(actions=actions)
+
+    # Wiadomości zapisane w trakcie przebudowy trafiły do starego indeksu - dogrywamy je
+    bulk_indexer.start()
+    caught_up = await _index_messages(started - catch_up_overlap, target, batch_size)
+    await bulk_indexer.stop()
+    logger.info("Alias %s wskazuje na %s (%d wiadomości)", alias, target, indexed + caught_up)
+
+
+async def _index_messages(since: Optional[datetime], index: str, batch_size: int) -> int:
+    """Indeksuje wiadomości (od `since`, jeśli podano); zwraca ich liczbę"""
+    indexed = 0
+    stmt = select(Message.id, Message.chat_id, Message.sender, Message.content, Message.timestamp)
+    if since is not None:
+        stmt = stmt.where(Message.timestamp >= since)
+    async with SessionLocal() as db:
+        rows = await db.stream(stmt.execution_options(yield_per=batch_size))
+        async for row in rows:
+            await index_message(*row, index=index)
+            indexed += 1
+            if indexed % 100000 == 0:
+                logger.info("Zaindeksowano %d wiadomości", indexed)
+    return indexed
+
+
+async def sync_users(alias: str = USERS_ALIAS, batch_size: int = 5000):
+    """Buduje indeks użytkowników od nowa z tabeli `users` i przełącza na niego alias"""
+    await ensure_users_index(alias)
+    if await legacy_users_index_exists(alias):
+        previous = [alias]
+    else:
+        previous = list(await es_client.indices.get_alias(name=alias))
+    target = f"{alias}-{int(time.time()):06d}"
+    await es_client.indices.create(index=target, **users_index_body())
+
+    indexed = 0
+    bulk_indexer.start()
+    async with SessionLocal() as db:
+        rows = await db.stream(
+            select(User.id, User.username).where(User.username.isnot(None)).execution_options(yield_per=batch_size)
+        )
+        async for user_id, username in rows:
+            await index_user(user_id, username, index=target)
+            indexed += 1
+    await bulk_indexer.stop()
+    await es_client.indices.refresh(index=target)
+
+    actions = [{"remove_index": {"index": index}} for index in previous]
+    actions.append({"add": {"index": target, "alias": alias}})
+    await es_client.indices.update_aliases(actions=actions)
+    logger.info("Alias %s wskazuje na %s (%d użytkowników)", alias, target, indexed)
+
+
+async def archive_messages(older_than_months: int, fmt: str, archive_dir: str, drop: bool = False):
+    """Eksportuje partycje starsze niż `older_than_months` miesięcy do plików i odłącza je od tabeli.
+
+    Partycja jest odłączana dopiero po zapisaniu pliku i wpisu w manifeście, więc
+    wiadomości są przez cały czas dostępne w bazie albo w archiwum.
+    """
+    cutoff = add_months(month_start(datetime.utcnow()), -older_than_months)
+    async with engine.connect() as conn:
+        partitions = [p for p in await list_partitions(conn) if p.end is not None and p.end <= cutoff]
+    for partition in partitions:
+        async with engine.connect() as conn:
+            entry = await archive.export_partition(conn, partition, fmt, archive_dir)
+        async with engine.begin() as conn:
+            await detach_partition(conn, partition.name, drop=drop)
+        logger.info("Zarchiwizowano %s (%d wiadomości) do %s", partition.name, entry["rows"], entry["file"])
+    if not partitions:
+        logger.info("Brak partycji starszych niż %s", cutoff.date())
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    reindex = commands.add_parser("reindex-messages", help="Przebudowuje indeks wiadomości z Postgresa")
+    reindex.add_argument("--alias", default=MESSAGES_ALIAS)
+
+    sync = commands.add_parser("sync-users", help="Przebudowuje indeks użytkowników z Postgresa")
+    sync.add_argument("--alias", default=USERS_ALIAS)
+
+    archive_cmd = commands.add_parser("archive-messages", help="Archiwizuje zimne partycje wiadomości na dysk")
+    archive_cmd.add_argument("--older-than-months", type=int, default=12)
+    archive_cmd.add_argument("--format", choices=archive.ARCHIVE_FORMATS, default="ndjson")
+    archive_cmd.add_argument("--dir", default=archive.MESSAGES_ARCHIVE_DIR)
+    archive_cmd.add_argument("--drop", action="store_true", help="Usuwa odłączone partycje (domyślnie zostają jako osobne tabele)")
+
+    args = parser.parse_args()
+    if args.command == "reindex-messages":
+        asyncio.run(reindex_messages(args.alias))
+    elif args.command == "sync-users":
+        asyncio.run(sync_users(args.alias))
+    elif args.command == "archive-messages":
+        asyncio.run(archive_messages(args.older_than_months, args.format, args.dir, args.drop))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+import orjson
+from prometheus_client import Counter, Gauge, Histogram
+
+from app.pubsub import (
+    RedisStreamReader,
+    RedisSubscriber,
+    channel_room,
+    read_room_since,
+    redis_client,
+    room_channel,
+    room_stream,
+    stream_position,
+    stream_room,
+)
+from app.instrumentation import gauge_function
+from app.registry import RoomRegistry
+from app.wire import DEFAULT_CODEC, Frame, codec_for
+
+# Maksymalna liczba ramek czekających na wysłanie do jednego klienta
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# Co robimy z wolnym klientem, gdy jego kolejka jest pełna: "drop_oldest" albo "disconnect"
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "drop_oldest")
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_QUEUED_FRAMES = Gauge(
+    "chat_ws_outbound_queued_frames", "Liczba ramek czekających w kolejkach wychodzących WebSocketów",
+    multiprocess_mode="livesum",
+)
+OUTBOUND_MAX_QUEUE_DEPTH = Gauge(
+    "chat_ws_outbound_max_queue_depth", "Najdłuższa kolejka wychodząca spośród podłączonych WebSocketów",
+    multiprocess_mode="livemax",
+)
+ACTIVE_WEBSOCKETS = Gauge(
+    "chat_ws_active_connections", "Otwarte WebSockety na tym węźle", multiprocess_mode="livesum"
+)
+ACTIVE_ROOMS = Gauge(
+    "chat_ws_active_rooms", "Pokoje z lokalnymi połączeniami (suma po workerach węzła)", multiprocess_mode="livesum"
+)
+FRAMES_SENT = Counter("chat_ws_frames_sent_total", "Ramki wysłane do klientów WebSocket")
+BROADCAST_DURATION = Histogram(
+    "chat_ws_broadcast_seconds", "Czas rozesłania jednego zdarzenia do kolejek wszystkich połączeń pokoju",
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+DROPPED_FRAMES = Counter(
+    "chat_ws_dropped_frames_total", "Ramki odrzucone z powodu przepełnionej kolejki wychodzącej", ["policy"]
+)
+SLOW_CONSUMER_DISCONNECTS = Counter(
+    "chat_ws_slow_consumer_disconnects_total", "WebSockety rozłączone, bo nie nadążały z odbiorem"
+)
+
+
+class ClientConnection:
+    """WebSocket z ograniczoną kolejką wychodzącą i własnym zadaniem zapisującym.
+
+    `send` nigdy nie czeka na sieć - wolny klient zapełnia tylko swoją kolejkę,
+    a po jej przepełnieniu obowiązuje `overflow_policy`. Ramki są już zakodowane
+    kodekiem połączenia (`codec`): tekstowe (str) lub binarne (bytes).
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: str = None,
+        codec=DEFAULT_CODEC,
+        max_queue: int = WS_SEND_QUEUE_SIZE,
+        overflow_policy: str = WS_OVERFLOW_POLICY,
+    ):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.codec = codec
+        self.rooms: Set[str] = set()  # Pokoje, do których należy to połączenie
+        # Pokoje w trakcie odtwarzania luki po reconnect -> wstrzymane ramki na żywo (id wpisu, ramka)
+        self.replaying: Dict[str, List[Tuple[str, Frame]]] = {}
+        self.overflow_policy = overflow_policy
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.closed = False
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def send(self, message: Frame) -> bool:
+        """Wstawia ramkę do kolejki; zwraca False, jeśli klient został odrzucony"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            DROPPED_FRAMES.labels(self.overflow_policy).inc()
+            if self.overflow_policy == "disconnect":
+                SLOW_CONSUMER_DISCONNECTS.inc()
+                self.close(code=1013)  # 1013: Try Again Later
+                return False
+            self.queue.get_nowait()
+            self.queue.put_nowait(message)
+            return True
+        OUTBOUND_QUEUED_FRAMES.inc()
+        return True
+
+    def close(self, code: int = None):
+        """Zatrzymuje zadanie zapisujące; z `code` zamyka też sam WebSocket"""
+        if self.closed:
+            return
+        self.closed = True
+        OUTBOUND_QUEUED_FRAMES.dec(self.queue.qsize())
+        self.writer.cancel()
+        if code is not None:
+            asyncio.create_task(self._close_socket(code))
+
+    def close_after_flush(self, code: int):
+        """Zamyka WebSocket kodem `code` po wysłaniu ramek, które są już w kolejce"""
+        if self.closed:
+            return
+        if self.queue.full():
+            self.close(code)
+            return
+        self.queue.put_nowait(code)
+        OUTBOUND_QUEUED_FRAMES.inc()
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _write_loop(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                OUTBOUND_QUEUED_FRAMES.dec()
+                if isinstance(message, int):
+                    # Kod zamknięcia wstawiony przez `close_after_flush`
+                    self.closed = True
+                    OUTBOUND_QUEUED_FRAMES.dec(self.queue.qsize())
+                    await self._close_socket(message)
+                    return
+                if isinstance(message, bytes):
+                    await self.websocket.send_bytes(message)
+                else:
+                    await self.websocket.send_text(message)
+                FRAMES_SENT.inc()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Klient się rozłączył - dalsze ramki nie mają dokąd trafić
+            self.closed = True
+            OUTBOUND_QUEUED_FRAMES.dec(self.queue.qsize())
+
+
+class ConnectionManager:
+    """Zarządza połączeniami WebSocket i wspólnym (jednym na proces) nasłuchem Redis.
+
+    Jeden WebSocket może należeć do wielu pokojów (`join` / `leave`), więc klient
+    obserwujący wiele czatów potrzebuje tylko jednego połączenia. Wiadomości
+    przychodzą ze strumieni Redis pokojów (z możliwością wznowienia od `last_id`),
+    ulotne zdarzenia (np. "pisze...") z kanałów pub/sub.
+
+    Stan pokojów jest lokalny tylko w zakresie własnych połączeń - każdy worker
+    czyta strumienie swoich pokojów, więc klienci pokoju mogą być podłączeni do
+    różnych workerów i podów bez sticky sessions. `registry` publikuje w Redisie,
+    które pokoje mają słuchaczy na tym węźle.
+    """
+
+    def __init__(self):
+        self.rooms: Dict[str, Set[WebSocket]] = {}  # Przechowuje połączenia WebSocket dla każdego pokoju
+        self.connections: Dict[WebSocket, ClientConnection] = {}  # Kolejki wychodzące poszczególnych WebSocketów
+        self.users: Dict[str, Set[WebSocket]] = {}  # Połączenia każdego użytkownika
+        self.subscriber = RedisSubscriber(redis_client, self.on_redis_message)  # Subskrybuje tylko pokoje z lokalnymi połączeniami
+        self.streams = RedisStreamReader(redis_client, self.on_stream_entry)
+        self.registry = RoomRegistry(lambda: list(self.rooms))
+        gauge_function(OUTBOUND_MAX_QUEUE_DEPTH, self.max_queue_depth)
+        gauge_function(ACTIVE_WEBSOCKETS, lambda: len(self.connections))
+        gauge_function(ACTIVE_ROOMS, lambda: len(self.rooms))
+
+    async def accept(self, websocket: WebSocket, user_id: str = None, subprotocol: Optional[str] = None):
+        """Akceptuje WebSocket (z wynegocjowanym podprotokołem) i tworzy jego kolejkę wychodzącą"""
+        await websocket.accept(subprotocol=subprotocol)
+        self.connections[websocket] = ClientConnection(websocket, user_id, codec_for(subprotocol))
+        if user_id is not None:
+            self.users.setdefault(user_id, set()).add(websocket)
+
+    async def join(self, chat_id: str, websocket: WebSocket, last_id: Optional[str] = None) -> bool:
+        """Dodaje zaakceptowany WebSocket do pokoju.
+
+        Z `last_id` najpierw odtwarza ze strumienia wpisy nowsze niż `last_id`, a dopiero
+        potem przepuszcza ramki na żywo. Zwraca False, jeśli luki nie dało się odtworzyć
+        (klient powinien wtedy pobrać historię z `get_chat_history`).
+        """
+        connection = self.connections.get(websocket)
+        if connection is None:
+            return True
+        connection.rooms.add(chat_id)
+        if last_id is not None:
+            connection.replaying[chat_id] = []
+        if chat_id not in self.rooms:
+            self.rooms[chat_id] = set()
+            self.registry.room_joined(chat_id)
+            await self.subscriber.subscribe(room_channel(chat_id))
+        self.rooms[chat_id].add(websocket)
+        await self.streams.add(room_stream(chat_id))
+        if last_id is None:
+            return True
+        return await self._replay(chat_id, connection, last_id)
+
+    async def _replay(self, chat_id: str, connection: ClientConnection, last_id: str) -> bool:
+        entries = await read_room_since(chat_id, last_id)
+        live = connection.replaying.pop(chat_id, [])
+        last = last_id
+        for entry_id, data in entries or ():
+            connection.send(connection.codec.encode(_stream_event(entry_id, data)))
+            last = entry_id
+        for entry_id, frame in live:
+            if entries is None or stream_position(entry_id) > stream_position(last):
+                connection.send(frame)
+        return entries is not None
+
+    async def leave(self, chat_id: str, websocket: WebSocket):
+        """Usuwa WebSocket z pokoju"""
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.rooms.discard(chat_id)
+            connection.replaying.pop(chat_id, None)
+        if chat_id in self.rooms:
+            self.rooms[chat_id].discard(websocket)
+            if not self.rooms[chat_id]:  # Jeśli pokój jest pusty, przestajemy czytać jego strumień i kanał
+                del self.rooms[chat_id]
+                self.registry.room_left(chat_id)
+                self.streams.remove(room_stream(chat_id))
+                await self.subscriber.unsubscribe(room_channel(chat_id))
+
+    async def close(self, websocket: WebSocket):
+        """Usuwa WebSocket ze wszystkich pokojów i zatrzymuje jego kolejkę"""
+        connection = self.connections.get(websocket)
+        if connection is None:
+            return
+        for chat_id in list(connection.rooms):
+            await self.leave(chat_id, websocket)
+        del self.connections[websocket]
+        connection.close()
+        if connection.user_id in self.users:
+            self.users[connection.user_id].discard(websocket)
+            if not self.users[connection.user_id]:
+                del self.users[connection.user_id]
+
+    async def connect(self, chat_id: str, websocket: WebSocket, user_id: str = None):
+        """Akceptuje WebSocket obsługujący jeden pokój"""
+        await self.accept(websocket, user_id)
+        await self.join(chat_id, websocket)
+
+    async def disconnect(self, chat_id: str, websocket: WebSocket):
+        """Usuwa WebSocket z listy aktywnych połączeń"""
+        await self.close(websocket)
+
+    def user_rooms(self, user_id: str) -> Set[str]:
+        """Pokoje, które użytkownik obserwuje na tym węźle"""
+        return {chat_id for websocket in self.users.get(user_id, ()) for chat_id in self.connections[websocket].rooms}
+
+    def send(self, websocket: WebSocket, event: dict):
+        """Wstawia zdarzenie do kolejki jednego WebSocketu (np. odpowiedź na ramkę sterującą)"""
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.send(connection.codec.encode(event))
+
+    def broadcast(self, chat_id: str, event: dict, entry_id: Optional[str] = None):
+        """Wstawia zdarzenie do kolejek wszystkich użytkowników w pokoju.
+
+        Zdarzenie jest kodowane raz na kodek, a nie raz na połączenie.
+        """
+        started = time.perf_counter()
+        encoded: Dict[str, Frame] = {}
+        for websocket in list(self.rooms.get(chat_id, ())):
+            connection = self.connections.get(websocket)
+            if connection is None:
+                continue
+            codec = connection.codec
+            message = encoded.get(codec.name)
+            if message is None:
+                message = encoded[codec.name] = codec.encode(event)
+            if entry_id is not None and chat_id in connection.replaying:
+                # Wyślemy po odtworzeniu luki, z pominięciem duplikatów
+                connection.replaying[chat_id].append((entry_id, message))
+            elif not connection.send(message):
+                # Wolny lub rozłączony klient - nie rozsyłamy mu kolejnych ramek
+                self.rooms[chat_id].discard(websocket)
+        BROADCAST_DURATION.observe(time.perf_counter() - started)
+
+    async def on_redis_message(self, channel: str, data: str):
+        """Przekazuje wiadomość z kanału Redis do lokalnych połączeń pokoju"""
+        self.broadcast(channel_room(channel), orjson.loads(data))
+
+    async def on_stream_entry(self, stream: str, entry_id: str, data: str):
+        """Przekazuje wpis ze strumienia pokoju do lokalnych połączeń"""
+        self.broadcast(stream_room(stream), _stream_event(entry_id, data), entry_id)
+
+    async def drain(self, reconnect_min_ms: int, reconnect_max_ms: int, timeout: float):
+        """Prosi wszystkich klientów o ponowne połączenie (w losowym czasie) i zamyka ich WebSockety.
+
+        Rozrzut `after_ms` sprawia, że klienci nie łączą się z pozostałymi węzłami
+        naraz. Połączenia, które nie opróżnią kolejki w `timeout`, są zamykane od razu.
+        """
+        connections = list(self.connections.values())
+        for connection in connections:
+            after_ms = random.randint(reconnect_min_ms, reconnect_max_ms)
+            connection.send(connection.codec.encode({"type": "reconnect", "after_ms": after_ms}))
+            connection.close_after_flush(1012)  # 1012: Service Restart
+        writers = [connection.writer for connection in connections if not connection.writer.done()]
+        if writers:
+            await asyncio.wait(writers, timeout=timeout)
+        for connection in connections:
+            connection.close(code=1012)
+
+    def max_queue_depth(self) -> int:
+        return max((c.queue.qsize() for c in self.connections.values()), default=0)
+
+
+def _stream_event(entry_id: str, data: str) -> dict:
+    """Dokleja do zdarzenia id wpisu strumienia, od którego klient może wznowić połączenie"""
+    event = orjson.loads(data)
+    event["stream_id"] = entry_id
+    return event
+
+
+manager = ConnectionManager()
@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aioredis.exceptions import RedisError, WatchError
+from prometheus_client import Counter
+
+from app.pubsub import redis_client
+
+# Ile najnowszych wiadomości każdego czatu trzymamy w Redisie i jak długo
+HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", "50"))
+HISTORY_CACHE_TTL = int(os.getenv("HISTORY_CACHE_TTL", "3600"))
+
+HISTORY_CACHE_HITS = Counter("chat_history_cache_hits_total", "Historia czatu obsłużona z Redisa")
+HISTORY_CACHE_MISSES = Counter("chat_history_cache_misses_total", "Historia czatu pobrana z Postgresa")
+HISTORY_CACHE_ERRORS = Counter("chat_history_cache_errors_total", "Błędy Redisa przy odczycie historii (odczyt z Postgresa)")
+
+logger = logging.getLogger(__name__)
+
+Position = Tuple[datetime, int]
+# loader(limit, before, after) -> wiadomości od najnowszej, jak w `get_chat_history`
+Loader = Callable[[int, Optional[Position], Optional[Position]], Awaitable[List[dict]]]
+
+
+def history_key(chat_id) -> str:
+    return f"chat_history:{chat_id}"
+
+
+def version_key(chat_id) -> str:
+    return f"chat_history_version:{chat_id}"
+
+
+def position(message: dict) -> Position:
+    return datetime.fromisoformat(message["timestamp"]), message["id"]
+
+
+async def append(messages: List[dict]):
+    """Write-through: dopisuje zapisane w bazie wiadomości do list czatów, które są w cache"""
+    by_chat: Dict[int, List[dict]] = defaultdict(list)
+    for message in messages:
+        by_chat[message["chat_id"]].append(message)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for chat_id, chat_messages in by_chat.items():
+            chat_messages.sort(key=position)
+            # Zmiana wersji unieważnia trwające w tym czasie wypełnianie listy z bazy
+            pipe.incr(version_key(chat_id))
+            pipe.expire(version_key(chat_id), HISTORY_CACHE_TTL)
+            # LPUSHX - zimnych czatów nie zaczynamy od niepełnej listy
+            for message in chat_messages:
+                pipe.lpushx(history_key(chat_id), json.dumps(_entry(message)))
+            pipe.ltrim(history_key(chat_id), 0, HISTORY_CACHE_SIZE - 1)
+        await pipe.execute()
+
+
+async def get_history(chat_id: int, limit: int, before: Optional[Position], after: Optional[Position], load: Loader) -> List[dict]:
+    """Zwraca okno historii z Redisa, jeśli się w nim mieści; w przeciwnym razie (także gdy Redis nie działa) z `load`"""
+    try:
+        cached = await redis_client.lrange(history_key(chat_id), 0, -1)
+    except RedisError:
+        logger.exception("Nie udało się odczytać historii czatu %s z Redisa", chat_id)
+        HISTORY_CACHE_ERRORS.inc()
+        return await load(limit, before, after)
+    if cached:
+        window = _select_window([json.loads(m) for m in cached], limit, before, after)
+        if window is not None:
+            HISTORY_CACHE_HITS.inc()
+            return window
+    HISTORY_CACHE_MISSES.inc()
+
+    if before is None and after is None and limit <= HISTORY_CACHE_SIZE:
+        return (await _fill(chat_id, load))[:limit]
+    return await load(limit, before, after)
+
+
+async def _fill(chat_id: int, load: Loader) -> List[dict]:
+    """Wypełnia listę czatu z bazy, chyba że w międzyczasie doszła nowa wiadomość.
+
+    Wersję czytamy przed zapytaniem do bazy, a WATCH/MULTI robimy dopiero po nim,
+    więc połączenie z puli Redisa nie czeka na Postgresa.
+    """
+    try:
+        version = await redis_client.get(version_key(chat_id))
+    except RedisError:
+        logger.exception("Nie udało się odczytać wersji historii czatu %s", chat_id)
+        HISTORY_CACHE_ERRORS.inc()
+        return await load(HISTORY_CACHE_SIZE, None, None)
+    messages = await load(HISTORY_CACHE_SIZE, None, None)
+    if not messages:
+        return messages
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            await pipe.watch(version_key(chat_id))
+            if await pipe.get(version_key(chat_id)) != version:
+                return messages
+            pipe.multi()
+            pipe.delete(history_key(chat_id))
+            pipe.rpush(history_key(chat_id), *(json.dumps(_entry(m)) for m in messages))
+            pipe.expire(history_key(chat_id), HISTORY_CACHE_TTL)
+            await pipe.execute()
+    except WatchError:
+        pass
+    except RedisError:
+        logger.exception("Nie udało się zapisać historii czatu %s w Redisie", chat_id)
+        HISTORY_CACHE_ERRORS.inc()
+    return messages
+
+
+def _select_window(cached: List[dict], limit: int, before: Optional[Position], after: Optional[Position]) -> Optional[List[dict]]:
+    """Wybiera okno z listy (od najnowszej) lub None, jeśli lista go nie obejmuje"""
+    cached.sort(key=position, reverse=True)
+    # Krótsza lista niż limit oznacza, że zawiera całą historię czatu
+    complete = len(cached) < HISTORY_CACHE_SIZE
+    if after is not None:
+        if not complete and position(cached[-1]) > after:
+            return None
+        return [m for m in cached if position(m) > after][-limit:]
+    older = [m for m in cached if before is None or position(m) < before]
+    if len(older) >= limit:
+        return older[:limit]
+    return older if complete else None
+
+
+def _entry(message: dict) -> dict:
+    return {
+        "id": message["id"],
+        "sender": message["sender"],
+        "content": message["content"],
+        "timestamp": message["timestamp"],
+    }
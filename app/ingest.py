@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from datetime import datetime
+from typing import Deque, List, Optional, Tuple
+
+import orjson
+from prometheus_client import Counter, Histogram
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app import history_cache, unread
+from app.database import engine
+from app.pubsub import publish_to_room, redis_client
+from app.search import index_message
+
+# "publish" - potwierdzenie (publikacja) od razu, zapis do bazy w tle
+# "persist" - publikacja dopiero po zapisaniu partii w bazie
+MESSAGE_DURABILITY = os.getenv("MESSAGE_DURABILITY", "publish")
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_FLUSH_INTERVAL_MS = int(os.getenv("INGEST_FLUSH_INTERVAL_MS", "50"))
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "20000"))
+INGEST_ID_BLOCK_SIZE = int(os.getenv("INGEST_ID_BLOCK_SIZE", "1000"))
+# Po tylu odrzuceniach wiersza przez bazę (błąd danych, brak partycji) trafia on do dead letter
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+INGEST_DEAD_LETTER_KEY = "ingest_dead_letter"
+INGEST_DEAD_LETTER_MAX = int(os.getenv("INGEST_DEAD_LETTER_MAX", "10000"))
+
+MESSAGE_COLUMNS = ["id", "chat_id", "sender", "content", "timestamp"]
+
+logger = logging.getLogger(__name__)
+
+MESSAGES_RECEIVED = Counter("chat_messages_received_total", "Wiadomości przyjęte od klientów")
+BATCH_WRITE_DURATION = Histogram(
+    "chat_db_commit_seconds", "Czas zapisu (COPY) jednej partii wiadomości w Postgresie",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+MESSAGES_DEAD_LETTERED = Counter("chat_messages_dead_lettered_total", "Opublikowane wiadomości, których nie udało się zapisać")
+
+Row = Tuple[int, int, str, str, datetime]
+# (wiersz, id nadawcy, future oczekującego na zapis w trybie "persist", liczba odrzuceń wiersza)
+Entry = Tuple[Row, Optional[str], Optional[asyncio.Future], int]
+
+
+class MessageIngestPipeline:
+    """Przyjmuje wiadomości z WebSocketów, publikuje je i zapisuje do Postgresa partiami.
+
+    Id i znacznik czasu są nadawane od razu (id rezerwowane blokami z sekwencji
+    `messages`), więc wiadomość można opublikować przed zapisem. Partie są
+    zapisywane przez COPY asyncpg, gdy osiągną `batch_size` albo po `flush_interval`.
+
+    Partia odrzucona przez bazę z powodu danych jest ponawiana wiersz po wierszu,
+    a wiersz odrzucony INGEST_MAX_ATTEMPTS razy trafia do dead letter (log i lista
+    w Redisie). Błędy połączenia ponawiamy bez limitu - bufor ogranicza `max_pending`.
+    """
+
+    def __init__(
+        self,
+        db_engine: AsyncEngine = engine,
+        durability: str = MESSAGE_DURABILITY,
+        batch_size: int = INGEST_BATCH_SIZE,
+        flush_interval: float = INGEST_FLUSH_INTERVAL_MS / 1000,
+        max_pending: int = INGEST_MAX_PENDING,
+    ):
+        if durability not in ("publish", "persist"):
+            raise ValueError(f"Nieznany tryb trwałości: {durability}")
+        self.engine = db_engine
+        self.durability = durability
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer: List[Entry] = []
+        self._ids: Deque[int] = deque()
+        self._id_lock = asyncio.Lock()
+        self._flush_now = asyncio.Event()
+        self._space = asyncio.Semaphore(max_pending)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Zatrzymuje pętlę i zapisuje wszystko, co zostało w buforze"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self.buffer:
+            if not await self.flush():
+                break
+
+    async def submit(self, chat_id: int, sender: str, content: str, sender_id: Optional[str] = None) -> dict:
+        """Przyjmuje wiadomość i zwraca jej payload zgodnie z trybem trwałości.
+
+        Zgłasza wyjątek, jeśli wiadomości nie udało się opublikować (tryb "publish")
+        albo zapisać (tryb "persist") - wywołujący odsyła wtedy klientowi błąd.
+        """
+        MESSAGES_RECEIVED.inc()
+        try:
+            message_id = await self._next_id()
+        except Exception:
+            logger.exception("Nie udało się zarezerwować id wiadomości")
+            raise
+        timestamp = datetime.utcnow()
+        payload = {
+            "id": message_id,
+            "chat_id": chat_id,
+            "sender": sender,
+            "content": content,
+            "timestamp": timestamp.isoformat(),
+        }
+        row = (message_id, chat_id, sender, content, timestamp)
+
+        await self._space.acquire()
+        if self.durability == "persist":
+            persisted = asyncio.get_running_loop().create_future()
+            self._enqueue(row, sender_id, persisted)
+            # Błąd zapisu partii (zalogowany w `flush`) trafia do wywołującego
+            await persisted
+            try:
+                await publish_to_room(chat_id, orjson.dumps(payload))
+            except Exception:
+                logger.exception("Wiadomość %d zapisana, ale nie opublikowana w czacie %s", message_id, chat_id)
+                raise
+        else:
+            try:
+                await publish_to_room(chat_id, orjson.dumps(payload))
+            except Exception:
+                # Wiadomość nie trafi ani do odbiorców, ani do bazy - zwalniamy miejsce w buforze
+                self._space.release()
+                logger.exception("Nie udało się opublikować wiadomości %d w czacie %s", message_id, chat_id)
+                raise
+            self._enqueue(row, sender_id, None)
+        return payload
+
+    def _enqueue(self, row: Row, sender_id: Optional[str], persisted: Optional[asyncio.Future]):
+        self.buffer.append((row, sender_id, persisted, 0))
+        if len(self.buffer) >= self.batch_size:
+            self._flush_now.set()
+
+    async def _next_id(self) -> int:
+        if not self._ids:
+            async with self._id_lock:
+                if not self._ids:
+                    async with self.engine.connect() as conn:
+                        result = await conn.execute(
+                            text("SELECT nextval(pg_get_serial_sequence('messages', 'id')) FROM generate_series(1, :n)"),
+                            {"n": INGEST_ID_BLOCK_SIZE},
+                        )
+                        self._ids.extend(row[0] for row in result)
+        return self._ids.popleft()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            while self.buffer:
+                if not await self.flush():
+                    await asyncio.sleep(self.flush_interval)
+                    break
+
+    async def flush(self) -> bool:
+        """Zapisuje jedną partię; zwraca False, jeśli zapis się nie powiódł"""
+        # Wiersze z odrzuconej partii zapisujemy pojedynczo, żeby jeden nie blokował pozostałych
+        size = 1 if self.buffer and self.buffer[0][3] else self.batch_size
+        batch, self.buffer = self.buffer[:size], self.buffer[size:]
+        if not batch:
+            return True
+        rows = [row for row, _, _, _ in batch]
+        try:
+            with BATCH_WRITE_DURATION.time():
+                async with self.engine.connect() as conn:
+                    raw = await conn.get_raw_connection()
+                    await raw.driver_connection.copy_records_to_table("messages", records=rows, columns=MESSAGE_COLUMNS)
+        except Exception as e:
+            logger.exception("Nie udało się zapisać partii %d wiadomości", len(rows))
+            # Klasy 22 (dane) i 23 (ograniczenia, także brak partycji) dotyczą wierszy, nie połączenia
+            rejected = getattr(e, "sqlstate", None) is not None and e.sqlstate[:2] in ("22", "23")
+            # Wiadomości już opublikowane ponawiamy; czekający na zapis dostają błąd
+            retry, dead = [], []
+            for row, sender_id, persisted, attempts in batch:
+                attempts += 1 if rejected else 0
+                if persisted is not None:
+                    if not persisted.done():
+                        persisted.set_exception(e)
+                    self._space.release()
+                elif attempts >= INGEST_MAX_ATTEMPTS:
+                    dead.append(row)
+                    self._space.release()
+                else:
+                    retry.append((row, sender_id, None, attempts))
+            self.buffer[:0] = retry
+            if dead:
+                await self._dead_letter(dead, e)
+            return False
+
+        for _, _, persisted, _ in batch:
+            if persisted is not None and not persisted.done():
+                persisted.set_result(None)
+            self._space.release()
+        messages = [dict(zip(MESSAGE_COLUMNS, row), timestamp=row[4].isoformat()) for row in rows]
+        try:
+            await history_cache.append(messages)
+        except Exception:
+            logger.exception("Nie udało się dopisać wiadomości do cache historii")
+        try:
+            await unread.record_messages(zip(messages, (sender_id for _, sender_id, _, _ in batch)))
+        except Exception:
+            logger.exception("Nie udało się zaktualizować liczników nieprzeczytanych")
+        # Indeksowanie w Elasticsearch poza ścieżką dostarczania wiadomości (bufor `_bulk`)
+        for row in rows:
+            await index_message(*row)
+        return True
+
+    async def _dead_letter(self, rows: List[Row], error: Exception):
+        MESSAGES_DEAD_LETTERED.inc(len(rows))
+        entries = [
+            orjson.dumps({**dict(zip(MESSAGE_COLUMNS, row)), "timestamp": row[4].isoformat(), "error": str(error)})
+            for row in rows
+        ]
+        for entry in entries:
+            logger.error("Porzucono wiadomość po %d próbach zapisu: %s", INGEST_MAX_ATTEMPTS, entry.decode())
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.lpush(INGEST_DEAD_LETTER_KEY, *entries)
+                pipe.ltrim(INGEST_DEAD_LETTER_KEY, 0, INGEST_DEAD_LETTER_MAX - 1)
+                await pipe.execute()
+        except Exception:
+            logger.exception("Nie udało się zapisać porzuconych wiadomości w Redisie")
+
+
+ingest_pipeline = MessageIngestPipeline()
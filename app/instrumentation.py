@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, List, Tuple
+
+from prometheus_client import Gauge, Histogram
+
+# Przy kilku workerach uvicorna każdy proces zapisuje metryki do plików w tym katalogu,
+# a /metrics je agreguje (katalog musi być czyszczony przy starcie kontenera)
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+MULTIPROCESS = bool(PROMETHEUS_MULTIPROC_DIR)
+# Co ile odświeżamy gauge liczone funkcją w trybie wieloprocesowym
+METRICS_SAMPLE_INTERVAL = float(os.getenv("METRICS_SAMPLE_INTERVAL", "5"))
+
+logger = logging.getLogger(__name__)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "chat_http_request_duration_seconds",
+    "Czas obsługi żądań HTTP",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+# Etykiety spoza tych zbiorów sklejamy, by liczba serii była ograniczona
+HTTP_METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"}
+UNMATCHED_ROUTE = "<unmatched>"
+
+_sampled: List[Tuple[Gauge, Callable[[], float]]] = []
+
+
+def gauge_function(gauge: Gauge, fn: Callable[[], float]):
+    """Jak `Gauge.set_function`, ale działa też w trybie wieloprocesowym.
+
+    Tam `set_function` jest ignorowane, więc wartość odświeża `sample_gauges_periodically`.
+    """
+    if MULTIPROCESS:
+        _sampled.append((gauge, fn))
+    else:
+        gauge.set_function(fn)
+
+
+async def sample_gauges_periodically():
+    while True:
+        for gauge, fn in _sampled:
+            try:
+                gauge.set(fn())
+            except Exception:
+                logger.exception("Nie udało się odczytać wartości metryki")
+        await asyncio.sleep(METRICS_SAMPLE_INTERVAL)
+
+
+class PrometheusMiddleware:
+    """Mierzy czas żądań HTTP per szablon trasy (np. /api/chat/chats/{chat_id}/messages)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # FastAPI zapisuje dopasowaną trasę w scope podczas routingu
+            route = scope.get("route")
+            method = scope["method"] if scope["method"] in HTTP_METHODS else "OTHER"
+            HTTP_REQUEST_DURATION.labels(
+                method, getattr(route, "path", UNMATCHED_ROUTE), str(status)
+            ).observe(time.perf_counter() - started)
@@ -0,0 +1,153 @@
+"""Start i zatrzymanie procesu przy wdrożeniach kroczących.
+
+Start: czekanie na zależności z wykładniczym odstępem, DDL tylko gdy baza nie
+jest na głowie migracji Alembica i rozgrzanie pul połączeń. Zatrzymanie
+(SIGTERM): węzeł przestaje być gotowy, odrzuca nowe WebSockety i prosi
+podłączonych klientów o ponowne połączenie z rozrzutem w czasie, a dopiero
+potem oddaje sterowanie uvicornowi.
+"""
+import asyncio
+import logging
+import os
+import random
+import signal
+import time
+from typing import Awaitable, Callable, Dict
+
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import text
+
+from app.connections import manager
+from app.database import DB_POOL_SIZE, engine, replica_engine
+from app.pubsub import redis_client
+from app.search import es_client
+
+ALEMBIC_CONFIG = os.getenv("ALEMBIC_CONFIG", "alembic.ini")
+# Łączny czas oczekiwania na Postgresa, Redisa i Elasticsearch przy starcie
+STARTUP_DEPENDENCY_TIMEOUT = float(os.getenv("STARTUP_DEPENDENCY_TIMEOUT", "60"))
+STARTUP_BACKOFF_MAX = float(os.getenv("STARTUP_BACKOFF_MAX", "5"))
+# Ile połączeń otwieramy w każdej puli przed przyjęciem ruchu
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", str(min(DB_POOL_SIZE, 5))))
+# Czas między zgłoszeniem braku gotowości a rozłączaniem klientów (load balancer zdejmuje węzeł)
+DRAIN_READINESS_DELAY = float(os.getenv("DRAIN_READINESS_DELAY", "5"))
+# Zakres opóźnienia ponownego połączenia podawanego klientom w ramce "reconnect"
+DRAIN_RECONNECT_MIN_MS = int(os.getenv("DRAIN_RECONNECT_MIN_MS", "500"))
+DRAIN_RECONNECT_MAX_MS = int(os.getenv("DRAIN_RECONNECT_MAX_MS", "15000"))
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "10"))
+
+logger = logging.getLogger(__name__)
+
+
+class State:
+    """Stan procesu widoczny dla endpointów zdrowia i nowych WebSocketów"""
+
+    def __init__(self):
+        self.ready = False
+        self.draining = False
+
+
+state = State()
+
+
+async def _check_postgres():
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
+async def _check_redis():
+    await redis_client.ping()
+
+
+async def _check_elasticsearch():
+    if not await es_client.ping():
+        raise ConnectionError("Elasticsearch nie odpowiada")
+
+
+DEPENDENCIES: Dict[str, Callable[[], Awaitable]] = {
+    "postgres": _check_postgres,
+    "redis": _check_redis,
+    "elasticsearch": _check_elasticsearch,
+}
+
+
+async def wait_for(name: str, check: Callable[[], Awaitable], timeout: float = STARTUP_DEPENDENCY_TIMEOUT):
+    """Powtarza `check` z wykładniczym odstępem (z rozrzutem) aż do skutku albo `timeout`"""
+    deadline = time.monotonic() + timeout
+    delay = 0.1
+    while True:
+        try:
+            await check()
+            return
+        except Exception as e:
+            if time.monotonic() + delay > deadline:
+                raise RuntimeError(f"{name} niedostępny po {timeout:.0f} s") from e
+            logger.info("Czekam na %s (%s), ponowienie za %.1f s", name, e, delay)
+        await asyncio.sleep(delay)
+        delay = min(STARTUP_BACKOFF_MAX, delay * 2) * random.uniform(0.8, 1.2)
+
+
+async def wait_for_dependencies():
+    """Czeka równolegle na wszystkie zależności"""
+    await asyncio.gather(*(wait_for(name, check) for name, check in DEPENDENCIES.items()))
+
+
+async def schema_at_head() -> bool:
+    """Czy baza ma już zastosowane wszystkie migracje Alembica"""
+    heads = set(ScriptDirectory.from_config(Config(ALEMBIC_CONFIG)).get_heads())
+    async with engine.connect() as conn:
+        current = await conn.run_sync(lambda sync_conn: set(MigrationContext.configure(sync_conn).get_current_heads()))
+    return current == heads
+
+
+async def warm_up():
+    """Otwiera po WARMUP_CONNECTIONS połączeń w pulach Postgresa (główna i replika) i Redisa"""
+
+    async def postgres(db_engine):
+        async with db_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    engines = {engine, replica_engine}
+    await asyncio.gather(
+        *(postgres(db_engine) for db_engine in engines for _ in range(WARMUP_CONNECTIONS)),
+        *(redis_client.ping() for _ in range(WARMUP_CONNECTIONS)),
+    )
+
+
+async def drain():
+    """Zdejmuje węzeł z ruchu i rozłącza klientów WebSocket"""
+    state.draining = True
+    logger.info("Zatrzymywanie: %d WebSocketów do rozłączenia", len(manager.connections))
+    try:
+        await asyncio.sleep(DRAIN_READINESS_DELAY)
+        await manager.drain(DRAIN_RECONNECT_MIN_MS, DRAIN_RECONNECT_MAX_MS, DRAIN_TIMEOUT)
+    except Exception:
+        logger.exception("Błąd rozłączania klientów")
+
+
+def install_drain_handler():
+    """Przejmuje SIGTERM: najpierw `drain`, potem zwykłe zamknięcie uvicorna.
+
+    Uvicorn po SIGTERM od razu zamyka wszystkie WebSockety, więc opróżnianie musi
+    nastąpić wcześniej. Drugi SIGTERM trafia już bezpośrednio do uvicorna.
+    """
+    loop = asyncio.get_running_loop()
+    previous = signal.getsignal(signal.SIGTERM) or signal.SIG_DFL
+
+    def stop_server(_task):
+        if callable(previous):
+            previous(signal.SIGTERM, None)
+        else:
+            signal.raise_signal(signal.SIGTERM)
+
+    def on_sigterm():
+        loop.remove_signal_handler(signal.SIGTERM)
+        signal.signal(signal.SIGTERM, previous)
+        asyncio.create_task(drain()).add_done_callback(stop_server)
+
+    try:
+        loop.add_signal_handler(signal.SIGTERM, on_sigterm)
+    except (NotImplementedError, RuntimeError, ValueError):
+        # Np. Windows albo pętla poza głównym wątkiem - zostaje zwykłe zamknięcie
+        logger.warning("Nie można przejąć SIGTERM - klienci zostaną rozłączeni bez opróżniania")
@@ -1,55 +1,80 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
 from app.database import engine
+from app.lifecycle import install_drain_handler, schema_at_head, state, wait_for_dependencies, warm_up
 from app.models import Base
-from app.routers import chat, users, auth, metrics
-from elasticsearch import AsyncElasticsearch
+from app.pubsub import redis_client
+from app.connections import manager
+from app.ingest import ingest_pipeline
+from app.profiles import profile_service
+from app.presence import presence
+from app.search import bulk_indexer, es_client, ensure_messages_index, ensure_users_index, rollover_messages_periodically
+from app.user_search import user_directory
+from app.ratelimit import rate_limiter
+from app.partitions import ensure_partitions, maintain_partitions_periodically
+from app.instrumentation import MULTIPROCESS, PrometheusMiddleware, sample_gauges_periodically
+from app.routers import chat, users, auth, metrics, health
+from app.routers.auth import public_keys
+from prometheus_client import multiprocess
 import asyncio
-
-es = AsyncElasticsearch(hosts=["http://elasticsearch:9200"])
-
-
-async def wait_for_elasticsearch(es_client, timeout: int = 60):
-    for i in range(timeout):
-        try:
-            if await es_client.ping():
-                return True
-        except Exception:
-            pass
-        await asyncio.sleep(1)
-    return False
+import os
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: tworzymy tabele w bazie danych
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    if not await wait_for_elasticsearch(es):
-        raise Exception("Elasticsearch is not available after waiting")
-
-    index_name = "users"
-    # Sprawdzamy, czy indeks już istnieje
-    if not await es.indices.exists(index=index_name):
-        await es.indices.create(
-            index=index_name,
-            body={
-                "settings": {
-                    "number_of_shards": 1,
-                    "number_of_replicas": 0,
-                },
-                "mappings": {
-                    "properties": {
-                        "username": {"type": "text"},
-                    }
-                },
-            },
-        )
+    await wait_for_dependencies()
+    # Schemat tworzy `alembic upgrade head`; create_all zostaje dla baz bez migracji (środowisko deweloperskie)
+    if not await schema_at_head():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    # Partycje wiadomości na bieżący i kolejne miesiące (przed przyjęciem pierwszych wiadomości)
+    await ensure_partitions()
+    await ensure_users_index()
+    await ensure_messages_index()
+    # Klucze JWKS przed przyjęciem pierwszych połączeń, dalej odświeżane w tle
+    await public_keys.start()
+    rollover_task = asyncio.create_task(rollover_messages_periodically())
+    partitions_task = asyncio.create_task(maintain_partitions_periodically())
+    bulk_indexer.start()
+    ingest_pipeline.start()
+    presence.start()
+    user_directory.start()
+    manager.registry.start()
+    rate_limiter.start()
+    sampling_task = asyncio.create_task(sample_gauges_periodically()) if MULTIPROCESS else None
+    await warm_up()
+    install_drain_handler()
+    state.ready = True
     yield
-    # Możesz tu dodać kod wykonywany przy zamykaniu aplikacji, np. czyszczenie zasobów
+    # Klienci WebSocket zostali już rozłączeni w `drain` (SIGTERM)
+    state.ready = False
+    rollover_task.cancel()
+    partitions_task.cancel()
+    if sampling_task is not None:
+        sampling_task.cancel()
+    # Zamykanie: dopisujemy zaległe wiadomości i dokumenty, potem wspólny nasłuch i pula połączeń Redis
+    await ingest_pipeline.stop()
+    await bulk_indexer.stop()
+    await presence.stop()
+    await user_directory.stop()
+    await rate_limiter.stop()
+    await public_keys.stop()
+    await manager.subscriber.stop()
+    await manager.streams.stop()
+    await manager.registry.stop()
+    await profile_service.close()
+    await redis_client.close()
+    await redis_client.connection_pool.disconnect()
+    await es_client.close()
+    if MULTIPROCESS:
+        # Gauge "live*" tego procesu przestają być liczone
+        multiprocess.mark_process_dead(os.getpid())
 
 
-app = FastAPI(lifespan=lifespan)
+# Odpowiedzi REST serializowane przez orjson
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(PrometheusMiddleware)
 
 # Importujemy routery
 app.include_router(chat.router)
@@ -57,3 +82,4 @@ app.include_router(chat.ws_router)
 app.include_router(users.router)
 app.include_router(auth.router)
 app.include_router(metrics.router)
+app.include_router(health.router)
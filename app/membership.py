@@ -0,0 +1,120 @@
+import logging
+import os
+from typing import Iterable, Set
+
+from fastapi import Depends, HTTPException
+from sqlalchemy import exists, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.cache import TTLCache
+from app.database import SessionLocal, get_db
+from app.models import user_chat_association
+from app.pubsub import redis_client
+from app.routers.auth import verify_token
+
+# Pamiętamy tylko potwierdzone członkostwa - nowi uczestnicy nie czekają na wygaśnięcie cache
+MEMBERSHIP_LOCAL_CACHE_SIZE = int(os.getenv("MEMBERSHIP_LOCAL_CACHE_SIZE", "100000"))
+MEMBERSHIP_LOCAL_CACHE_TTL = int(os.getenv("MEMBERSHIP_LOCAL_CACHE_TTL", "60"))
+MEMBERSHIP_REDIS_TTL = int(os.getenv("MEMBERSHIP_REDIS_TTL", "3600"))
+
+logger = logging.getLogger(__name__)
+
+local_memberships = TTLCache(MEMBERSHIP_LOCAL_CACHE_SIZE, MEMBERSHIP_LOCAL_CACHE_TTL)
+local_chat_members = TTLCache(MEMBERSHIP_LOCAL_CACHE_SIZE, MEMBERSHIP_LOCAL_CACHE_TTL)
+
+# `chat_members:{id}` to zawsze pełna lista z bazy - nowych uczestników dopisujemy
+# tylko do już wypełnionego zbioru. KEYS[1] - zbiór, ARGV[1] - TTL, dalej użytkownicy
+SADD_IF_EXISTS_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('SADD', KEYS[1], unpack(ARGV, 2))
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+"""
+sadd_if_exists = redis_client.register_script(SADD_IF_EXISTS_LUA)
+
+
+def membership_key(user_id: str) -> str:
+    return f"user_chats:{user_id}"
+
+
+def chat_members_key(chat_id) -> str:
+    return f"chat_members:{chat_id}"
+
+
+async def is_member(db: AsyncSession, user_id: str, chat_id: int) -> bool:
+    """Czy użytkownik należy do czatu: lokalny cache -> zbiór w Redisie -> zapytanie EXISTS"""
+    if local_memberships.get((user_id, chat_id)):
+        return True
+    try:
+        cached = await redis_client.sismember(membership_key(user_id), chat_id)
+    except Exception:
+        logger.exception("Nie udało się sprawdzić członkostwa w Redisie")
+        cached = False
+    if not cached:
+        member = await db.scalar(
+            select(
+                exists().where(
+                    user_chat_association.c.user_id == user_id,
+                    user_chat_association.c.chat_id == chat_id,
+                )
+            )
+        )
+        if not member:
+            return False
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.sadd(membership_key(user_id), chat_id)
+                pipe.expire(membership_key(user_id), MEMBERSHIP_REDIS_TTL)
+                await pipe.execute()
+        except Exception:
+            logger.exception("Nie udało się zapisać członkostwa w Redisie")
+    local_memberships.set((user_id, chat_id), True)
+    return True
+
+
+async def check_member(user_id: str, chat_id: int) -> bool:
+    """`is_member` we własnej, krótkiej sesji - dla WebSocketów, które żyją dłużej niż jedno zapytanie"""
+    async with SessionLocal() as db:
+        return await is_member(db, user_id, chat_id)
+
+
+async def chat_members(db: AsyncSession, chat_id: int) -> Set[str]:
+    """Pełna lista uczestników czatu: lokalny cache -> zbiór w Redisie -> Postgres"""
+    members = local_chat_members.get(chat_id)
+    if members is not None:
+        return members
+    members = set(await redis_client.smembers(chat_members_key(chat_id)))
+    if not members:
+        result = await db.execute(
+            select(user_chat_association.c.user_id).where(user_chat_association.c.chat_id == chat_id)
+        )
+        members = set(result.scalars())
+        if members:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.sadd(chat_members_key(chat_id), *members)
+                pipe.expire(chat_members_key(chat_id), MEMBERSHIP_REDIS_TTL)
+                await pipe.execute()
+    local_chat_members.set(chat_id, members)
+    return members
+
+
+async def add_members(chat_id: int, user_ids: Iterable[str]):
+    """Zapamiętuje nowych uczestników czatu (wywoływane po dodaniu ich w bazie)"""
+    user_ids = list(user_ids)
+    local_chat_members.pop(chat_id)
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.sadd(membership_key(user_id), chat_id)
+                pipe.expire(membership_key(user_id), MEMBERSHIP_REDIS_TTL)
+            await pipe.execute()
+        await sadd_if_exists(keys=[chat_members_key(chat_id)], args=[MEMBERSHIP_REDIS_TTL, *user_ids])
+    except Exception:
+        logger.exception("Nie udało się zapisać członkostwa czatu %s w Redisie", chat_id)
+
+
+async def require_member(chat_id: int, user=Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    """Zależność endpointów czatu: 403, jeśli użytkownik nie jest uczestnikiem"""
+    if not await is_member(db, user["sub"], chat_id):
+        raise HTTPException(status_code=403, detail="Nie jesteś uczestnikiem tego czatu")
+    return user
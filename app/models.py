@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Table
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Table, Index, UniqueConstraint, PrimaryKeyConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -9,8 +9,12 @@ Base = declarative_base()
 user_chat_association = Table(
     "user_chat_association",
     Base.metadata,
-    Column("user_id", String, ForeignKey("users.id")),
-    Column("chat_id", Integer, ForeignKey("chats.id")),
+    Column("user_id", String, ForeignKey("users.id"), nullable=False),
+    Column("chat_id", Integer, ForeignKey("chats.id"), nullable=False),
+    Column("last_read_message_id", Integer, nullable=True),  # Kursor odczytu użytkownika w czacie
+    # (chat_id, user_id) - uczestnicy czatu; (user_id, chat_id) - czaty użytkownika
+    PrimaryKeyConstraint("chat_id", "user_id", name="user_chat_association_pkey"),
+    Index("ix_user_chat_association_user_id_chat_id", "user_id", "chat_id"),
 )
 
 class User(Base):
@@ -22,17 +26,30 @@ class User(Base):
 
 class Chat(Base):
     __tablename__ = "chats"
+    __table_args__ = (
+        # Czat 1:1 - posortowana para uczestników, co najwyżej jeden czat na parę
+        UniqueConstraint("dm_user_a", "dm_user_b", name="uq_chats_dm_pair"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=False, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    dm_user_a = Column(String, ForeignKey("users.id"), nullable=True)
+    dm_user_b = Column(String, ForeignKey("users.id"), nullable=True)
     participants = relationship("User", secondary=user_chat_association, back_populates="chats")
 
 class Message(Base):
     __tablename__ = "messages"
-
-    id = Column(Integer, primary_key=True, index=True)
+    __table_args__ = (
+        # Stronicowanie historii czatu kursorem po (timestamp, id)
+        Index("ix_messages_chat_id_timestamp_id", "chat_id", "timestamp", "id"),
+        # Partycje miesięczne po timestamp - zakładane przez app.partitions
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+
+    # Klucz partycjonowania musi należeć do klucza głównego
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     chat_id = Column(Integer, ForeignKey("chats.id"))
     sender = Column(String, index=True)
     content = Column(String)
-    timestamp = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    timestamp = Column(DateTime, primary_key=True, default=datetime.utcnow)
\ No newline at end of file
@@ -0,0 +1,11 @@
+import base64
+import json
+
+
+def encode_cursor(values: list) -> str:
+    """Koduje wartości sortowania ostatniego elementu strony jako nieprzezroczysty kursor"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    return json.loads(base64.urlsafe_b64decode(cursor.encode()))
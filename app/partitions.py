@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import os
+import re
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from app.database import engine
+
+# Ile miesięcy naprzód zakładamy partycje tabeli messages
+MESSAGES_PARTITION_MONTHS_AHEAD = int(os.getenv("MESSAGES_PARTITION_MONTHS_AHEAD", "3"))
+MESSAGES_PARTITION_CHECK_INTERVAL = int(os.getenv("MESSAGES_PARTITION_CHECK_INTERVAL", "3600"))
+# Blokada doradcza - partycje zakłada tylko jeden worker naraz
+PARTITION_LOCK_ID = 7_260_433_501
+
+logger = logging.getLogger(__name__)
+
+_BOUND = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+class Partition(NamedTuple):
+    name: str
+    start: Optional[datetime]  # None = MINVALUE
+    end: Optional[datetime]  # None = MAXVALUE
+
+
+def month_start(value: datetime) -> datetime:
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"messages_p{month:%Y%m}"
+
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    """Czy tabela messages jest już partycjonowana (baza po migracji)"""
+    return bool(await conn.scalar(
+        text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('messages'))")
+    ))
+
+
+async def list_partitions(conn: AsyncConnection) -> List[Partition]:
+    """Partycje tabeli messages od najstarszej"""
+    rows = await conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'messages'::regclass"
+    ))
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND.search(bound or "")
+        if match:
+            partitions.append(Partition(name, _bound_value(match.group(1)), _bound_value(match.group(2))))
+    return sorted(partitions, key=lambda p: p.start or datetime.min)
+
+
+def _bound_value(value: str) -> Optional[datetime]:
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+
+async def ensure_partitions(
+    months_ahead: int = MESSAGES_PARTITION_MONTHS_AHEAD,
+    db_engine: AsyncEngine = engine,
+    since: Optional[datetime] = None,
+) -> List[str]:
+    """Zakłada brakujące partycje miesięczne od miesiąca `since` (domyślnie bieżącego) do `months_ahead` naprzód.
+
+    Miesiące pokryte już przez inną partycję (np. `messages_legacy` z migracji) są pomijane.
+    """
+    created = []
+    async with db_engine.begin() as conn:
+        if not await conn.scalar(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": PARTITION_LOCK_ID}):
+            return created
+        if not await is_partitioned(conn):
+            return created
+        existing = await list_partitions(conn)
+        month = month_start(since or datetime.utcnow())
+        last = add_months(month_start(datetime.utcnow()), months_ahead)
+        while month <= last:
+            if not any(_covers(partition, month) for partition in existing):
+                name = partition_name(month)
+                # DDL nie przyjmuje parametrów - granice to daty wyliczone powyżej
+                await conn.execute(text(
+                    f"CREATE TABLE {name} PARTITION OF messages "
+                    f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+                ))
+                created.append(name)
+            month = add_months(month, 1)
+    if created:
+        logger.info("Utworzono partycje wiadomości: %s", ", ".join(created))
+    return created
+
+
+def _covers(partition: Partition, month: datetime) -> bool:
+    return (partition.start is None or partition.start <= month) and (partition.end is None or partition.end > month)
+
+
+async def detach_partition(conn: AsyncConnection, name: str, drop: bool = False):
+    """Odłącza partycję od messages (opcjonalnie ją usuwa)"""
+    await conn.execute(text(f"ALTER TABLE messages DETACH PARTITION \"{name}\""))
+    if drop:
+        await conn.execute(text(f"DROP TABLE \"{name}\""))
+
+
+async def maintain_partitions_periodically():
+    while True:
+        await asyncio.sleep(MESSAGES_PARTITION_CHECK_INTERVAL)
+        try:
+            await ensure_partitions()
+        except Exception:
+            logger.exception("Nie udało się założyć partycji wiadomości")
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from app.pubsub import redis_client, room_channel
+
+# Identyfikator węzła (pod / worker), używany w zbiorze połączeń węzła
+NODE_ID = os.getenv("NODE_ID", f"{socket.gethostname()}:{os.getpid()}")
+# Użytkownik jest online, dopóki jego klucz nie wygaśnie (odświeżany przez heartbeaty)
+PRESENCE_TTL = int(os.getenv("PRESENCE_TTL", "60"))
+# Co ile zapisujemy zebrane zmiany obecności do Redisa (jednym pipeline)
+PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL", "5"))
+# Najwyżej jedno zdarzenie "pisze..." na użytkownika i czat w tym czasie
+TYPING_THROTTLE = float(os.getenv("TYPING_THROTTLE", "3"))
+PRESENCE_BATCH_MAX_USERS = int(os.getenv("PRESENCE_BATCH_MAX_USERS", "500"))
+
+logger = logging.getLogger(__name__)
+
+
+def presence_key(user_id: str) -> str:
+    return f"presence:{user_id}"
+
+
+def node_key(node_id: str = NODE_ID) -> str:
+    return f"presence_node:{node_id}"
+
+
+def user_nodes_key(user_id: str) -> str:
+    """Węzły, na których użytkownik ma połączenia"""
+    return f"presence_user_nodes:{user_id}"
+
+
+# KEYS[1] - węzły użytkownika, KEYS[2] - klucz obecności; ARGV[1] - węzeł.
+# Po rozłączeniu na ostatnim węźle użytkownik od razu przestaje być online
+LEAVE_LUA = """
+redis.call('SREM', KEYS[1], ARGV[1])
+if redis.call('SCARD', KEYS[1]) == 0 then
+    redis.call('DEL', KEYS[1], KEYS[2])
+end
+"""
+
+
+class PresenceTracker:
+    """Obecność użytkowników między węzłami: klucze z TTL w Redisie odświeżane zbiorczo.
+
+    Połączenia i heartbeaty są tylko zapamiętywane lokalnie; `flush` co
+    PRESENCE_FLUSH_INTERVAL zapisuje nowych użytkowników i odświeża tych, których
+    klucz zbliża się do wygaśnięcia - koszt nie zależy od częstotliwości ramek.
+    """
+
+    def __init__(self, node_id: str = NODE_ID):
+        self.node_id = node_id
+        self.connections: Dict[str, int] = {}  # user_id -> liczba lokalnych WebSocketów
+        self.last_seen: Dict[str, float] = {}  # ostatnia ramka/heartbeat od użytkownika
+        self.refreshed_at: Dict[str, float] = {}  # ostatni zapis klucza obecności w Redisie
+        self.left: Set[str] = set()
+        self.typing_sent: Dict[Tuple[int, str], float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            # Połączenia są już zamknięte (drain) - wypisujemy ich użytkowników
+            await self.flush()
+        except Exception:
+            logger.exception("Nie udało się zapisać obecności w Redisie")
+        try:
+            await redis_client.delete(node_key(self.node_id))
+        except Exception:
+            logger.exception("Nie udało się usunąć zbioru połączeń węzła")
+
+    def connected(self, user_id: str):
+        self.connections[user_id] = self.connections.get(user_id, 0) + 1
+        self.last_seen[user_id] = time.time()
+        self.left.discard(user_id)
+
+    def disconnected(self, user_id: str):
+        remaining = self.connections.get(user_id, 0) - 1
+        if remaining > 0:
+            self.connections[user_id] = remaining
+            return
+        self.connections.pop(user_id, None)
+        self.last_seen.pop(user_id, None)
+        self.refreshed_at.pop(user_id, None)
+        self.left.add(user_id)
+
+    def heartbeat(self, user_id: str):
+        if user_id in self.connections:
+            self.last_seen[user_id] = time.time()
+
+    async def typing(self, chat_id: int, user_id: str, username: str):
+        """Ulotne zdarzenie "pisze..." - tylko pub/sub, nigdy nie zapisywane"""
+        now = time.monotonic()
+        if now - self.typing_sent.get((chat_id, user_id), 0) < TYPING_THROTTLE:
+            return
+        self.typing_sent[(chat_id, user_id)] = now
+        await redis_client.publish(
+            room_channel(chat_id),
+            json.dumps({"type": "typing", "chat_id": chat_id, "user_id": user_id, "username": username}),
+        )
+
+    async def flush(self):
+        now = time.time()
+        stale_after = PRESENCE_TTL / 2
+        due = [
+            user_id
+            for user_id, seen in self.last_seen.items()
+            if now - seen < PRESENCE_TTL and now - self.refreshed_at.get(user_id, 0) >= stale_after
+        ]
+        left, self.left = self.left, set()
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for user_id in due:
+                pipe.set(presence_key(user_id), json.dumps({"last_seen": self.last_seen[user_id]}), ex=PRESENCE_TTL)
+                pipe.sadd(user_nodes_key(user_id), self.node_id)
+                pipe.expire(user_nodes_key(user_id), PRESENCE_TTL)
+            for user_id in left:
+                pipe.eval(LEAVE_LUA, 2, user_nodes_key(user_id), presence_key(user_id), self.node_id)
+            if due:
+                pipe.sadd(node_key(self.node_id), *due)
+            if left:
+                pipe.srem(node_key(self.node_id), *left)
+            pipe.expire(node_key(self.node_id), PRESENCE_TTL)
+            await pipe.execute()
+        for user_id in due:
+            self.refreshed_at[user_id] = now
+        # Wygasłe wpisy ograniczania "pisze..." nie są już potrzebne
+        cutoff = time.monotonic() - TYPING_THROTTLE
+        self.typing_sent = {key: sent for key, sent in self.typing_sent.items() if sent > cutoff}
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(PRESENCE_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Nie udało się zapisać obecności w Redisie")
+
+
+async def online(user_ids: Iterable[str]) -> Dict[str, dict]:
+    """Obecność wielu użytkowników jednym MGET"""
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return {}
+    values = await redis_client.mget([presence_key(user_id) for user_id in user_ids])
+    return {
+        user_id: {"online": value is not None, "last_seen": json.loads(value)["last_seen"] if value else None}
+        for user_id, value in zip(user_ids, values)
+    }
+
+
+presence = PresenceTracker()
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, Iterable, Optional
+
+import httpx
+
+from app.cache import TTLCache
+from app.pubsub import redis_client
+
+USER_SERVICE_URL = os.getenv("USER_SERVICE_URL", "http://user_service:8000")
+# Dwa poziomy cache profili: lokalny LRU (krótki TTL) i Redis (dłuższy TTL)
+PROFILE_LOCAL_CACHE_SIZE = int(os.getenv("PROFILE_LOCAL_CACHE_SIZE", "10000"))
+PROFILE_LOCAL_CACHE_TTL = int(os.getenv("PROFILE_LOCAL_CACHE_TTL", "60"))
+PROFILE_REDIS_TTL = int(os.getenv("PROFILE_REDIS_TTL", "3600"))
+PROFILE_FETCH_CONCURRENCY = int(os.getenv("PROFILE_FETCH_CONCURRENCY", "20"))
+PROFILE_FETCH_TIMEOUT = float(os.getenv("PROFILE_FETCH_TIMEOUT", "2.0"))
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileService:
+    """Pobiera profile uczestników z `user_service` partiami, z cache i łączeniem żądań.
+
+    Profil nieistniejącego użytkownika jest zapamiętywany jako `{}`; błędy
+    połączenia nie są cache'owane i dają `None`.
+    """
+
+    def __init__(self):
+        self.client = httpx.AsyncClient(
+            base_url=USER_SERVICE_URL,
+            timeout=PROFILE_FETCH_TIMEOUT,
+            limits=httpx.Limits(max_connections=PROFILE_FETCH_CONCURRENCY, max_keepalive_connections=PROFILE_FETCH_CONCURRENCY),
+        )
+        self.local = TTLCache(PROFILE_LOCAL_CACHE_SIZE, PROFILE_LOCAL_CACHE_TTL)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._limit = asyncio.Semaphore(PROFILE_FETCH_CONCURRENCY)
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def get_many(self, user_ids: Iterable[str]) -> Dict[str, Optional[dict]]:
+        """Zwraca profile dla (zdeduplikowanych) `user_ids`"""
+        profiles: Dict[str, Optional[dict]] = {}
+        missing = []
+        for user_id in set(user_ids):
+            profile = self.local.get(user_id)
+            if profile is None:
+                missing.append(user_id)
+            else:
+                profiles[user_id] = profile
+        if not missing:
+            return profiles
+
+        try:
+            cached = await redis_client.mget([profile_key(user_id) for user_id in missing])
+        except Exception:
+            logger.exception("Nie udało się odczytać profili z Redisa")
+            cached = [None] * len(missing)
+        to_fetch = []
+        for user_id, data in zip(missing, cached):
+            if data is None:
+                to_fetch.append(user_id)
+            else:
+                profiles[user_id] = json.loads(data)
+                self.local.set(user_id, profiles[user_id])
+
+        fetched = await asyncio.gather(*(self._fetch_coalesced(user_id) for user_id in to_fetch))
+        profiles.update(zip(to_fetch, fetched))
+        return profiles
+
+    async def _fetch_coalesced(self, user_id: str) -> Optional[dict]:
+        """Równoległe braki dla tego samego użytkownika czekają na jedno żądanie HTTP"""
+        future = self._inflight.get(user_id)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(user_id))
+            self._inflight[user_id] = future
+            future.add_done_callback(lambda _: self._inflight.pop(user_id, None))
+        return await asyncio.shield(future)
+
+    async def _fetch(self, user_id: str) -> Optional[dict]:
+        async with self._limit:
+            try:
+                resp = await self.client.get(f"/admin/api/users/users/{user_id}")
+            except Exception:
+                return None
+        if resp.status_code == 200:
+            profile = resp.json()
+        elif resp.status_code == 404:
+            profile = {}
+        else:
+            return None
+        self.local.set(user_id, profile)
+        try:
+            await redis_client.set(profile_key(user_id), json.dumps(profile), ex=PROFILE_REDIS_TTL)
+        except Exception:
+            logger.exception("Nie udało się zapisać profilu %s w Redisie", user_id)
+        return profile
+
+
+def profile_key(user_id: str) -> str:
+    return f"user_profile:{user_id}"
+
+
+profile_service = ProfileService()
@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+
+import aioredis
+from prometheus_client import Histogram
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+# Ile sekund polecenie czeka na wolne połączenie z puli, zanim zgłosi błąd
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+# Przybliżona długość strumienia pokoju (XADD MAXLEN ~) - tyle zdarzeń da się odtworzyć po reconnect
+ROOM_STREAM_MAXLEN = int(os.getenv("ROOM_STREAM_MAXLEN", "1000"))
+# Strumień nieaktywnego pokoju wygasa (każdy XADD przedłuża TTL) - po tym czasie klient doczytuje historię z API
+ROOM_STREAM_TTL = int(os.getenv("ROOM_STREAM_TTL", "86400"))
+# Jak długo XREAD czeka na nowe wpisy; nowo dodane pokoje są czytane od następnego wywołania
+ROOM_STREAM_BLOCK_MS = int(os.getenv("ROOM_STREAM_BLOCK_MS", "500"))
+ROOM_STREAM_READ_COUNT = int(os.getenv("ROOM_STREAM_READ_COUNT", "500"))
+
+logger = logging.getLogger(__name__)
+
+PUBLISH_DURATION = Histogram(
+    "chat_redis_publish_seconds", "Czas dopisania zdarzenia do strumienia pokoju (XADD)",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+
+# Jeden współdzielony klient na proces. Przy wyczerpanej puli polecenia czekają
+# na zwolnienie połączenia zamiast od razu zgłaszać "Too many connections"
+redis_client = aioredis.Redis(
+    connection_pool=aioredis.BlockingConnectionPool.from_url(
+        REDIS_URL, decode_responses=True, max_connections=REDIS_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT
+    )
+)
+
+
+def room_channel(chat_id) -> str:
+    """Nazwa kanału Redis dla pokoju czatu"""
+    return f"chat_channel:{chat_id}"
+
+
+def channel_room(channel: str) -> str:
+    """Odwrotność `room_channel` - zwraca chat_id z nazwy kanału"""
+    return channel.split(":", 1)[1]
+
+
+def room_stream(chat_id) -> str:
+    """Nazwa strumienia Redis z trwałymi zdarzeniami pokoju (wiadomościami)"""
+    return f"chat_stream:{chat_id}"
+
+
+def stream_room(stream: str) -> str:
+    """Odwrotność `room_stream` - zwraca chat_id z nazwy strumienia"""
+    return stream.split(":", 1)[1]
+
+
+def stream_position(entry_id: str) -> Tuple[int, int]:
+    """Identyfikator wpisu strumienia ("ms-seq") jako porównywalna krotka"""
+    ms, _, seq = entry_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+async def publish_to_room(chat_id, data: Union[str, bytes]) -> str:
+    """Dopisuje zdarzenie do ograniczonego strumienia pokoju; zwraca id wpisu"""
+    with PUBLISH_DURATION.time():
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.xadd(room_stream(chat_id), {"data": data}, maxlen=ROOM_STREAM_MAXLEN, approximate=True)
+            pipe.expire(room_stream(chat_id), ROOM_STREAM_TTL)
+            entry_id, _ = await pipe.execute()
+        return entry_id
+
+
+async def read_room_since(chat_id, last_id: str, limit: int = ROOM_STREAM_MAXLEN) -> Optional[List[Tuple[str, str]]]:
+    """Wpisy pokoju nowsze niż `last_id` lub None, jeśli luki nie da się odtworzyć.
+
+    XRANGE od `last_id` włącznie: jeśli tego wpisu już nie ma w strumieniu (przycięty
+    przez MAXLEN albo niepoprawny id), nie wiemy, ile zdarzeń przepadło.
+    """
+    try:
+        entries = await redis_client.xrange(room_stream(chat_id), min=last_id, max="+", count=limit + 1)
+    except aioredis.ResponseError:
+        return None
+    if not entries or entries[0][0] != last_id or len(entries) > limit:
+        return None
+    return [(entry_id, fields["data"]) for entry_id, fields in entries[1:]]
+
+
+class RedisStreamReader:
+    """Jeden blokujący XREAD na proces dla strumieni wszystkich pokojów z lokalnymi połączeniami.
+
+    Dla każdego strumienia pamiętamy id ostatnio przeczytanego wpisu; nowy strumień
+    zaczynamy od jego aktualnego końca. Wpisy trafiają do `handler(stream, entry_id, data)`.
+    """
+
+    def __init__(self, redis: aioredis.Redis, handler: Callable[[str, str, str], Awaitable[None]]):
+        self.redis = redis
+        self.handler = handler
+        self.positions: Dict[str, str] = {}
+        self._has_streams = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Uruchamia pętlę czytania (jeśli jeszcze nie działa)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.positions.clear()
+
+    async def add(self, stream: str):
+        if stream in self.positions:
+            return
+        last = await self.redis.xrevrange(stream, count=1)
+        if stream in self.positions:
+            return
+        self.positions[stream] = last[0][0] if last else "0-0"
+        self._has_streams.set()
+        self.start()
+
+    def remove(self, stream: str):
+        self.positions.pop(stream, None)
+
+    async def _listen(self):
+        while True:
+            if not self.positions:
+                self._has_streams.clear()
+                await self._has_streams.wait()
+            try:
+                response = await self.redis.xread(
+                    dict(self.positions), count=ROOM_STREAM_READ_COUNT, block=ROOM_STREAM_BLOCK_MS
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Błąd odczytu strumieni Redis")
+                await asyncio.sleep(1)
+                continue
+            for stream, entries in response or ():
+                for entry_id, fields in entries:
+                    # Strumień mógł zostać usunięty (lub dodany od nowa) w trakcie XREAD
+                    position = self.positions.get(stream)
+                    if position is None or stream_position(entry_id) <= stream_position(position):
+                        continue
+                    self.positions[stream] = entry_id
+                    try:
+                        await self.handler(stream, entry_id, fields["data"])
+                    except Exception:
+                        logger.exception("Błąd obsługi wpisu %s ze strumienia %s", entry_id, stream)
+
+
+class RedisSubscriber:
+    """Jeden subskrybent Redis na proces, multipleksujący kanały wszystkich pokojów.
+
+    Kanały są dynamicznie subskrybowane/odsubskrybowywane na jednym połączeniu,
+    a każda odebrana wiadomość trafia do `handler(channel, data)`.
+    """
+
+    def __init__(self, redis: aioredis.Redis, handler: Callable[[str, str], Awaitable[None]]):
+        self.redis = redis
+        self.handler = handler
+        self.channels: Set[str] = set()
+        self.pubsub = redis.pubsub()
+        self._has_channels = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Uruchamia pętlę nasłuchu (jeśli jeszcze nie działa)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        """Zatrzymuje nasłuch i zwalnia połączenie"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.channels.clear()
+        await self.pubsub.reset()
+
+    async def subscribe(self, channel: str):
+        if channel in self.channels:
+            return
+        self.channels.add(channel)
+        await self.pubsub.subscribe(channel)
+        self._has_channels.set()
+        self.start()
+
+    async def unsubscribe(self, channel: str):
+        if channel not in self.channels:
+            return
+        self.channels.discard(channel)
+        await self.pubsub.unsubscribe(channel)
+
+    async def _listen(self):
+        while True:
+            if not self.channels:
+                # Bez subskrypcji połączenie pubsub nie istnieje - czekamy na pierwszy kanał
+                self._has_channels.clear()
+                await self._has_channels.wait()
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # PubSub sam odnawia połączenie i subskrypcje przy kolejnej próbie
+                logger.exception("Błąd nasłuchu Redis pub/sub")
+                await asyncio.sleep(1)
+                continue
+            if message is None or message["type"] != "message":
+                continue
+            try:
+                await self.handler(message["channel"], message["data"])
+            except Exception:
+                logger.exception("Błąd obsługi wiadomości z kanału %s", message["channel"])
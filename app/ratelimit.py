@@ -0,0 +1,233 @@
+"""Limity częstotliwości żądań REST i ramek WebSocket (token bucket w Redisie).
+
+Każda reguła to wiadro o pojemności `burst` uzupełniane `rate` tokenami na
+sekundę, wspólne dla wszystkich workerów i podów (atomowy skrypt Lua). Przed
+Redisem sprawdzamy lokalną kopię wiadra: dopóki jest w niej więcej niż
+RATE_LIMIT_LOCAL_THRESHOLD pojemności, żądanie przechodzi bez zapytania do
+Redisa, a zużyte tokeny są dopisywane do wiadra w Redisie przy następnym
+sprawdzeniu albo co RATE_LIMIT_SYNC_INTERVAL.
+
+Reguły można nadpisać zmienną RATE_LIMIT_<NAZWA> w formacie "rate/burst",
+np. RATE_LIMIT_WS_MESSAGE="10/40" dla reguły "ws:message".
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from fastapi import Depends, HTTPException, Request, status
+from prometheus_client import Counter
+
+from app.pubsub import redis_client
+from app.routers.auth import verify_token
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Powyżej tej części pojemności lokalnego wiadra nie pytamy Redisa
+RATE_LIMIT_LOCAL_THRESHOLD = float(os.getenv("RATE_LIMIT_LOCAL_THRESHOLD", "0.5"))
+RATE_LIMIT_SYNC_INTERVAL = float(os.getenv("RATE_LIMIT_SYNC_INTERVAL", "1"))
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMITED = Counter("chat_rate_limited_total", "Żądania i ramki odrzucone przez limity", ["rule"])
+RATE_LIMIT_CHECKS = Counter(
+    "chat_rate_limit_checks_total", "Sprawdzenia limitów wg miejsca decyzji (local, redis, error)", ["source"]
+)
+
+
+class Rule(NamedTuple):
+    rate: float  # tokeny na sekundę
+    burst: int  # pojemność wiadra
+
+
+def _rule(name: str, rate: float, burst: int) -> Rule:
+    value = os.getenv("RATE_LIMIT_" + name.upper().replace(":", "_"))
+    if value:
+        rate, burst = value.split("/")
+    return Rule(float(rate), int(burst))
+
+
+RULES: Dict[str, Rule] = {
+    name: _rule(name, rate, burst)
+    for name, rate, burst in [
+        # REST (na użytkownika, wyszukiwanie użytkowników - na adres IP)
+        ("http:list_chats", 5, 20),
+        ("http:history", 10, 40),
+        ("http:search", 2, 10),
+        ("http:user_search", 10, 30),
+        # Ramki WebSocket (na użytkownika)
+        ("ws:message", 5, 20),
+        ("ws:typing", 2, 5),
+        ("ws:read", 10, 30),
+        ("ws:subscribe", 20, 100),
+        ("ws:unsubscribe", 20, 100),
+        # Wszystkie wiadomości w jednym czacie (na czat)
+        ("ws:message:room", 50, 200),
+    ]
+}
+
+# KEYS[1] - wiadro; ARGV: rate, burst, koszt, tokeny zużyte lokalnie od ostatniej synchronizacji.
+# Czas z Redisa (TIME), więc zegary workerów nie mają znaczenia. Zwraca {dozwolone, pozostałe tokeny}.
+TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local debit = tonumber(ARGV[4])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+tokens = math.max(-burst, tokens - debit)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+def bucket_key(rule: str, subject: str) -> str:
+    return f"ratelimit:{rule}:{subject}"
+
+
+class LocalBucket:
+    """Lokalna kopia wiadra z Redisa i tokeny zużyte od ostatniej synchronizacji"""
+
+    __slots__ = ("rule", "tokens", "updated", "pending")
+
+    def __init__(self, rule: str, tokens: float):
+        self.rule = rule
+        self.tokens = tokens
+        self.updated = time.monotonic()
+        self.pending = 0
+
+    def refill(self, rule: Rule):
+        now = time.monotonic()
+        self.tokens = min(rule.burst, self.tokens + (now - self.updated) * rule.rate)
+        self.updated = now
+
+
+class RateLimiter:
+    def __init__(self, rules: Dict[str, Rule] = RULES):
+        self.rules = rules
+        self.local: Dict[str, LocalBucket] = {}
+        self.script = redis_client.register_script(TOKEN_BUCKET_LUA)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.sync()
+
+    async def hit(self, rule_name: str, subject, cost: int = 1) -> Optional[float]:
+        """Zużywa `cost` tokenów; zwraca None albo liczbę sekund do ponowienia"""
+        rule = self.rules.get(rule_name)
+        if rule is None or not RATE_LIMIT_ENABLED:
+            return None
+        key = bucket_key(rule_name, subject)
+        bucket = self.local.get(key)
+        if bucket is not None:
+            bucket.refill(rule)
+            if bucket.tokens - cost >= rule.burst * RATE_LIMIT_LOCAL_THRESHOLD:
+                bucket.tokens -= cost
+                bucket.pending += cost
+                RATE_LIMIT_CHECKS.labels("local").inc()
+                return None
+            if bucket.tokens < cost:
+                # Inne workery tokenów tylko ubywają, więc Redis też by odmówił
+                RATE_LIMIT_CHECKS.labels("local").inc()
+                RATE_LIMITED.labels(rule_name).inc()
+                return (cost - bucket.tokens) / rule.rate
+        allowed, tokens = await self._remote(key, rule_name, rule, cost)
+        if allowed:
+            return None
+        RATE_LIMITED.labels(rule_name).inc()
+        return (cost - tokens) / rule.rate
+
+    async def _remote(self, key: str, rule_name: str, rule: Rule, cost: int) -> Tuple[bool, float]:
+        bucket = self.local.get(key)
+        debit = bucket.pending if bucket is not None else 0
+        try:
+            allowed, tokens = await self.script(keys=[key], args=[rule.rate, rule.burst, cost, debit])
+        except Exception:
+            # Redis niedostępny - nie blokujemy ruchu
+            logger.exception("Nie udało się sprawdzić limitu %s", key)
+            RATE_LIMIT_CHECKS.labels("error").inc()
+            return True, float(rule.burst)
+        RATE_LIMIT_CHECKS.labels("redis").inc()
+        tokens = float(tokens)
+        if bucket is None:
+            bucket = self.local[key] = LocalBucket(rule_name, tokens)
+        else:
+            bucket.tokens, bucket.updated = tokens, time.monotonic()
+        bucket.pending -= debit
+        return bool(allowed), tokens
+
+    async def sync(self):
+        """Dopisuje tokeny zużyte lokalnie do Redisa i usuwa wiadra, które się zapełniły"""
+        for key, bucket in list(self.local.items()):
+            rule = self.rules[bucket.rule]
+            if bucket.pending:
+                await self._remote(key, bucket.rule, rule, 0)
+            else:
+                bucket.refill(rule)
+                if bucket.tokens >= rule.burst:
+                    del self.local[key]
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(RATE_LIMIT_SYNC_INTERVAL)
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Nie udało się zsynchronizować limitów z Redisem")
+
+
+rate_limiter = RateLimiter()
+
+
+async def frame_retry_after(frame_type: str, user_id: str, chat_id: int) -> Optional[float]:
+    """Limity ramki WebSocket: na użytkownika i (dla wiadomości) na czat"""
+    retry_after = await rate_limiter.hit(f"ws:{frame_type}", user_id)
+    if retry_after is None and frame_type == "message":
+        retry_after = await rate_limiter.hit("ws:message:room", chat_id)
+    return retry_after
+
+
+def rate_limit(rule: str, by: str = "user"):
+    """Dependency ograniczająca endpoint regułą `rule` - na użytkownika (`by="user"`) lub adres IP"""
+
+    async def check(user=Depends(verify_token)):
+        await _check(rule, user["sub"])
+
+    async def check_ip(request: Request):
+        await _check(rule, request.client.host if request.client else "unknown")
+
+    return check if by == "user" else check_ip
+
+
+async def _check(rule: str, subject: str):
+    retry_after = await rate_limiter.hit(rule, subject)
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Przekroczono limit żądań",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
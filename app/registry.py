@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, Iterable, List, Optional, Set
+
+from app.presence import NODE_ID
+from app.pubsub import redis_client
+
+# Zbiór pokojów węzła wygasa, jeśli węzeł przestanie go odświeżać (np. po awarii)
+ROOM_REGISTRY_TTL = int(os.getenv("ROOM_REGISTRY_TTL", "30"))
+ROOM_REGISTRY_FLUSH_INTERVAL = float(os.getenv("ROOM_REGISTRY_FLUSH_INTERVAL", "5"))
+# Węzły (workery / pody) z czasem ostatniego odświeżenia rejestru
+REGISTRY_NODES_KEY = "room_registry_nodes"
+
+logger = logging.getLogger(__name__)
+
+
+def node_rooms_key(node_id: str = NODE_ID) -> str:
+    return f"node_rooms:{node_id}"
+
+
+class RoomRegistry:
+    """Rejestr pokojów z lokalnymi słuchaczami tego węzła, w Redisie.
+
+    Jak obecność: dołączenia i wyjścia są zbierane lokalnie, a `flush` zapisuje
+    różnice jednym pipeline. Po błędzie zapisu (lub przy starcie) zbiór jest
+    zapisywany w całości z `rooms()`, więc nie rozjeżdża się ze stanem procesu.
+    """
+
+    def __init__(self, rooms: Callable[[], Iterable[str]], node_id: str = NODE_ID):
+        self.rooms = rooms
+        self.node_id = node_id
+        self.joined: Set[str] = set()
+        self.left: Set[str] = set()
+        self.resync = True
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.delete(node_rooms_key(self.node_id))
+                pipe.zrem(REGISTRY_NODES_KEY, self.node_id)
+                await pipe.execute()
+        except Exception:
+            logger.exception("Nie udało się usunąć rejestru pokojów węzła")
+
+    def room_joined(self, chat_id: str):
+        self.left.discard(chat_id)
+        self.joined.add(chat_id)
+
+    def room_left(self, chat_id: str):
+        self.joined.discard(chat_id)
+        self.left.add(chat_id)
+
+    async def flush(self):
+        key = node_rooms_key(self.node_id)
+        resync, self.resync = self.resync, False
+        joined, self.joined = self.joined, set()
+        left, self.left = self.left, set()
+        now = time.time()
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                if resync:
+                    pipe.delete(key)
+                    joined = set(self.rooms())
+                    left = set()
+                if joined:
+                    pipe.sadd(key, *joined)
+                if left:
+                    pipe.srem(key, *left)
+                pipe.expire(key, ROOM_REGISTRY_TTL)
+                pipe.zadd(REGISTRY_NODES_KEY, {self.node_id: now})
+                pipe.zremrangebyscore(REGISTRY_NODES_KEY, "-inf", now - ROOM_REGISTRY_TTL)
+                await pipe.execute()
+        except Exception:
+            self.resync = True
+            raise
+
+    async def _run(self):
+        while True:
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Nie udało się zapisać rejestru pokojów w Redisie")
+            await asyncio.sleep(ROOM_REGISTRY_FLUSH_INTERVAL)
+
+
+async def live_nodes() -> List[str]:
+    """Węzły, które odświeżyły rejestr w ciągu ROOM_REGISTRY_TTL"""
+    return await redis_client.zrangebyscore(REGISTRY_NODES_KEY, time.time() - ROOM_REGISTRY_TTL, "+inf")
+
+
+async def room_nodes(chat_id) -> List[str]:
+    """Węzły, na których pokój ma lokalnych słuchaczy"""
+    nodes = await live_nodes()
+    if not nodes:
+        return []
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for node_id in nodes:
+            pipe.sismember(node_rooms_key(node_id), str(chat_id))
+        members = await pipe.execute()
+    return [node_id for node_id, member in zip(nodes, members) if member]
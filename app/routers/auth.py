@@ -2,14 +2,25 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi_keycloak import FastAPIKeycloak
 from keycloak.keycloak_openid import KeycloakOpenID
 from fastapi.security import OAuth2PasswordBearer
+import asyncio
 import os
 from time import sleep
+import hashlib
+import json
+import logging
+import time
 import traceback
-from jose import jwt, JWTError
+from typing import Dict, Optional
+import httpx
+from jose import jwk, jwt, JWTError
 from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from app.cache import TTLCache
 from app.database import get_db
 from app.models import User
+from app.search import index_user
+from app.user_search import user_directory
 
 router = APIRouter()
 keycloak = None
@@ -49,21 +60,130 @@ keycloak_openid = KeycloakOpenID(
 # tokenUrl nie jest używany w trybie bearer-only, ale musi być podany – możesz użyć dowolnej wartości
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+DEFAULT_PUBLIC_KEY = (
+    "-----BEGIN PUBLIC KEY-----\n"
+    + "MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEA5VkAT4Kw/1MYC2pR+XYIHx/j0iZMjfkgpBUXkVfVux4y58WDnekUpyagTd604xIN4ajX4gSgzXx0FGbEcyM7uiFNPfvFlZRyo3eievFaxmkCejYgaRiS2/sFHOoQ/bytf+rjWL4nZv7eAatmOUajjxJZNpVzy2k1c6/945PHzHAa+tI9MD1OV5xwmJsuQF75IZJIlog1xgQdup+EQRGN9JwKa1cvTIdG3cq7oVCmdMn4RHQhldVGqmg484EbfQg6DqRilos2ng1iqoAiLK6A0tZSC8ye7V6CFu/cjJvnwQTh2fk2K3BRAQXL3zIfDjOt7RHVmch6uCvWsTAjvFhjvwIDAQAB"
+    + "\n-----END PUBLIC KEY-----"
+)
+JWT_ALGORITHMS = ["RS256"]
+# Klucz publiczny realm-u: na stałe (PEM) albo z JWKS (URL Keycloaka lub lokalny plik, np. w testach)
+JWT_PUBLIC_KEY = os.getenv("JWT_PUBLIC_KEY", DEFAULT_PUBLIC_KEY)
+JWKS_URL = os.getenv("JWKS_URL")  # np. http://keycloak:8080/realms/chat_realm/protocol/openid-connect/certs
+JWKS_FILE = os.getenv("JWKS_FILE")
+JWKS_REFRESH_INTERVAL = int(os.getenv("JWKS_REFRESH_INTERVAL", "60"))
+# Ile zweryfikowanych tokenów pamiętamy (do ich `exp`)
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+logger = logging.getLogger(__name__)
+
+
+class PublicKeys:
+    """Sparsowane raz klucze publiczne z JWKS, pobierane w tle (httpx.AsyncClient).
+
+    Klucze są pobierane przy starcie aplikacji i odświeżane co JWKS_REFRESH_INTERVAL.
+    Nieznany `kid` nie blokuje weryfikacji - token jest odrzucany, a pętla w tle
+    odświeża JWKS (nie częściej niż co JWKS_REFRESH_INTERVAL).
+    """
+
+    def __init__(self):
+        self.static_key = None if (JWKS_URL or JWKS_FILE) else jwk.construct(JWT_PUBLIC_KEY, JWT_ALGORITHMS[0])
+        self.keys: Dict[Optional[str], jwk.Key] = {}
+        self.refreshed_at: Optional[float] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wanted: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, kid: Optional[str]):
+        if self.static_key is not None:
+            return self.static_key
+        key = self.keys.get(kid)
+        if key is None and self._loop is not None:
+            # verify_token działa też w wątkach puli (zależności synchroniczne)
+            self._loop.call_soon_threadsafe(self._wanted.set)
+        return key
+
+    async def start(self):
+        """Pobiera klucze i uruchamia ich odświeżanie w tle"""
+        if self.static_key is not None:
+            return
+        await self.refresh()
+        if self._task is None or self._task.done():
+            self._loop = asyncio.get_running_loop()
+            self._wanted = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._loop = None
+
+    async def refresh(self) -> bool:
+        now = time.monotonic()
+        if self.refreshed_at is not None and now - self.refreshed_at < JWKS_REFRESH_INTERVAL:
+            return False
+        self.refreshed_at = now
+        try:
+            if JWKS_FILE:
+                with open(JWKS_FILE) as f:
+                    jwks = json.load(f)
+            else:
+                async with httpx.AsyncClient(timeout=5) as client:
+                    jwks = (await client.get(JWKS_URL)).json()
+        except Exception:
+            logger.exception("Nie udało się pobrać JWKS")
+            return False
+        self.keys = {
+            key.get("kid"): jwk.construct(key, key.get("alg", JWT_ALGORITHMS[0]))
+            for key in jwks["keys"]
+            if key.get("use", "sig") == "sig" and key.get("alg", JWT_ALGORITHMS[0]) in JWT_ALGORITHMS
+        }
+        return True
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wanted.wait(), timeout=JWKS_REFRESH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wanted.clear()
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Nieprawidłowy JWKS")
+
+
+public_keys = PublicKeys()
+verified_tokens = TTLCache(TOKEN_CACHE_SIZE, ttl=0)
+
+
 def verify_token(token: str = Depends(oauth2_scheme)):
-    try:
-        public_key = (
-            "-----BEGIN PUBLIC KEY-----\n"
-            + "MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEA5VkAT4Kw/1MYC2pR+XYIHx/j0iZMjfkgpBUXkVfVux4y58WDnekUpyagTd604xIN4ajX4gSgzXx0FGbEcyM7uiFNPfvFlZRyo3eievFaxmkCejYgaRiS2/sFHOoQ/bytf+rjWL4nZv7eAatmOUajjxJZNpVzy2k1c6/945PHzHAa+tI9MD1OV5xwmJsuQF75IZJIlog1xgQdup+EQRGN9JwKa1cvTIdG3cq7oVCmdMn4RHQhldVGqmg484EbfQg6DqRilos2ng1iqoAiLK6A0tZSC8ye7V6CFu/cjJvnwQTh2fk2K3BRAQXL3zIfDjOt7RHVmch6uCvWsTAjvFhjvwIDAQAB"
-            + "\n-----END PUBLIC KEY-----"
-        )
-        decoded_token = jwt.decode(token, public_key, algorithms=["RS256"], options={"verify_aud": False})
+    token_hash = hashlib.sha256(token.encode()).digest()
+    decoded_token = verified_tokens.get(token_hash)
+    if decoded_token is not None:
         return decoded_token
+    try:
+        key = public_keys.get(jwt.get_unverified_header(token).get("kid"))
+        if key is None:
+            raise JWTError("Nieznany klucz podpisu")
+        decoded_token = jwt.decode(token, key, algorithms=JWT_ALGORITHMS, options={"verify_aud": False})
     except JWTError as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    # Token bez `exp` weryfikujemy za każdym razem
+    ttl = decoded_token.get("exp", 0) - time.time()
+    if ttl > 0:
+        verified_tokens.set(token_hash, decoded_token, ttl=ttl)
+    return decoded_token
 
 
 @router.get("/protected")
@@ -73,4 +193,13 @@ async def get_current_user(user=Depends(verify_token), db: AsyncSession = Depend
     if not user_db:
         user_db = User(id=user["sub"], username=user["preferred_username"])
         db.add(user_db)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # Równoległe pierwsze żądanie tego użytkownika już go zapisało (i zaindeksowało)
+            await db.rollback()
+            return user
+        # Do wyszukiwarki i katalogu trafia dopiero użytkownik zapisany w bazie
+        await index_user(user_db.id, user_db.username)
+        user_directory.add(user_db.id, user_db.username)
     return user
\ No newline at end of file
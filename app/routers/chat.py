@@ -1,69 +1,41 @@
 import asyncio
-import json
-import aioredis
 import os
-from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Depends
-import httpx
+
+import orjson
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Depends, Query
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from sqlalchemy import distinct, func, select
+from sqlalchemy import func, insert, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import selectinload, joinedload
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.database import get_db
+from app.database import SessionLocal, get_db, get_read_db
 from app.routers.auth import get_current_user, verify_token
 from app.models import User, Chat, user_chat_association
 from app.models import Message
-from app.search import index_message, search_messages
-from typing import Dict, List, Set
+from app.search import search_messages
+from app.ingest import ingest_pipeline
+from app import archive, history_cache, lifecycle
+from app.cache import TTLCache
+from app.connections import manager
+from app.membership import add_members, check_member, require_member
+from app.profiles import profile_service
+from app.unread import mark_read, summaries
+from app.presence import PRESENCE_BATCH_MAX_USERS, online, presence
+from app.ratelimit import frame_retry_after, rate_limit
+from app.pagination import decode_cursor, encode_cursor
+from app.wire import CODECS, negotiate
+from datetime import datetime
+from typing import List, Optional, Tuple
 
 router = APIRouter(prefix="/api/chat")
 ws_router = APIRouter()
 
-REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379")
+# Maksymalna liczba czatów subskrybowanych przez jedno połączenie /ws
+WS_MAX_ROOMS = int(os.getenv("WS_MAX_ROOMS", "500"))
 
-class ConnectionManager:
-    """Zarządza połączeniami WebSocket i jednorazowym nasłuchem Redis"""
-    
-    def __init__(self):
-        self.rooms: Dict[str, Set[WebSocket]] = {}  # Przechowuje połączenia WebSocket dla każdego pokoju
-        self.redis_tasks: Dict[str, asyncio.Task] = {}  # Przechowuje jednorazowy nasłuch Redis
-
-    async def connect(self, chat_id: str, websocket: WebSocket):
-        """Dodaje WebSocket do listy aktywnych połączeń w danym pokoju"""
-        await websocket.accept()
-        if chat_id not in self.rooms:
-            self.rooms[chat_id] = set()
-        self.rooms[chat_id].add(websocket)
-
-        # Jeśli jeszcze nie ma nasłuchu dla tego pokoju, uruchamiamy go
-        if chat_id not in self.redis_tasks:
-            self.redis_tasks[chat_id] = asyncio.create_task(self.listen_to_redis(chat_id))
-
-    async def disconnect(self, chat_id: str, websocket: WebSocket):
-        """Usuwa WebSocket z listy aktywnych połączeń"""
-        if chat_id in self.rooms:
-            self.rooms[chat_id].discard(websocket)
-            if not self.rooms[chat_id]:  # Jeśli pokój jest pusty, usuwamy nasłuch Redis
-                del self.rooms[chat_id]
-                self.redis_tasks[chat_id].cancel()
-                del self.redis_tasks[chat_id]
-
-    async def broadcast(self, chat_id: str, message: str):
-        """Wysyła wiadomość do wszystkich użytkowników w danym pokoju"""
-        if chat_id in self.rooms:
-            for connection in self.rooms[chat_id]:
-                await connection.send_text(message)
-
-    async def listen_to_redis(self, chat_id: str):
-        """Jednorazowy nasłuch Redis dla pokoju czatu"""
-        redis = await aioredis.from_url(REDIS_URL, decode_responses=True)
-        pubsub = redis.pubsub()
-        await pubsub.subscribe(f"chat_channel:{chat_id}")
-
-        async for message in pubsub.listen():
-            if message["type"] == "message":
-                await self.broadcast(chat_id, message["data"])
-
-manager = ConnectionManager()
+# Data utworzenia czatu się nie zmienia - decyduje, czy historia może sięgać archiwum
+chat_created_at = TTLCache(int(os.getenv("CHAT_CREATED_AT_CACHE_SIZE", "100000")), ttl=3600)
 
 # @router.websocket("/ws/chat/{chat_id}")
 # async def chat_endpoint(websocket: WebSocket, chat_id: str):#, db: AsyncSession = Depends(get_db)):
@@ -87,57 +59,219 @@ manager = ConnectionManager()
 #         await manager.disconnect(chat_id, websocket)
 
 
-@ws_router.websocket("/ws/chat/{chat_id}")
-async def chat_endpoint(websocket: WebSocket, chat_id: int, db: AsyncSession = Depends(get_db)):
-
+async def _authenticate(websocket: WebSocket) -> Optional[dict]:
+    """Weryfikuje token z parametru `token`; przy błędzie zamyka WebSocket i zwraca None"""
+    if lifecycle.state.draining:
+        # Węzeł jest zatrzymywany - klient połączy się z innym
+        await websocket.close(code=1012)  # 1012: Service Restart
+        return None
     token = websocket.query_params.get("token")
     if not token:
         await websocket.close(code=1008)  # 1008: Policy Violation
-        return
+        return None
 
     # Validate token manually
     try:
-        user = verify_token(token)
+        return verify_token(token)
     except HTTPException as e:
         await websocket.close(code=1008)
-        return
+        return None
 
-    """ WebSocket obsługujący czaty z autoryzacją """
-    redis = await aioredis.from_url(REDIS_URL, decode_responses=True)
-    pubsub = redis.pubsub()
-    await pubsub.subscribe(f"chat_channel:{chat_id}")
 
-    user_db = await db.execute(select(User).options(selectinload(User.chats)).where(User.id == user["sub"]))
-    user_db = user_db.scalar()
+@ws_router.websocket("/ws/chat/{chat_id}")
+async def chat_endpoint(websocket: WebSocket, chat_id: int):
+    """ WebSocket obsługujący czaty z autoryzacją.
+
+    Połączenie trwa długo, więc nie trzyma sesji bazy - każde zapytanie ma własną,
+    krótką sesję (inaczej połączenie z puli zostaje "idle in transaction").
+    """
+    user = await _authenticate(websocket)
+    if user is None:
+        return
 
-    if not user_db or chat_id not in [chat.id for chat in user_db.chats]:
+    if not await check_member(user["sub"], chat_id):
         await websocket.close()
         return
-    await manager.connect(str(chat_id), websocket)
+    await manager.accept(websocket, user["sub"], negotiate(websocket.scope.get("subprotocols", ())))
+    presence.connected(user["sub"])
+    # Po reconnect klient podaje ostatni otrzymany `stream_id` i dostaje brakujące wiadomości
+    if not await manager.join(str(chat_id), websocket, websocket.query_params.get("last_id")):
+        manager.send(websocket, _resync_frame(chat_id))
 
     try:
         while True:
-            data = await websocket.receive_text()
-            message = Message(chat_id=chat_id, sender=user["preferred_username"], content=data)
-            # do dodania tam gdzie tworzymy wiadomośc w bazie
-            db.add(message)
-            await db.commit()
-            await index_message(chat_id, user["preferred_username"], data)
-            payload = {
-                "id": message.id,
-                "sender": message.sender,
-                "content": data,
-                "timestamp": message.timestamp.isoformat()
-            }
-            await redis.publish(f"chat_channel:{chat_id}", json.dumps(payload))
+            frame, text = await _receive(websocket)
+            # Każda ramka od klienta jest też heartbeatem obecności
+            presence.heartbeat(user["sub"])
+            if frame is None and text is not None:
+                if not await _within_limits(websocket, user, {"type": "message", "chat_id": chat_id}):
+                    continue
+                # Publikacja i zapis (partiami) do bazy oraz Elasticsearch odbywa się w potoku
+                await _submit_message(websocket, user, chat_id, text, {"type": "message", "chat_id": chat_id})
+            elif frame is None:
+                manager.send(websocket, _error_frame("Niepoprawna ramka"))
+            elif await _within_limits(websocket, user, {**frame, "chat_id": chat_id}):
+                await _handle_room_frame(websocket, user, chat_id, frame)
     except WebSocketDisconnect:
+        pass
+    finally:
+        presence.disconnected(user["sub"])
         await manager.disconnect(str(chat_id), websocket)
 
+
+@ws_router.websocket("/ws")
+async def multiplexed_chat_endpoint(websocket: WebSocket):
+    """Jeden WebSocket dla wielu czatów użytkownika.
+
+    Klient dołącza do czatów ramkami {"type": "subscribe", "chat_id": N} (opcjonalnie
+    z "last_id", by odtworzyć wiadomości od ostatniego `stream_id`) i opuszcza
+    je ramkami "unsubscribe"; wiadomości wysyła jako {"type": "message", "chat_id": N,
+    "content": ...}. Wszystkie ramki wychodzące zawierają `chat_id`.
+
+    Kodowanie ramek wybiera podprotokół: "chat.v1.json" (domyślnie) lub "chat.v1.msgpack".
+    Przy zatrzymaniu węzła klient dostaje {"type": "reconnect", "after_ms": N} i powinien
+    połączyć się ponownie po N ms, podając `last_id` każdego czatu.
+
+    Jak `chat_endpoint` nie trzyma sesji bazy przez cały czas połączenia.
+    """
+    user = await _authenticate(websocket)
+    if user is None:
+        return
+
+    await manager.accept(websocket, user["sub"], negotiate(websocket.scope.get("subprotocols", ())))
+    presence.connected(user["sub"])
+    rooms = manager.connections[websocket].rooms
+
+    try:
+        while True:
+            frame, _ = await _receive(websocket)
+            presence.heartbeat(user["sub"])
+            if frame is None:
+                manager.send(websocket, _error_frame("Oczekiwano ramki z polem type"))
+                continue
+            if frame["type"] == "heartbeat":
+                continue
+            chat_id = frame.get("chat_id")
+            if not isinstance(chat_id, int):
+                manager.send(websocket, _error_frame("Brak chat_id", frame))
+            elif not await _within_limits(websocket, user, frame):
+                continue
+            elif frame["type"] == "subscribe":
+                if str(chat_id) in rooms:
+                    manager.send(websocket, {"type": "subscribed", "chat_id": chat_id})
+                elif len(rooms) >= WS_MAX_ROOMS:
+                    manager.send(websocket, _error_frame("Przekroczono limit czatów na połączenie", frame))
+                elif await check_member(user["sub"], chat_id):
+                    last_id = frame.get("last_id") if isinstance(frame.get("last_id"), str) else None
+                    replayed = await manager.join(str(chat_id), websocket, last_id)
+                    manager.send(websocket, {"type": "subscribed", "chat_id": chat_id})
+                    if not replayed:
+                        manager.send(websocket, _resync_frame(chat_id))
+                else:
+                    manager.send(websocket, _error_frame("Brak dostępu do czatu", frame))
+            elif frame["type"] == "unsubscribe":
+                await manager.leave(str(chat_id), websocket)
+                manager.send(websocket, {"type": "unsubscribed", "chat_id": chat_id})
+            elif str(chat_id) not in rooms:
+                manager.send(websocket, _error_frame("Czat nie jest subskrybowany", frame))
+            else:
+                await _handle_room_frame(websocket, user, chat_id, frame)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        presence.disconnected(user["sub"])
+        await manager.close(websocket)
+
+
+async def _handle_room_frame(websocket: WebSocket, user: dict, chat_id: int, frame: dict):
+    """Ramki sterujące dotyczące jednego czatu (wspólne dla obu endpointów)"""
+    if frame["type"] == "message":
+        if isinstance(frame.get("content"), str):
+            await _submit_message(websocket, user, chat_id, frame["content"], frame)
+        else:
+            manager.send(websocket, _error_frame("Brak treści wiadomości", frame))
+    elif frame["type"] == "read" and isinstance(frame.get("message_id"), int):
+        async with SessionLocal() as db:
+            remaining = await mark_read(db, user["sub"], chat_id, frame["message_id"])
+        if remaining is not None:
+            manager.send(websocket, {"type": "unread", "chat_id": chat_id, "unread": remaining})
+    elif frame["type"] == "typing":
+        await presence.typing(chat_id, user["sub"], user["preferred_username"])
+
+
+async def _submit_message(websocket: WebSocket, user: dict, chat_id: int, content: str, frame: dict):
+    """Przekazuje wiadomość do potoku; błąd publikacji lub zapisu (logowany w potoku) nie zamyka połączenia"""
+    try:
+        await ingest_pipeline.submit(chat_id, user["preferred_username"], content, sender_id=user["sub"])
+    except Exception:
+        manager.send(websocket, _error_frame("Nie udało się wysłać wiadomości", frame))
+
+
+async def _within_limits(websocket: WebSocket, user: dict, frame: dict) -> bool:
+    """Sprawdza limity ramki; po przekroczeniu odsyła błąd (połączenie zostaje otwarte)"""
+    retry_after = await frame_retry_after(frame["type"], user["sub"], frame["chat_id"])
+    if retry_after is None:
+        return True
+    error = _error_frame("Przekroczono limit ramek", frame)
+    error["retry_after_ms"] = int(retry_after * 1000) + 1
+    manager.send(websocket, error)
+    return False
+
+
+CONTROL_FRAME_TYPES = {"read", "heartbeat", "typing", "subscribe", "unsubscribe", "message"}
+
+async def _receive(websocket: WebSocket) -> Tuple[Optional[dict], Optional[str]]:
+    """Kolejna ramka klienta jako (ramka sterująca, tekst).
+
+    Ramki tekstowe to JSON albo zwykły tekst (treść wiadomości), binarne - MessagePack.
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("text") is not None:
+        return _control_frame(message["text"]), message["text"]
+    try:
+        frame = CODECS["msgpack"].decode(message["bytes"])
+    except Exception:
+        return None, None
+    return (frame if _is_control_frame(frame) else None), None
+
+
+def _control_frame(data: str) -> Optional[dict]:
+    """Ramka sterująca ({"type": ...}); zwykły tekst jest treścią wiadomości"""
+    if not data.startswith("{"):
+        return None
+    try:
+        frame = orjson.loads(data)
+    except ValueError:
+        return None
+    return frame if _is_control_frame(frame) else None
+
+
+def _is_control_frame(frame) -> bool:
+    return isinstance(frame, dict) and frame.get("type") in CONTROL_FRAME_TYPES
+
+
+def _resync_frame(chat_id: int) -> dict:
+    """Luka po reconnect wykracza poza strumień pokoju - klient musi pobrać historię"""
+    return {"type": "resync", "chat_id": chat_id}
+
+
+def _error_frame(detail: str, frame: Optional[dict] = None) -> dict:
+    error = {"type": "error", "detail": detail}
+    if frame is not None:
+        error["request"] = frame.get("type")
+        error["chat_id"] = frame.get("chat_id")
+    return error
+
 class ChatCreate(BaseModel):
     userId: str
+
+class ReadCursor(BaseModel):
+    message_id: int
     
-@router.get("/chats/")
-async def list_chats(user=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+@router.get("/chats/", dependencies=[Depends(rate_limit("http:list_chats"))])
+async def list_chats(user=Depends(get_current_user), db: AsyncSession = Depends(get_read_db)):
     result = await db.execute(
         select(User)
         .options(
@@ -150,53 +284,41 @@ async def list_chats(user=Depends(get_current_user), db: AsyncSession = Depends(
     if not user_db:
         return []
     
-    async with httpx.AsyncClient() as client:
-        async def fetch_picture(participant):
-            try:
-                resp = await client.get(f"http://user_service:8000/admin/api/users/users/{participant.id}")
-                if resp.status_code == 200:
-                    data = resp.json()
-                    return data.get("picture")
-                return None
-            except Exception:
-                return None
-
-        chats_response = []
-        for chat in user_db.chats:
-            tasks = [fetch_picture(p) for p in chat.participants]
-            pictures = await asyncio.gather(*tasks)
-            participants_data = [
-                {"id": p.id, "username": p.username, "picture": pictures[idx]}
-                for idx, p in enumerate(chat.participants)
-            ]
-            chats_response.append({
-                "id": chat.id,
-                "name": chat.name,
-                "participants": participants_data,
-            })
-    return chats_response
+    # Jedno zbiorcze pobranie profili dla unikalnych uczestników wszystkich czatów
+    profiles = await profile_service.get_many(p.id for chat in user_db.chats for p in chat.participants)
+    # Nieprzeczytane i podglądy ostatnich wiadomości są utrzymywane na bieżąco w Redisie
+    chat_summaries = await summaries(db, user_db.id, user_db.username, [chat.id for chat in user_db.chats])
+
+    def picture(participant):
+        return (profiles.get(participant.id) or {}).get("picture")
+
+    # Odpowiedź budujemy sami - bez przechodzenia przez jsonable_encoder
+    return ORJSONResponse([
+        {
+            "id": chat.id,
+            "name": chat.name,
+            "participants": [
+                {"id": p.id, "username": p.username, "picture": picture(p)} for p in chat.participants
+            ],
+            **chat_summaries[chat.id],
+        }
+        for chat in user_db.chats
+    ])
 
 @router.post("/chats/")
 async def create_chat(chat: ChatCreate, user=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     """ Tworzenie nowego czatu """
     participant = chat.userId
-    # existing_chat = await db.execute(select(Chat).where(Chat.name == chat_name))
-    # if existing_chat.scalar():
-    #     raise HTTPException(status_code=400, detail="Chat already exists")
-
-    chat = Chat(name="")
-    user_db = await db.execute(select(User).where(User.id == user["sub"]))
-    user_2 = await db.execute(select(User).where(User.id == participant))
-    user_db = user_db.scalar()
-    user_2 = user_2.scalar()
+    if participant == user["sub"]:
+        raise HTTPException(status_code=400, detail="Nie można utworzyć czatu z samym sobą")
+    user_a, user_b = sorted([user["sub"], participant])
 
-    if not user_db or not user_2:
+    users_found = await db.scalar(select(func.count()).select_from(User).where(User.id.in_([user_a, user_b])))
+    if users_found != 2:
         raise HTTPException(status_code=400, detail="Użytkownik musi być zarejestrowany")
 
-    chat.participants.append(user_db)
-    chat.participants.append(user_2)
-    db.add(chat)
-    await db.commit()
+    # Czat dwóch osób to czat 1:1 - ta sama ścieżka co get-or-create, bez duplikatów
+    chat, _ = await _get_or_create_dm(db, user_a, user_b)
     return {"message": "Chat created", "chat_id": chat.id}
 
 # @router.get("/chats/")
@@ -215,26 +337,130 @@ async def create_chat(chat: ChatCreate, user=Depends(get_current_user), db: Asyn
 #     return [{"id": chat.id, "name": chat.name, "participants": [{"id": p.id, "username": p.username} for p in chat.participants]} for chat in user_db.chats]
 
 
-@router.get("/chats/{chat_id}/search")
-async def search_chat_messages(chat_id: str, query: str):
-    """Wyszukuje wiadomości w czacie"""
-    messages = await search_messages(query, chat_id)
+@router.post("/chats/{chat_id}/read")
+async def mark_chat_read(chat_id: int, cursor: ReadCursor, user=Depends(require_member), db: AsyncSession = Depends(get_db)):
+    """Przesuwa kursor odczytu użytkownika w czacie"""
+    remaining = await mark_read(db, user["sub"], chat_id, cursor.message_id)
+    if remaining is None:
+        raise HTTPException(status_code=404, detail="Wiadomość nie istnieje w tym czacie")
+    return {"chat_id": chat_id, "unread": remaining}
+
+
+@router.get("/presence")
+async def get_presence(user_ids: List[str] = Query(...), user=Depends(verify_token)):
+    """Obecność wielu użytkowników naraz (`user_ids=a,b,c` lub powtórzony parametr)"""
+    ids = [user_id for value in user_ids for user_id in value.split(",") if user_id]
+    if len(ids) > PRESENCE_BATCH_MAX_USERS:
+        raise HTTPException(status_code=400, detail=f"Maksymalnie {PRESENCE_BATCH_MAX_USERS} użytkowników")
+    return await online(ids)
+
+
+@router.get("/chats/{chat_id}/search", dependencies=[Depends(rate_limit("http:search"))])
+async def search_chat_messages(
+    chat_id: str,
+    query: str,
+    limit: int = Query(20, ge=1, le=100),
+    after: Optional[str] = None,
+    user=Depends(require_member),
+):
+    """Wyszukuje wiadomości w czacie (`after` = `cursor` ostatniego wyniku poprzedniej strony)"""
+    if after is not None:
+        _search_cursor(after)
+    messages = await search_messages(query, chat_id, limit=limit, after=after)
     return messages
 
 
 
-@router.get("/chats/{chat_id}/messages", response_model=List[dict])
-async def get_chat_history(chat_id: int, limit: int = 50, db: AsyncSession = Depends(get_db)):
-    """ Pobiera historię wiadomości dla danego czatu """
-    result = await db.execute(
-        select(Message).where(Message.chat_id == chat_id).order_by(Message.timestamp.desc()).limit(limit)
+@router.get("/chats/{chat_id}/messages", response_model=List[dict], dependencies=[Depends(rate_limit("http:history"))])
+async def get_chat_history(
+    chat_id: int,
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    user=Depends(require_member),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """ Pobiera historię wiadomości dla danego czatu (od najnowszych).
+
+    `before` / `after` to `cursor` wiadomości, od której pobieramy starsze / nowsze.
+    """
+    messages = await history_cache.get_history(
+        chat_id,
+        limit,
+        _history_cursor(before) if before else None,
+        _history_cursor(after) if after else None,
+        lambda *window: _load_history(db, chat_id, *window),
+    )
+    return ORJSONResponse(
+        [{**message, "cursor": encode_cursor([message["timestamp"], message["id"]])} for message in messages]
     )
-    messages = result.scalars().all()
 
-    if not messages:
-        return []
 
-    return [{"id": msg.id, "sender": msg.sender, "content": msg.content, "timestamp": msg.timestamp} for msg in messages]
+async def _load_history(db: AsyncSession, chat_id: int, limit: int, before=None, after=None) -> List[dict]:
+    """Historia z Postgresa (od najnowszej), stronicowana kursorem po (timestamp, id)"""
+    position = tuple_(Message.timestamp, Message.id)
+    stmt = select(Message.id, Message.sender, Message.content, Message.timestamp).where(Message.chat_id == chat_id)
+    # Osobny warunek na samym timestamp pozwala plannerowi pominąć partycje spoza okna
+    if after:
+        stmt = stmt.where(Message.timestamp >= after[0], position > tuple_(*after)).order_by(Message.timestamp, Message.id)
+    else:
+        if before:
+            stmt = stmt.where(Message.timestamp <= before[0], position < tuple_(*before))
+        stmt = stmt.order_by(Message.timestamp.desc(), Message.id.desc())
+    rows = (await db.execute(stmt.limit(limit))).all()
+    if after:
+        rows.reverse()
+    messages = [
+        {"id": row.id, "sender": row.sender, "content": row.content, "timestamp": row.timestamp.isoformat()}
+        for row in rows
+    ]
+    return await _with_archived(db, chat_id, limit, before, after, messages)
+
+
+async def _with_archived(db: AsyncSession, chat_id: int, limit: int, before, after, messages: List[dict]) -> List[dict]:
+    """Uzupełnia okno historii wiadomościami z zarchiwizowanych (odłączonych) partycji"""
+    until = archive.archived_until()
+    if until is None:
+        return messages
+    if after:
+        if after[0] >= until:
+            return messages
+        # Najstarsza część okna leży w archiwum
+        archived = await asyncio.to_thread(archive.read_history, chat_id, limit, None, after)
+        live_ids = {m["id"] for m in messages}
+        combined = [m for m in reversed(archived) if m["id"] not in live_ids] + list(reversed(messages))
+        return list(reversed(combined[:limit]))
+    if len(messages) >= limit or not await _created_before(db, chat_id, until):
+        return messages
+    # Baza nie ma starszych wiadomości - dalsza historia może być tylko w archiwum
+    boundary = history_cache.position(messages[-1]) if messages else before
+    archived = await asyncio.to_thread(archive.read_history, chat_id, limit - len(messages), boundary, None)
+    return messages + archived
+
+
+async def _created_before(db: AsyncSession, chat_id: int, until: datetime) -> bool:
+    """Czy czat powstał przed końcem archiwum (czaty bez daty utworzenia traktujemy jak stare)"""
+    created_at = chat_created_at.get(chat_id)
+    if created_at is None:
+        created_at = await db.scalar(select(Chat.created_at).where(Chat.id == chat_id)) or datetime.min
+        chat_created_at.set(chat_id, created_at)
+    return created_at < until
+
+
+def _history_cursor(cursor: str):
+    try:
+        timestamp, message_id = decode_cursor(cursor)
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Nieprawidłowy kursor")
+
+def _search_cursor(cursor: str):
+    # search_after wyszukiwania: [_score, timestamp, id]
+    try:
+        score, timestamp, message_id = decode_cursor(cursor)
+        return float(score), int(timestamp), int(message_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Nieprawidłowy kursor")
 
 @router.get("/test")
 async def test_endpoint():
@@ -251,37 +477,40 @@ async def get_or_create_chat(
     Jeśli taki nie istnieje (i jest zarejestrowany user), tworzy nowy.
     """
     current_user_id = user["sub"]
-    user_db = await db.execute(select(User).where(User.id == current_user_id))
-    result_other = await db.execute(select(User).where(User.id == other_user_id))
-    other_user_db = result_other.scalar()
-    if not other_user_db or not user_db.scalar():
-        raise HTTPException(status_code=404, detail="Użytkownik nie istnieje w bazie")
-
-    stmt = (
-        select(Chat)
-        .options(selectinload(Chat.participants))
-        .join(user_chat_association, Chat.id == user_chat_association.c.chat_id)
-        .where(user_chat_association.c.user_id.in_([current_user_id, other_user_id]))
-        .group_by(Chat.id)
-        .having(func.count(distinct(user_chat_association.c.user_id)) == 2)
-    )
-    
-    existing_chat = (await db.execute(stmt)).scalars().first()
-    if existing_chat:
-        return {"chat": {"id": existing_chat.id, "name": existing_chat.name, "participants": [{"id": p.id, "username": p.username} for p in existing_chat.participants]}, "detail": "existing_chat"}
-    
-    # Tworzymy nowy czat
-    new_chat = Chat(name="")
-    result_current = await db.execute(select(User).where(User.id == current_user_id))
-    current_user_db = result_current.scalar()
-    if not current_user_db:
-        raise HTTPException(status_code=401, detail="Aktualny użytkownik nie znaleziony w bazie")
-
-    new_chat.participants.append(current_user_db)
-    new_chat.participants.append(other_user_db)
+    if other_user_id == current_user_id:
+        raise HTTPException(status_code=400, detail="Nie można utworzyć czatu z samym sobą")
+    user_a, user_b = sorted([current_user_id, other_user_id])
 
-    db.add(new_chat)
-    await db.commit()
-    await db.refresh(new_chat)
+    users_found = await db.scalar(select(func.count()).select_from(User).where(User.id.in_([user_a, user_b])))
+    if users_found != 2:
+        raise HTTPException(status_code=404, detail="Użytkownik nie istnieje w bazie")
 
-    return {"chat": {"id": new_chat.id, "name": new_chat.name, "participants": [{"id": p.id, "username": p.username} for p in new_chat.participants]}, "detail": "created_new_chat"}
\ No newline at end of file
+    chat, created = await _get_or_create_dm(db, user_a, user_b)
+    detail = "created_new_chat" if created else "existing_chat"
+    return {"chat": {"id": chat.id, "name": chat.name, "participants": [{"id": p.id, "username": p.username} for p in chat.participants]}, "detail": detail}
+
+
+async def _get_or_create_dm(db: AsyncSession, user_a: str, user_b: str) -> Tuple[Chat, bool]:
+    """Czat 1:1 dla pary (user_a < user_b); zwraca (czat, czy utworzono nowy)"""
+    # Czat 1:1 ma unikalny klucz (dm_user_a, dm_user_b) - wyszukanie to jedno trafienie w indeks
+    stmt = select(Chat).options(selectinload(Chat.participants)).where(Chat.dm_user_a == user_a, Chat.dm_user_b == user_b)
+    chat = (await db.execute(stmt)).scalar()
+    new_chat_id = None
+    if not chat:
+        # ON CONFLICT - równoległe wywołania dla tej samej pary nie utworzą duplikatu
+        new_chat_id = await db.scalar(
+            pg_insert(Chat)
+            .values(name="", created_at=datetime.utcnow(), dm_user_a=user_a, dm_user_b=user_b)
+            .on_conflict_do_nothing(constraint="uq_chats_dm_pair")
+            .returning(Chat.id)
+        )
+        if new_chat_id is not None:
+            await db.execute(
+                insert(user_chat_association),
+                [{"user_id": user_a, "chat_id": new_chat_id}, {"user_id": user_b, "chat_id": new_chat_id}],
+            )
+        await db.commit()
+        chat = (await db.execute(stmt.execution_options(populate_existing=True))).scalar()
+        if new_chat_id is not None:
+            await add_members(chat.id, [user_a, user_b])
+    return chat, new_chat_id is not None
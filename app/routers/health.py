@@ -0,0 +1,22 @@
+from fastapi import APIRouter
+from fastapi.responses import ORJSONResponse
+
+from app.lifecycle import state
+
+router = APIRouter()
+
+
+@router.get("/healthz")
+async def liveness():
+    """Proces działa i pętla zdarzeń odpowiada"""
+    return {"status": "ok"}
+
+
+@router.get("/readyz")
+async def readiness():
+    """Węzeł przyjmuje ruch: start zakończony i nie trwa zatrzymywanie"""
+    if state.draining:
+        return ORJSONResponse({"status": "draining"}, status_code=503)
+    if not state.ready:
+        return ORJSONResponse({"status": "starting"}, status_code=503)
+    return {"status": "ready"}
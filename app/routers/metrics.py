@@ -1,9 +1,16 @@
-from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest, multiprocess
 from fastapi import APIRouter, Response
 
+from app.instrumentation import MULTIPROCESS
+
 router = APIRouter()
 
 
 @router.get("/metrics")
 async def metrics():
+    if MULTIPROCESS:
+        # Każdy worker ma własne liczniki - agregujemy pliki wszystkich procesów
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
     return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,10 +1,19 @@
-from fastapi import APIRouter
-from app.search import search_users
+from fastapi import APIRouter, Depends, Query
+from app.ratelimit import rate_limit
+from app.user_search import find_users
+
+# Limit strony wyników; `offset` ograniczony, bo głębokie strony podpowiedzi nie mają sensu
+USER_SEARCH_MAX_LIMIT = 50
+USER_SEARCH_MAX_OFFSET = 1000
 
 router = APIRouter()
 
-@router.get("/api/chat/users/search")
-async def search_users_api(username: str):
-    """Wyszukuje użytkowników w Elasticsearch"""
-    users = await search_users(username)
-    return users
\ No newline at end of file
+@router.get("/api/chat/users/search", dependencies=[Depends(rate_limit("http:user_search", by="ip"))])
+async def search_users_api(
+    username: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=USER_SEARCH_MAX_LIMIT),
+    offset: int = Query(0, ge=0, le=USER_SEARCH_MAX_OFFSET),
+):
+    """Wyszukuje użytkowników po prefiksie nazwy (strona `limit` wyników od `offset`)"""
+    users = await find_users(username, limit=limit, offset=offset)
+    return users
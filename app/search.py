@@ -1,41 +1,355 @@
-from elasticsearch import AsyncElasticsearch
+from elasticsearch import ApiError, AsyncElasticsearch, TransportError
+from prometheus_client import Counter, Gauge, Histogram
+from collections import deque
+from datetime import datetime
+from typing import Deque, List, Optional, Tuple
+import asyncio
+import json
+import logging
 import os
+import random
+import time
+
+from app.pagination import decode_cursor, encode_cursor
 
 ELASTICSEARCH_URL = os.getenv("ELASTICSEARCH_URL", "http://elasticsearch:9200")
+# Limity partii `_bulk` i bufora dokumentów czekających na indeksowanie
+ES_BULK_MAX_DOCS = int(os.getenv("ES_BULK_MAX_DOCS", "1000"))
+ES_BULK_MAX_BYTES = int(os.getenv("ES_BULK_MAX_BYTES", str(5 * 1024 * 1024)))
+ES_BULK_FLUSH_INTERVAL_MS = int(os.getenv("ES_BULK_FLUSH_INTERVAL_MS", "1000"))
+ES_BULK_BUFFER_SIZE = int(os.getenv("ES_BULK_BUFFER_SIZE", "50000"))
+ES_BULK_MAX_RETRIES = int(os.getenv("ES_BULK_MAX_RETRIES", "5"))
+# Wiadomości: alias `messages` wskazuje na indeksy czasowe `messages-NNNNNN`
+MESSAGES_ALIAS = "messages"
+MESSAGES_SHARDS = int(os.getenv("ES_MESSAGES_SHARDS", "3"))
+MESSAGES_ROLLOVER_CONDITIONS = {
+    "max_age": os.getenv("ES_MESSAGES_ROLLOVER_MAX_AGE", "30d"),
+    "max_primary_shard_size": os.getenv("ES_MESSAGES_ROLLOVER_MAX_SHARD_SIZE", "30gb"),
+}
+MESSAGES_ROLLOVER_CHECK_INTERVAL = int(os.getenv("ES_MESSAGES_ROLLOVER_CHECK_INTERVAL", "3600"))
+# Użytkownicy: alias `users` wskazuje na indeks przebudowywany przez `python -m app.cli sync-users`
+USERS_ALIAS = "users"
+
+logger = logging.getLogger(__name__)
 
 es_client = AsyncElasticsearch([ELASTICSEARCH_URL])
 
-async def index_user(user_id: str, username: str):
-    """Indeksuje użytkownika w Elasticsearch"""
-    await es_client.index(index="users", id=user_id, body={"id": user_id, "username": username})
+BULK_BUFFER_DOCS = Gauge(
+    "chat_es_bulk_buffer_docs", "Dokumenty czekające w buforze indeksowania", multiprocess_mode="livesum"
+)
+BULK_BATCH_DOCS = Histogram(
+    "chat_es_bulk_batch_docs", "Liczba dokumentów w jednym żądaniu _bulk",
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+BULK_LAG = Histogram(
+    "chat_es_bulk_lag_seconds", "Czas od przyjęcia dokumentu do jego zaindeksowania",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+BULK_REQUEST_DURATION = Histogram(
+    "chat_es_bulk_request_seconds", "Czas jednego żądania _bulk do Elasticsearch",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+BULK_RETRIES = Counter("chat_es_bulk_retries_total", "Ponowienia żądań _bulk (429 / błędy połączenia)")
+BULK_FAILED_DOCS = Counter("chat_es_bulk_failed_docs_total", "Dokumenty, których nie udało się zaindeksować")
+
+# (akcja, dokument, rozmiar w bajtach, czas przyjęcia)
+BulkItem = Tuple[dict, dict, int, float]
+
+
+class BulkIndexer:
+    """Buforuje dokumenty i wysyła je do Elasticsearch przez API `_bulk`.
+
+    Partia jest wysyłana po zebraniu `max_docs` dokumentów lub `max_bytes` bajtów
+    albo co `flush_interval`. Odpowiedzi 429 są ponawiane z wykładniczym odstępem.
+    """
+
+    def __init__(
+        self,
+        client: AsyncElasticsearch,
+        max_docs: int = ES_BULK_MAX_DOCS,
+        max_bytes: int = ES_BULK_MAX_BYTES,
+        flush_interval: float = ES_BULK_FLUSH_INTERVAL_MS / 1000,
+        buffer_size: int = ES_BULK_BUFFER_SIZE,
+        max_retries: int = ES_BULK_MAX_RETRIES,
+    ):
+        self.client = client
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.max_retries = max_retries
+        self.buffer: Deque[BulkItem] = deque()
+        self.buffer_bytes = 0
+        self._flush_now = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Zatrzymuje pętlę i wysyła wszystko, co zostało w buforze"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Każde wywołanie zdejmuje partię z bufora, więc pętla się kończy także przy błędach
+        while self.buffer:
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Błąd indeksowania partii w Elasticsearch")
+
+    async def add(self, index: str, document: dict, doc_id: Optional[str] = None, routing: Optional[str] = None):
+        """Dodaje dokument do bufora; czeka tylko wtedy, gdy bufor jest pełny"""
+        while len(self.buffer) >= self.buffer_size:
+            self._space.clear()
+            self._flush_now.set()
+            await self._space.wait()
+        action = {"_index": index}
+        if doc_id is not None:
+            action["_id"] = doc_id
+        if routing is not None:
+            action["routing"] = routing
+        size = len(json.dumps(document))
+        self.buffer.append(({"index": action}, document, size, time.monotonic()))
+        self.buffer_bytes += size
+        BULK_BUFFER_DOCS.inc()
+        if len(self.buffer) >= self.max_docs or self.buffer_bytes >= self.max_bytes:
+            self._flush_now.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            while self.buffer:
+                try:
+                    await self.flush()
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception("Błąd indeksowania partii w Elasticsearch")
+                    break
+
+    def _take_batch(self) -> List[BulkItem]:
+        batch, size = [], 0
+        while self.buffer and len(batch) < self.max_docs and (not batch or size + self.buffer[0][2] <= self.max_bytes):
+            item = self.buffer.popleft()
+            batch.append(item)
+            size += item[2]
+        self.buffer_bytes -= size
+        BULK_BUFFER_DOCS.dec(len(batch))
+        self._space.set()
+        return batch
+
+    async def flush(self):
+        """Wysyła jedną partię, ponawiając dokumenty odrzucone z kodem 429"""
+        pending = self._take_batch()
+        if not pending:
+            return
+        BULK_BATCH_DOCS.observe(len(pending))
+        for attempt in range(self.max_retries + 1):
+            operations = []
+            for action, document, _, _ in pending:
+                operations += [action, document]
+            try:
+                with BULK_REQUEST_DURATION.time():
+                    response = await self.client.bulk(operations=operations)
+            except (ApiError, TransportError) as e:
+                if isinstance(e, ApiError) and e.meta.status != 429:
+                    # Błąd całego żądania (np. 400) - ponowienie nic nie zmieni
+                    BULK_FAILED_DOCS.inc(len(pending))
+                    logger.error("Elasticsearch odrzucił partię %d dokumentów: %s", len(pending), e)
+                    return
+                retry = pending
+            else:
+                retry = []
+                now = time.monotonic()
+                for item, result in zip(pending, response["items"]):
+                    status = next(iter(result.values()))["status"]
+                    if status == 429:
+                        retry.append(item)
+                    elif status >= 300:
+                        BULK_FAILED_DOCS.inc()
+                        logger.error("Elasticsearch odrzucił dokument: %s", result)
+                    else:
+                        BULK_LAG.observe(now - item[3])
+            if not retry:
+                return
+            pending = retry
+            BULK_RETRIES.inc()
+            await asyncio.sleep(min(30.0, 0.1 * 2 ** attempt) * random.uniform(0.5, 1.5))
+        BULK_FAILED_DOCS.inc(len(pending))
+        logger.error("Porzucono %d dokumentów po %d próbach", len(pending), self.max_retries + 1)
+
+
+bulk_indexer = BulkIndexer(es_client)
+
+
+def messages_index_body() -> dict:
+    """Ustawienia i mapowanie indeksów wiadomości (`messages-000001`, `messages-000002`, ...)"""
+    return {
+        "settings": {
+            "number_of_shards": MESSAGES_SHARDS,
+            "number_of_replicas": 0,
+        },
+        "mappings": {
+            "_routing": {"required": True},
+            "properties": {
+                "id": {"type": "long"},
+                "chat_id": {"type": "keyword"},
+                "sender": {"type": "keyword"},
+                "content": {"type": "text"},
+                "timestamp": {"type": "date"},
+            },
+        },
+    }
+
+
+async def legacy_messages_index_exists(alias: str = MESSAGES_ALIAS) -> bool:
+    """Czy `alias` jest jeszcze zwykłym indeksem z dynamicznym mapowaniem"""
+    return await es_client.indices.exists(index=alias) and not await es_client.indices.exists_alias(name=alias)
+
+
+async def ensure_messages_index(alias: str = MESSAGES_ALIAS):
+    """Tworzy szablon indeksów wiadomości i pierwszy indeks z aliasem zapisu `alias`"""
+    await es_client.indices.put_index_template(
+        name=alias, index_patterns=[f"{alias}-*"], template=messages_index_body()
+    )
+    if await legacy_messages_index_exists(alias):
+        logger.warning("Indeks %s ma dynamiczne mapowanie - uruchom `python -m app.cli reindex-messages`", alias)
+        return
+    if not await es_client.indices.exists_alias(name=alias):
+        # 400 (resource_already_exists) - indeks założył w tym czasie inny worker
+        await es_client.options(ignore_status=400).indices.create(
+            index=f"{alias}-000001", aliases={alias: {"is_write_index": True}}, **messages_index_body()
+        )
 
-async def search_users(query: str):
-    """Wyszukuje użytkowników w Elasticsearch"""
-    response = await es_client.search(index="users", body={
+
+async def rollover_messages_index(alias: str = MESSAGES_ALIAS):
+    """Przełącza alias zapisu na nowy indeks, jeśli bieżący jest za stary lub za duży"""
+    if await legacy_messages_index_exists(alias):
+        return
+    await es_client.indices.rollover(alias=alias, conditions=MESSAGES_ROLLOVER_CONDITIONS)
+
+
+async def rollover_messages_periodically():
+    while True:
+        await asyncio.sleep(MESSAGES_ROLLOVER_CHECK_INTERVAL)
+        try:
+            await rollover_messages_index()
+        except Exception:
+            logger.exception("Nie udało się sprawdzić rollovera indeksu wiadomości")
+
+
+def users_index_body() -> dict:
+    """Indeks użytkowników: `username` jako `search_as_you_type` (prefiksy bez zapytań `prefix`)"""
+    return {
+        "settings": {
+            "number_of_shards": 1,
+            "number_of_replicas": 0,
+            "analysis": {"normalizer": {"lowercase": {"type": "custom", "filter": ["lowercase"]}}},
+        },
+        "mappings": {
+            "properties": {
+                "id": {"type": "keyword"},
+                "username": {
+                    "type": "search_as_you_type",
+                    "fields": {"raw": {"type": "keyword", "normalizer": "lowercase"}},
+                },
+            },
+        },
+    }
+
+
+async def legacy_users_index_exists(alias: str = USERS_ALIAS) -> bool:
+    """Czy `alias` jest jeszcze zwykłym indeksem z polem `username` typu `text`"""
+    return await es_client.indices.exists(index=alias) and not await es_client.indices.exists_alias(name=alias)
+
+
+async def ensure_users_index(alias: str = USERS_ALIAS):
+    """Tworzy pierwszy indeks użytkowników z aliasem `alias`"""
+    if await legacy_users_index_exists(alias):
+        logger.warning("Indeks %s ma stare mapowanie - uruchom `python -m app.cli sync-users`", alias)
+        return
+    if not await es_client.indices.exists_alias(name=alias):
+        await es_client.options(ignore_status=400).indices.create(
+            index=f"{alias}-000001", aliases={alias: {}}, **users_index_body()
+        )
+
+
+async def index_user(user_id: str, username: str, index: str = USERS_ALIAS):
+    """Indeksuje użytkownika w Elasticsearch (przez bufor `_bulk`)"""
+    await bulk_indexer.add(index, {"id": user_id, "username": username}, doc_id=user_id)
+
+
+async def search_users(query: str, limit: int = 20, offset: int = 0, index: str = USERS_ALIAS):
+    """Wyszukuje użytkowników, których nazwa (lub jej kolejne słowo) zaczyna się od `query`"""
+    response = await es_client.search(index=index, body={
         "query": {
-            "prefix": {"username": query},
-        }
+            "multi_match": {
+                "query": query,
+                "type": "bool_prefix",
+                "fields": ["username", "username._2gram", "username._3gram"],
+            },
+        },
+        "sort": [{"_score": "desc"}, {"username.raw": {"order": "asc", "unmapped_type": "keyword"}}],
+        "_source": ["id", "username"],
+        "from": offset,
+        "size": limit,
     })
     return [hit["_source"] for hit in response["hits"]["hits"]]
-  
-async def index_message(chat_id: str, sender: str, content: str):
-    """Indeksuje wiadomość czatu w Elasticsearch"""
-    await es_client.index(index="messages", body={
-        "chat_id": chat_id,
+
+
+async def index_message(message_id: int, chat_id: str, sender: str, content: str, timestamp: datetime, index: str = MESSAGES_ALIAS):
+    """Indeksuje wiadomość czatu w Elasticsearch (przez bufor `_bulk`, routing po chat_id)"""
+    await bulk_indexer.add(index, {
+        "id": message_id,
+        "chat_id": str(chat_id),
         "sender": sender,
-        "content": content
-    })
+        "content": content,
+        "timestamp": timestamp.isoformat(),
+    }, doc_id=str(message_id), routing=str(chat_id))
+
 
-async def search_messages(query: str, chat_id: str):
-    """Wyszukuje wiadomości w czacie"""
-    response = await es_client.search(index="messages", body={
+async def search_messages(query: str, chat_id: str, limit: int = 20, after: Optional[str] = None, index: str = MESSAGES_ALIAS):
+    """Wyszukuje wiadomości w czacie.
+
+    chat_id jest filtrem (bez liczenia trafności) i kluczem routingu, więc
+    zapytanie trafia tylko do jednego sharda. Każdy wynik ma `cursor`, który
+    przekazany jako `after` zwraca kolejną stronę.
+    """
+    body = {
         "query": {
             "bool": {
-                "must": [
-                    {"match": {"content": query}},
-                    {"match": {"chat_id": chat_id}}
-                ]
+                "must": [{"match": {"content": query}}],
+                "filter": [{"term": {"chat_id": str(chat_id)}}],
             }
+        },
+        "sort": [
+            {"_score": "desc"},
+            {"timestamp": {"order": "desc", "unmapped_type": "date"}},
+            {"id": {"order": "desc", "unmapped_type": "long"}},
+        ],
+        "highlight": {"fields": {"content": {}}},
+        "size": limit,
+    }
+    if after:
+        body["search_after"] = decode_cursor(after)
+    response = await es_client.search(index=index, routing=str(chat_id), body=body)
+    return [
+        {
+            **hit["_source"],
+            "highlight": hit.get("highlight", {}).get("content", []),
+            "cursor": encode_cursor(hit["sort"]),
         }
-    })
-    return [hit["_source"] for hit in response["hits"]["hits"]]
\ No newline at end of file
+        for hit in response["hits"]["hits"]
+    ]
@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from aioredis.exceptions import RedisError
+from sqlalchemy import and_, func, or_, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import SessionLocal
+from app.membership import chat_members
+from app.models import Message, user_chat_association
+from app.pubsub import ROOM_STREAM_MAXLEN, redis_client, room_stream
+
+UNREAD_PREVIEW_LENGTH = int(os.getenv("UNREAD_PREVIEW_LENGTH", "100"))
+# Jak długo pamiętamy odczyt wiadomości opublikowanej, ale jeszcze nie zapisanej w bazie
+UNREAD_PENDING_READ_TTL = int(os.getenv("UNREAD_PENDING_READ_TTL", "300"))
+
+# Hash chat_id -> ostatnia wiadomość czatu (podgląd na liście czatów)
+PREVIEWS_KEY = "chat_previews"
+
+logger = logging.getLogger(__name__)
+
+
+def unread_key(user_id: str) -> str:
+    """Hash chat_id -> liczba nieprzeczytanych wiadomości użytkownika"""
+    return f"unread:{user_id}"
+
+
+def pending_reads_key(chat_id) -> str:
+    """Hash user_id -> pozycja odczytanej wiadomości, której nie ma jeszcze w bazie"""
+    return f"pending_reads:{chat_id}"
+
+
+async def record_messages(messages: Iterable[Tuple[dict, Optional[str]]]):
+    """Aktualizuje podglądy i liczniki nieprzeczytanych dla zapisanej partii (wiadomość, id nadawcy)"""
+    by_chat: Dict[int, List[Tuple[dict, Optional[str]]]] = defaultdict(list)
+    for message, sender_id in messages:
+        by_chat[message["chat_id"]].append((message, sender_id))
+
+    async with SessionLocal() as db:
+        members = {chat_id: await chat_members(db, chat_id) for chat_id in by_chat}
+    # Uczestnicy, którzy odczytali te wiadomości, zanim trafiły do bazy - ich nie liczymy
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for chat_id in by_chat:
+            pipe.hgetall(pending_reads_key(chat_id))
+        pending_reads = {
+            chat_id: {user_id: _position(json.loads(read)) for user_id, read in reads.items()}
+            for chat_id, reads in zip(by_chat, await pipe.execute())
+        }
+
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for chat_id, chat_messages in by_chat.items():
+            last, _ = max(chat_messages, key=lambda m: (m[0]["timestamp"], m[0]["id"]))
+            pipe.hset(PREVIEWS_KEY, chat_id, json.dumps(_preview(last)))
+            unread = defaultdict(int)
+            reads = pending_reads[chat_id]
+            for message, sender_id in chat_messages:
+                for member in members[chat_id]:
+                    if member != sender_id and not (member in reads and _position(message) <= reads[member]):
+                        unread[member] += 1
+            for member, count in unread.items():
+                pipe.hincrby(unread_key(member), chat_id, count)
+        await pipe.execute()
+
+
+async def mark_read(db: AsyncSession, user_id: str, chat_id: int, message_id: int) -> Optional[int]:
+    """Przesuwa kursor odczytu użytkownika na `message_id`; zwraca liczbę pozostałych nieprzeczytanych.
+
+    W trybie "publish" klient może odczytać wiadomość, zanim trafi ona do bazy -
+    wtedy jej pozycję bierzemy ze strumienia pokoju, a `record_messages` nie
+    doliczy jej użytkownikowi po zapisie.
+    """
+    timestamp = await db.scalar(select(Message.timestamp).where(Message.id == message_id, Message.chat_id == chat_id))
+    if timestamp is None:
+        timestamp = await _published_timestamp(chat_id, message_id)
+        if timestamp is None:
+            return None
+        async with redis_client.pipeline(transaction=False) as pipe:
+            read = {"id": message_id, "timestamp": timestamp.isoformat()}
+            pipe.hset(pending_reads_key(chat_id), user_id, json.dumps(read))
+            pipe.expire(pending_reads_key(chat_id), UNREAD_PENDING_READ_TTL)
+            await pipe.execute()
+
+    current = (
+        await db.execute(
+            select(Message.timestamp, Message.id)
+            .join(user_chat_association, Message.id == user_chat_association.c.last_read_message_id)
+            .where(user_chat_association.c.user_id == user_id, user_chat_association.c.chat_id == chat_id)
+        )
+    ).first()
+    if current is None or tuple(current) < (timestamp, message_id):
+        await db.execute(
+            update(user_chat_association)
+            .where(user_chat_association.c.user_id == user_id, user_chat_association.c.chat_id == chat_id)
+            .values(last_read_message_id=message_id)
+        )
+        await db.commit()
+    else:
+        # Kursor odczytu się nie cofa
+        timestamp, message_id = current
+
+    # Najczęściej czytana jest ostatnia wiadomość czatu - wtedy nie liczymy niczego w bazie
+    preview = await redis_client.hget(PREVIEWS_KEY, chat_id)
+    if preview and _position(json.loads(preview)) <= (timestamp, message_id):
+        remaining = 0
+    else:
+        remaining = await db.scalar(
+            select(func.count())
+            .select_from(Message)
+            .where(
+                Message.chat_id == chat_id,
+                Message.timestamp >= timestamp,  # pozwala pominąć starsze partycje
+                tuple_(Message.timestamp, Message.id) > tuple_(timestamp, message_id),
+            )
+        )
+    await redis_client.hset(unread_key(user_id), chat_id, remaining)
+    return remaining
+
+
+async def _published_timestamp(chat_id: int, message_id: int) -> Optional[datetime]:
+    """Znacznik czasu wiadomości ze strumienia pokoju (najnowsze wpisy najpierw)"""
+    entries = await redis_client.xrevrange(room_stream(chat_id), count=ROOM_STREAM_MAXLEN)
+    for _, fields in entries:
+        message = json.loads(fields["data"])
+        if message.get("id") == message_id:
+            return datetime.fromisoformat(message["timestamp"])
+    return None
+
+
+async def summaries(db: AsyncSession, user_id: str, username: str, chat_ids: List[int]) -> Dict[int, dict]:
+    """Liczba nieprzeczytanych i podgląd ostatniej wiadomości dla czatów użytkownika (dwa odczyty z Redisa).
+
+    Gdy Redis nie działa, te same dane liczymy w Postgresie.
+    """
+    if not chat_ids:
+        return {}
+    try:
+        unread = await redis_client.hgetall(unread_key(user_id))
+        previews = await redis_client.hmget(PREVIEWS_KEY, chat_ids)
+    except RedisError:
+        logger.exception("Nie udało się odczytać nieprzeczytanych z Redisa")
+        return await _summaries_from_db(db, user_id, username, chat_ids)
+    return {
+        chat_id: {
+            "unread": int(unread.get(str(chat_id), 0)),
+            "last_message": json.loads(preview) if preview else None,
+        }
+        for chat_id, preview in zip(chat_ids, previews)
+    }
+
+
+async def _summaries_from_db(db: AsyncSession, user_id: str, username: str, chat_ids: List[int]) -> Dict[int, dict]:
+    last_messages = await db.execute(
+        select(Message.chat_id, Message.id, Message.sender, Message.content, Message.timestamp)
+        .where(Message.chat_id.in_(chat_ids))
+        .order_by(Message.chat_id, Message.timestamp.desc(), Message.id.desc())
+        .distinct(Message.chat_id)
+    )
+    previews = {
+        row.chat_id: _preview({
+            "id": row.id, "sender": row.sender, "content": row.content, "timestamp": row.timestamp.isoformat(),
+        })
+        for row in last_messages
+    }
+    # Pozycja kursora odczytu w każdym czacie (NULL - nic nie przeczytano)
+    cursors = (
+        select(user_chat_association.c.chat_id, Message.timestamp, Message.id)
+        .outerjoin(Message, Message.id == user_chat_association.c.last_read_message_id)
+        .where(user_chat_association.c.user_id == user_id, user_chat_association.c.chat_id.in_(chat_ids))
+        .subquery()
+    )
+    counts = await db.execute(
+        select(Message.chat_id, func.count())
+        .join(cursors, cursors.c.chat_id == Message.chat_id)
+        .where(
+            Message.sender != username,  # jak w record_messages - własnych wiadomości nie liczymy
+            or_(
+                cursors.c.id.is_(None),
+                and_(
+                    Message.timestamp >= cursors.c.timestamp,
+                    tuple_(Message.timestamp, Message.id) > tuple_(cursors.c.timestamp, cursors.c.id),
+                ),
+            ),
+        )
+        .group_by(Message.chat_id)
+    )
+    unread = dict(counts.all())
+    return {chat_id: {"unread": unread.get(chat_id, 0), "last_message": previews.get(chat_id)} for chat_id in chat_ids}
+
+
+def _preview(message: dict) -> dict:
+    return {
+        "id": message["id"],
+        "sender": message["sender"],
+        "content": message["content"][:UNREAD_PREVIEW_LENGTH],
+        "timestamp": message["timestamp"],
+    }
+
+
+def _position(message: dict) -> Tuple[datetime, int]:
+    return datetime.fromisoformat(message["timestamp"]), message["id"]
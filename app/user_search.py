@@ -0,0 +1,150 @@
+"""Wyszukiwanie użytkowników po prefiksie nazwy (podpowiedzi przy wpisywaniu).
+
+Krótkie prefiksy (najczęstsze i najdroższe w Elasticsearch) obsługuje lokalny,
+posortowany katalog nazw odświeżany z Postgresa (prefiks pasuje do początku
+każdego słowa nazwy, jak w ES); dłuższe trafiają do indeksu
+`users` z mapowaniem `search_as_you_type`, a ich wyniki są krótko cache'owane.
+"""
+import asyncio
+import bisect
+import logging
+import os
+import re
+import time
+from typing import List, Optional
+
+from prometheus_client import Counter
+from sqlalchemy import select
+
+from app.cache import TTLCache
+from app.database import ReadSessionLocal
+from app.models import User
+from app.search import search_users
+
+# Prefiksy do tej długości obsługuje katalog w pamięci procesu
+USER_SEARCH_LOCAL_PREFIX_MAX = int(os.getenv("USER_SEARCH_LOCAL_PREFIX_MAX", "3"))
+USER_DIRECTORY_REFRESH_INTERVAL = int(os.getenv("USER_DIRECTORY_REFRESH_INTERVAL", "300"))
+# Powyżej tej liczby użytkowników katalog nie jest ładowany (wszystko idzie do ES)
+USER_DIRECTORY_MAX_USERS = int(os.getenv("USER_DIRECTORY_MAX_USERS", "200000"))
+USER_SEARCH_CACHE_SIZE = int(os.getenv("USER_SEARCH_CACHE_SIZE", "10000"))
+USER_SEARCH_CACHE_TTL = int(os.getenv("USER_SEARCH_CACHE_TTL", "30"))
+
+logger = logging.getLogger(__name__)
+
+USER_SEARCHES = Counter("chat_user_search_total", "Wyszukiwania użytkowników wg źródła wyniku", ["source"])
+
+# Słowa nazwy jak w analizatorze standard ES: "." i "'" wewnątrz słowa go nie dzielą
+WORD = re.compile(r"\w+(?:[.'’:]\w+)*")
+
+
+def word_keys(username: str) -> List[str]:
+    """Klucze katalogu: nazwa od początku każdego słowa ("jan-kowalski" -> "jan-kowalski", "kowalski")"""
+    name = username.lower()
+    return list(dict.fromkeys(name[match.start():] for match in WORD.finditer(name))) or [name]
+
+
+class UserDirectory:
+    """Nazwy użytkowników posortowane bez względu na wielkość liter.
+
+    Jak `bool_prefix` w Elasticsearch prefiks pasuje do początku dowolnego słowa
+    nazwy, więc każdy użytkownik ma klucz od początku każdego słowa. Prefiks to
+    ciągły zakres listy kluczy - wyszukiwanie to jedno `bisect` plus odczyt
+    kolejnych elementów (bez powtórzeń użytkowników).
+    """
+
+    def __init__(self, refresh_interval: float = USER_DIRECTORY_REFRESH_INTERVAL, max_users: int = USER_DIRECTORY_MAX_USERS):
+        self.refresh_interval = refresh_interval
+        self.max_users = max_users
+        self.keys: List[str] = []
+        self.users: List[dict] = []
+        self.loaded_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.loaded_at is not None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Nie udało się odświeżyć katalogu użytkowników")
+            await asyncio.sleep(self.refresh_interval)
+
+    async def refresh(self):
+        async with ReadSessionLocal() as db:
+            rows = (await db.execute(
+                select(User.id, User.username).where(User.username.isnot(None)).limit(self.max_users + 1)
+            )).all()
+        if len(rows) > self.max_users:
+            logger.warning("Ponad %d użytkowników - katalog lokalny wyłączony", self.max_users)
+            self.keys, self.users, self.loaded_at = [], [], None
+            return
+        entries = sorted((key, user_id, username) for user_id, username in rows for key in word_keys(username))
+        self.keys = [key for key, _, _ in entries]
+        self.users = [{"id": user_id, "username": username} for _, user_id, username in entries]
+        self.loaded_at = time.monotonic()
+
+    def add(self, user_id: str, username: str):
+        """Dopisuje nowego użytkownika bez czekania na odświeżenie"""
+        if not self.ready:
+            return
+        user = {"id": user_id, "username": username}
+        for key in word_keys(username):
+            position = bisect.bisect_left(self.keys, key)
+            while position < len(self.keys) and self.keys[position] == key:
+                if self.users[position]["id"] == user_id:
+                    return
+                position += 1
+            self.keys.insert(position, key)
+            self.users.insert(position, user)
+
+    def search(self, prefix: str, limit: int, offset: int = 0) -> List[dict]:
+        key = prefix.lower()
+        seen, found = set(), []
+        for position in range(bisect.bisect_left(self.keys, key), len(self.keys)):
+            if not self.keys[position].startswith(key) or len(found) >= limit:
+                break
+            user = self.users[position]
+            if user["id"] in seen:
+                continue
+            seen.add(user["id"])
+            if len(seen) > offset:
+                found.append(user)
+        return found
+
+
+user_directory = UserDirectory()
+_results = TTLCache(USER_SEARCH_CACHE_SIZE, USER_SEARCH_CACHE_TTL)
+
+
+async def find_users(prefix: str, limit: int = 20, offset: int = 0) -> List[dict]:
+    """Strona użytkowników, w których nazwie któreś słowo zaczyna się od `prefix`"""
+    if len(prefix) <= USER_SEARCH_LOCAL_PREFIX_MAX and user_directory.ready:
+        USER_SEARCHES.labels("local").inc()
+        return user_directory.search(prefix, limit, offset)
+    key = (prefix.lower(), limit, offset)
+    users = _results.get(key)
+    if users is not None:
+        USER_SEARCHES.labels("cache").inc()
+        return users
+    USER_SEARCHES.labels("elasticsearch").inc()
+    users = await search_users(prefix, limit=limit, offset=offset)
+    _results.set(key, users)
+    return users
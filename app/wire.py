@@ -0,0 +1,57 @@
+from typing import Iterable, Optional, Union
+
+import msgpack
+import orjson
+
+# Podprotokoły WebSocket (Sec-WebSocket-Protocol) -> kodowanie ramek
+SUBPROTOCOLS = {
+    "chat.v1.json": "json",
+    "chat.v1.msgpack": "msgpack",
+}
+
+Frame = Union[str, bytes]
+
+
+class JSONCodec:
+    """Ramki tekstowe JSON (orjson)"""
+
+    name = "json"
+    binary = False
+
+    def encode(self, event: dict) -> str:
+        return orjson.dumps(event).decode()
+
+    def decode(self, data: Frame):
+        return orjson.loads(data)
+
+
+class MsgPackCodec:
+    """Ramki binarne MessagePack - mniejsze i szybsze w (de)serializacji"""
+
+    name = "msgpack"
+    binary = True
+
+    def encode(self, event: dict) -> bytes:
+        return msgpack.packb(event, use_bin_type=True)
+
+    def decode(self, data: Frame):
+        return msgpack.unpackb(data, raw=False)
+
+
+CODECS = {codec.name: codec for codec in (JSONCodec(), MsgPackCodec())}
+DEFAULT_CODEC = CODECS["json"]
+
+
+def negotiate(offered: Iterable[str]) -> Optional[str]:
+    """Pierwszy obsługiwany podprotokół spośród zaproponowanych przez klienta"""
+    for subprotocol in offered:
+        if subprotocol in SUBPROTOCOLS:
+            return subprotocol
+    return None
+
+
+def codec_for(subprotocol: Optional[str]):
+    """Kodek dla wynegocjowanego podprotokołu; bez podprotokołu - JSON"""
+    if subprotocol is None:
+        return DEFAULT_CODEC
+    return CODECS[SUBPROTOCOLS[subprotocol]]
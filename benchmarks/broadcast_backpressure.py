@@ -0,0 +1,72 @@
+"""Benchmark rozgłaszania w pokoju z jednym wolnym klientem.
+
+Mierzy opóźnienie dostarczenia (p50/p99) do szybkich klientów w pokoju
+o MEMBERS uczestnikach, gdy jeden klient odbiera ramki z opóźnieniem SLOW_MS.
+Wiadomości trafiają bezpośrednio do `manager.broadcast`; Redis jest potrzebny
+tylko do subskrypcji kanału i strumienia pokoju przy `connect`.
+
+    REDIS_URL=redis://localhost:6379 python -m benchmarks.broadcast_backpressure --members 500 --slow-ms 200
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from app.connections import manager
+from benchmarks.common import percentiles, report
+
+
+class FakeWebSocket:
+    def __init__(self, latencies, delay: float = 0.0):
+        self.latencies = latencies
+        self.delay = delay
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+    async def send_text(self, data: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.latencies.append(time.perf_counter() - json.loads(data)["sent_at"])
+
+
+async def main(members: int, messages: int, slow_ms: float, interval_ms: float):
+    fast_latencies, slow_latencies = [], []
+    sockets = [FakeWebSocket(slow_latencies, slow_ms / 1000)]
+    sockets += [FakeWebSocket(fast_latencies) for _ in range(members - 1)]
+    for ws in sockets:
+        await manager.connect("bench", ws)
+
+    started = time.perf_counter()
+    for _ in range(messages):
+        manager.broadcast("bench", {"sent_at": time.perf_counter()})
+        await asyncio.sleep(interval_ms / 1000)
+    expected = (members - 1) * messages
+    while len(fast_latencies) < expected and time.perf_counter() - started < 60:
+        await asyncio.sleep(0.01)
+
+    report(
+        "broadcast_backpressure",
+        members=members,
+        messages=messages,
+        slow_ms=slow_ms,
+        fast_latency_ms=percentiles(fast_latencies),
+        slow_delivered=len(slow_latencies),
+    )
+    for ws in sockets:
+        await manager.disconnect("bench", ws)
+    await manager.subscriber.stop()
+    await manager.streams.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--slow-ms", type=float, default=200)
+    parser.add_argument("--interval-ms", type=float, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.members, args.messages, args.slow_ms, args.interval_ms))
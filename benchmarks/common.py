@@ -0,0 +1,22 @@
+import json
+import sys
+import time
+from typing import Dict, List
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Zwraca p50/p90/p99/max (w ms) dla listy czasów w sekundach"""
+    if not samples:
+        return {"p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {"p50": pick(0.50), "p90": pick(0.90), "p99": pick(0.99), "max": round(ordered[-1] * 1000, 3)}
+
+
+def report(name: str, **results):
+    """Wypisuje wynik benchmarku jako jedną linię JSON (łatwą do porównania między commitami)"""
+    print(json.dumps({"benchmark": name, "time": time.time(), **results}, sort_keys=True))
+    sys.stdout.flush()
@@ -0,0 +1,59 @@
+"""Testowa para kluczy RSA i podpisywanie tokenów JWT jak Keycloak.
+
+Ustawia `JWT_PUBLIC_KEY`, więc musi być zaimportowany przed `app.routers.auth`.
+Klucz prywatny jest zapisywany w BENCH_JWT_KEY_FILE, żeby serwer uruchomiony
+osobno mógł weryfikować tokeny scenariuszy HTTP/WebSocket:
+
+    JWT_PUBLIC_KEY="$(python -m benchmarks.jwt_fixture)" uvicorn app.main:app
+"""
+import argparse
+import os
+import time
+import uuid
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwt
+
+BENCH_JWT_KEY_FILE = os.getenv("BENCH_JWT_KEY_FILE", "/tmp/chat-bench-jwt.pem")
+
+
+def _load_private_key():
+    if os.path.exists(BENCH_JWT_KEY_FILE):
+        with open(BENCH_JWT_KEY_FILE, "rb") as f:
+            return serialization.load_pem_private_key(f.read(), password=None)
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with open(BENCH_JWT_KEY_FILE, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    return key
+
+
+_private_key = _load_private_key()
+PRIVATE_KEY_PEM = _private_key.private_bytes(
+    serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+).decode()
+PUBLIC_KEY_PEM = _private_key.public_key().public_bytes(
+    serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+).decode()
+
+os.environ["JWT_PUBLIC_KEY"] = PUBLIC_KEY_PEM
+
+
+def make_token(user_id: str = None, username: str = None, ttl: int = 3600) -> str:
+    """Podpisuje token z polami, których używa serwis (`sub`, `preferred_username`, `exp`)"""
+    user_id = user_id or str(uuid.uuid4())
+    return jwt.encode(
+        {
+            "sub": user_id,
+            "preferred_username": username or f"user-{user_id[:8]}",
+            "exp": int(time.time()) + ttl,
+        },
+        PRIVATE_KEY_PEM,
+        algorithm="RS256",
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wypisuje klucz publiczny dla JWT_PUBLIC_KEY serwera")
+    parser.parse_args()
+    print(PUBLIC_KEY_PEM, end="")
@@ -0,0 +1,51 @@
+"""Mikrobenchmark weryfikacji tokenów JWT.
+
+Porównuje liczbę weryfikacji/s: dawną (PEM składany i parsowany przy każdym
+wywołaniu), z kluczem sparsowanym raz oraz `verify_token` z cache tokenów
+(TOKENS różnych tokenów weryfikowanych na zmianę).
+
+    python -m benchmarks.jwt_verify --iterations 5000
+"""
+import argparse
+import time
+
+from benchmarks.jwt_fixture import PUBLIC_KEY_PEM, make_token
+from jose import jwt
+
+from app.routers.auth import JWT_ALGORITHMS, public_keys, verified_tokens, verify_token
+from benchmarks.common import report
+
+
+def legacy_verify(token: str):
+    public_key = "".join(PUBLIC_KEY_PEM.splitlines(keepends=True))
+    return jwt.decode(token, public_key, algorithms=JWT_ALGORITHMS, options={"verify_aud": False})
+
+
+def parsed_key_verify(token: str):
+    key = public_keys.get(None)
+    return jwt.decode(token, key, algorithms=JWT_ALGORITHMS, options={"verify_aud": False})
+
+
+def rate(verify, tokens, iterations: int) -> float:
+    started = time.perf_counter()
+    for i in range(iterations):
+        verify(tokens[i % len(tokens)])
+    return round(iterations / (time.perf_counter() - started), 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--tokens", type=int, default=100)
+    args = parser.parse_args()
+
+    tokens = [make_token() for _ in range(args.tokens)]
+    verified_tokens.entries.clear()
+    report(
+        "jwt_verify",
+        iterations=args.iterations,
+        tokens=args.tokens,
+        legacy_per_sec=rate(legacy_verify, tokens, args.iterations),
+        parsed_key_per_sec=rate(parsed_key_verify, tokens, args.iterations),
+        cached_per_sec=rate(verify_token, tokens, args.iterations),
+    )
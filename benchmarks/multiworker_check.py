@@ -0,0 +1,203 @@
+"""Test integracyjny trybu wieloprocesowego: klienci jednego pokoju na różnych workerach.
+
+Uruchamia WORKERS osobnych procesów uvicorn (każdy z własnym NODE_ID, jak osobne
+pody) albo korzysta z podanych `--urls`. Uczestnicy każdego pokoju łączą się z
+workerami po kolei, kilku z nich wysyła ponumerowane wiadomości jednocześnie.
+Sprawdzamy, że każdy klient dostał każdą wiadomość dokładnie raz, że wszyscy
+klienci pokoju widzą tę samą kolejność (rosnące `stream_id`) i że wiadomości
+jednego nadawcy zachowują kolejność wysłania. Kod wyjścia 1 oznacza błąd.
+
+    python -m benchmarks.seed --chats 10 --messages 0 --rooms 10 --room-members 6
+    python -m benchmarks.multiworker_check --first-chat 1 --rooms 10 --members 6 --workers 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+from typing import Dict, List, Tuple
+
+import httpx
+import websockets
+
+from benchmarks.common import report
+from benchmarks.jwt_fixture import make_token
+from app.pubsub import stream_position
+from app.registry import ROOM_REGISTRY_FLUSH_INTERVAL, room_nodes
+
+# (stream_id, nadawca, numer wiadomości nadawcy)
+Received = Tuple[str, str, int]
+
+
+class Client:
+    def __init__(self, url: str, chat_id: int, user_id: str, run_id: str):
+        self.url = url
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.run_id = run_id
+        self.received: List[Received] = []
+        self.subscribed = asyncio.Event()
+        self.ws = None
+        self.reader = None
+
+    async def connect(self):
+        token = make_token(self.user_id, self.user_id)
+        self.ws = await websockets.connect(f"{self.url}/ws?token={token}", subprotocols=["chat.v1.json"])
+        self.reader = asyncio.create_task(self._read())
+        await self.ws.send(json.dumps({"type": "subscribe", "chat_id": self.chat_id}))
+        await asyncio.wait_for(self.subscribed.wait(), timeout=10)
+
+    async def send(self, seq: int):
+        content = json.dumps({"run": self.run_id, "sender": self.user_id, "seq": seq})
+        await self.ws.send(json.dumps({"type": "message", "chat_id": self.chat_id, "content": content}))
+
+    async def _read(self):
+        async for data in self.ws:
+            frame = json.loads(data)
+            if frame.get("type") == "subscribed":
+                self.subscribed.set()
+            elif "stream_id" in frame and frame.get("content", "").startswith("{"):
+                content = json.loads(frame["content"])
+                if content.get("run") == self.run_id:
+                    self.received.append((frame["stream_id"], content["sender"], content["seq"]))
+
+    async def close(self):
+        self.reader.cancel()
+        await self.ws.close()
+
+
+def start_workers(count: int, base_port: int) -> Tuple[List[subprocess.Popen], List[str]]:
+    processes, urls = [], []
+    for i in range(count):
+        port = base_port + i
+        env = {
+            **os.environ,
+            "NODE_ID": f"multiworker-check-{i}",
+            "DRAIN_READINESS_DELAY": "0",
+            "RATE_LIMIT_ENABLED": "false",  # nadawcy wysyłają szybciej niż limit ramek
+        }
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--ws", "websockets"], env=env
+        ))
+        urls.append(f"http://localhost:{port}")
+    return processes, urls
+
+
+async def wait_ready(urls: List[str], timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        for url in urls:
+            while True:
+                try:
+                    if (await client.get(f"{url}/readyz")).is_success:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{url} nie jest gotowy")
+                await asyncio.sleep(0.5)
+
+
+def check_room(chat_id: int, clients: List[Client], senders: int, messages: int) -> List[str]:
+    errors = []
+    expected = senders * messages
+    reference = [stream_id for stream_id, _, _ in clients[0].received]
+    for client in clients:
+        stream_ids = [stream_id for stream_id, _, _ in client.received]
+        where = f"pokój {chat_id}, {client.user_id} ({client.url})"
+        if len(stream_ids) != expected:
+            errors.append(f"{where}: {len(stream_ids)} wiadomości zamiast {expected}")
+        if len(set(stream_ids)) != len(stream_ids):
+            errors.append(f"{where}: zduplikowane wiadomości")
+        positions = [stream_position(stream_id) for stream_id in stream_ids]
+        if positions != sorted(positions):
+            errors.append(f"{where}: stream_id nie rosną")
+        if stream_ids != reference:
+            errors.append(f"{where}: inna kolejność niż u {clients[0].user_id}")
+        last_seq: Dict[str, int] = {}
+        for _, sender, seq in client.received:
+            if seq <= last_seq.get(sender, -1):
+                errors.append(f"{where}: wiadomość {seq} od {sender} po {last_seq[sender]}")
+                break
+            last_seq[sender] = seq
+    return errors
+
+
+async def main(args) -> int:
+    processes, urls = ([], args.urls) if args.urls else start_workers(args.workers, args.base_port)
+    try:
+        await wait_ready(urls)
+        ws_urls = [url.replace("http", "ws", 1) for url in urls]
+        run_id = uuid.uuid4().hex
+        rooms = range(args.first_chat, args.first_chat + args.rooms)
+        clients = {
+            chat_id: [
+                Client(ws_urls[m % len(ws_urls)], chat_id, f"bench-member-{m}", run_id)
+                for m in range(args.members)
+            ]
+            for chat_id in rooms
+        }
+        await asyncio.gather(*(client.connect() for room in clients.values() for client in room))
+
+        # Rejestr pokojów jest zapisywany co ROOM_REGISTRY_FLUSH_INTERVAL
+        await asyncio.sleep(ROOM_REGISTRY_FLUSH_INTERVAL * 2)
+        nodes = {chat_id: await room_nodes(chat_id) for chat_id in rooms}
+
+        async def send_all(client: Client):
+            for seq in range(args.messages):
+                await client.send(seq)
+                await asyncio.sleep(args.interval_ms / 1000)
+
+        senders = [client for room in clients.values() for client in room[: args.senders]]
+        await asyncio.gather(*(send_all(client) for client in senders))
+
+        expected = args.senders * args.messages
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline and any(
+            len(client.received) < expected for room in clients.values() for client in room
+        ):
+            await asyncio.sleep(0.1)
+        await asyncio.sleep(1)  # ewentualne duplikaty po ostatniej wiadomości
+        await asyncio.gather(*(client.close() for room in clients.values() for client in room))
+
+        errors = []
+        for chat_id, room in clients.items():
+            errors += check_room(chat_id, room, args.senders, args.messages)
+            if len(urls) > 1 and len(nodes[chat_id]) < min(len(urls), args.members):
+                errors.append(f"pokój {chat_id}: rejestr zna tylko węzły {nodes[chat_id]}")
+        for error in errors[:20]:
+            print(error, file=sys.stderr)
+        report(
+            "multiworker_check",
+            workers=len(urls),
+            rooms=args.rooms,
+            members=args.members,
+            senders=args.senders,
+            messages=args.messages,
+            delivered=sum(len(client.received) for room in clients.values() for client in room),
+            expected=expected * args.rooms * args.members,
+            errors=len(errors),
+        )
+        return 1 if errors else 0
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--urls", nargs="+", help="Działające węzły (domyślnie uruchamiamy --workers procesów)")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--base-port", type=int, default=8100)
+    parser.add_argument("--first-chat", type=int, default=1)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--members", type=int, default=6)
+    parser.add_argument("--senders", type=int, default=3)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--interval-ms", type=float, default=5)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,80 @@
+"""Test obciążeniowy rozgłaszania przez strumienie Redis pokojów.
+
+Łączy ROOMS x MEMBERS fałszywych WebSocketów z `ConnectionManager`, publikuje
+wiadomości do strumieni pokojów i mierzy czas od publikacji do dostarczenia
+oraz liczbę połączeń klientów widzianych przez Redis.
+
+Wymaga lokalnego Redisa, np.:
+    docker run --rm -p 6379:6379 redis:7
+    REDIS_URL=redis://localhost:6379 python -m benchmarks.pubsub_fanout --rooms 50 --members 40
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from app.pubsub import publish_to_room, redis_client
+from app.connections import manager
+from benchmarks.common import percentiles, report
+
+
+class FakeWebSocket:
+    def __init__(self, latencies):
+        self.latencies = latencies
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data: str):
+        self.latencies.append(time.perf_counter() - json.loads(data)["sent_at"])
+
+
+async def connected_clients() -> int:
+    info = await redis_client.info("clients")
+    return int(info["connected_clients"])
+
+
+async def main(rooms: int, members: int, messages: int):
+    latencies = []
+    clients_before = await connected_clients()
+    sockets = {}
+    for room in range(rooms):
+        sockets[str(room)] = [FakeWebSocket(latencies) for _ in range(members)]
+        for ws in sockets[str(room)]:
+            await manager.connect(str(room), ws)
+    clients_after = await connected_clients()
+
+    expected = rooms * members * messages
+    for _ in range(messages):
+        for room in range(rooms):
+            await publish_to_room(room, json.dumps({"sent_at": time.perf_counter()}))
+    deadline = time.perf_counter() + 30
+    while len(latencies) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+
+    for room, room_sockets in sockets.items():
+        for ws in room_sockets:
+            await manager.disconnect(room, ws)
+    await manager.subscriber.stop()
+    await manager.streams.stop()
+
+    report(
+        "pubsub_fanout",
+        rooms=rooms,
+        members=members,
+        messages=messages,
+        delivered=len(latencies),
+        expected=expected,
+        redis_connections_added=clients_after - clients_before,
+        latency_ms=percentiles(latencies),
+    )
+    await redis_client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rooms", type=int, default=50)
+    parser.add_argument("--members", type=int, default=40)
+    parser.add_argument("--messages", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.rooms, args.members, args.messages))
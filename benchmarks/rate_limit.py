@@ -0,0 +1,79 @@
+"""Koszt sprawdzania limitów i ich dokładność (lokalny Redis).
+
+- spokojny klient (poniżej limitu): większość decyzji bez zapytania do Redisa,
+- ten sam klient ze sprawdzaniem każdego żądania w Redisie (próg lokalny > 1),
+- zalewający klient: ile żądań przepuszczono w czasie DURATION względem
+  burst + rate * DURATION.
+
+    REDIS_URL=redis://localhost:6379 python -m benchmarks.rate_limit
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from prometheus_client import REGISTRY
+
+from app import ratelimit
+from app.ratelimit import RateLimiter, Rule
+from benchmarks.common import percentiles, report
+
+RULE = "bench"
+
+
+async def timed_hits(limiter: RateLimiter, subject: str, count: int, interval: float) -> list:
+    samples = []
+    for _ in range(count):
+        started = time.perf_counter()
+        await limiter.hit(RULE, subject)
+        samples.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+    return samples
+
+
+def redis_checks() -> float:
+    return REGISTRY.get_sample_value("chat_rate_limit_checks_total", {"source": "redis"}) or 0.0
+
+
+async def main(args):
+    rule = Rule(rate=args.rate, burst=args.burst)
+    limiter = RateLimiter({RULE: rule})
+    interval = 1 / (args.rate / 2)  # połowa limitu
+
+    before = redis_checks()
+    local = await timed_hits(limiter, uuid.uuid4().hex, args.requests, interval)
+    local_redis_calls = redis_checks() - before
+
+    ratelimit.RATE_LIMIT_LOCAL_THRESHOLD = 2.0
+    before = redis_checks()
+    remote = await timed_hits(limiter, uuid.uuid4().hex, args.requests, interval)
+    remote_redis_calls = redis_checks() - before
+    ratelimit.RATE_LIMIT_LOCAL_THRESHOLD = 0.5
+
+    subject, allowed = uuid.uuid4().hex, 0
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        if await limiter.hit(RULE, subject) is None:
+            allowed += 1
+    await limiter.stop()
+
+    report(
+        "rate_limit",
+        rate=args.rate,
+        burst=args.burst,
+        under_limit_ms=percentiles(local),
+        under_limit_redis_calls=local_redis_calls,
+        redis_every_call_ms=percentiles(remote),
+        redis_every_call_redis_calls=remote_redis_calls,
+        flood_allowed=allowed,
+        flood_expected=round(args.burst + args.rate * args.duration),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=50)
+    parser.add_argument("--burst", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=5)
+    asyncio.run(main(parser.parse_args()))
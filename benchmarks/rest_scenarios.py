@@ -0,0 +1,165 @@
+"""Scenariusze REST na działającym serwerze.
+
+Mierzy przepustowość i opóźnienia `list_chats`, `get_chat_history` (pierwsza
+strona i przewijanie kursorem), `get_or_create_chat`, wyszukiwania wiadomości
+oraz podpowiedzi użytkowników (kolejne prefiksy nazwy) przy CONCURRENCY
+równoległych klientach. Żądania wysyłają użytkownicy z `benchmarks.seed` z tokenami z `benchmarks.jwt_fixture`.
+
+    python -m benchmarks.seed --chats 10000 --messages 10000000 --users 5000
+    python -m app.cli reindex-messages   # dla scenariusza search
+    python -m app.cli sync-users         # dla scenariusza user_search (prefiksy > 3 znaków)
+    # Bez limitów częstotliwości - mierzymy serwer, a nie limiter
+    RATE_LIMIT_ENABLED=false JWT_PUBLIC_KEY="$(python -m benchmarks.jwt_fixture)" uvicorn app.main:app --port 8000 &
+    python -m benchmarks.rest_scenarios --first-chat 1 --chats 10000 --users 5000
+
+`get_or_create_chat` tworzy nowe czaty dla losowych par użytkowników.
+"""
+import argparse
+import asyncio
+import random
+import time
+from typing import Dict
+
+import httpx
+
+from benchmarks.common import percentiles, report
+from benchmarks.jwt_fixture import make_token
+
+SCENARIOS = {}
+
+
+def scenario(fn):
+    SCENARIOS[fn.__name__] = fn
+    return fn
+
+
+class Context:
+    def __init__(self, client: httpx.AsyncClient, first_chat: int, chats: int, users: int):
+        self.client = client
+        self.first_chat = first_chat
+        self.chats = chats
+        self.users = users
+        self.tokens: Dict[str, str] = {}
+
+    def headers(self, user_id: str) -> dict:
+        if user_id not in self.tokens:
+            self.tokens[user_id] = make_token(user_id, user_id)
+        return {"Authorization": f"Bearer {self.tokens[user_id]}"}
+
+    def random_user(self) -> str:
+        return f"bench-user-{random.randrange(self.users)}"
+
+    def random_membership(self):
+        """Losowy czat i jego uczestnik (przypisania jak w `seed_participants`)"""
+        chat_id = self.first_chat + random.randrange(self.chats)
+        return chat_id, f"bench-user-{chat_id % self.users}"
+
+
+@scenario
+async def list_chats(ctx: Context):
+    user_id = ctx.random_user()
+    return [await ctx.client.get("/api/chat/chats/", headers=ctx.headers(user_id))]
+
+
+@scenario
+async def history_first_page(ctx: Context):
+    chat_id, user_id = ctx.random_membership()
+    return [await ctx.client.get(f"/api/chat/chats/{chat_id}/messages", params={"limit": 50}, headers=ctx.headers(user_id))]
+
+
+@scenario
+async def history_scroll(ctx: Context, pages: int = 5):
+    """Pięć kolejnych stron historii - każda od kursora ostatniej wiadomości poprzedniej"""
+    chat_id, user_id = ctx.random_membership()
+    responses, params = [], {"limit": 50}
+    for _ in range(pages):
+        response = await ctx.client.get(f"/api/chat/chats/{chat_id}/messages", params=params, headers=ctx.headers(user_id))
+        responses.append(response)
+        messages = response.json() if response.is_success else []
+        if not messages:
+            break
+        params = {"limit": 50, "before": messages[-1]["cursor"]}
+    return responses
+
+
+@scenario
+async def get_or_create_chat(ctx: Context):
+    user_id, other = ctx.random_user(), ctx.random_user()
+    while other == user_id:
+        other = ctx.random_user()
+    return [await ctx.client.get(f"/api/chat/chats/get-or-create/{other}", headers=ctx.headers(user_id))]
+
+
+@scenario
+async def search(ctx: Context):
+    chat_id, user_id = ctx.random_membership()
+    return [
+        await ctx.client.get(
+            f"/api/chat/chats/{chat_id}/search", params={"query": "wiadomość", "limit": 20}, headers=ctx.headers(user_id)
+        )
+    ]
+
+
+@scenario
+async def user_search(ctx: Context):
+    """Podpowiedzi dla kolejnych znaków nazwy losowego użytkownika"""
+    user_id, name = ctx.random_user(), ctx.random_user()
+    return [
+        await ctx.client.get(
+            "/api/chat/users/search", params={"username": name[:length], "limit": 10}, headers=ctx.headers(user_id)
+        )
+        for length in range(1, len(name) + 1)
+    ]
+
+
+async def run(name: str, ctx: Context, requests: int, concurrency: int):
+    latencies, errors = [], 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                responses = await SCENARIOS[name](ctx)
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            if all(r.is_success for r in responses):
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    report(
+        f"rest_{name}",
+        requests=requests,
+        concurrency=concurrency,
+        errors=errors,
+        throughput_rps=round(len(latencies) / elapsed, 1),
+        latency_ms=percentiles(latencies),
+    )
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30) as client:
+        ctx = Context(client, args.first_chat, args.chats, args.users)
+        for name in args.scenarios:
+            await run(name, ctx, args.requests, args.concurrency)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--first-chat", type=int, default=1)
+    parser.add_argument("--chats", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    random.seed(0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,123 @@
+"""Uruchamia zestaw benchmarków i zapisuje wyniki do porównania między commitami.
+
+Każdy benchmark wypisuje jedną linię JSON (`benchmarks.common.report`); runner
+zbiera je do jednego pliku razem z commitem i parametrami maszyny.
+
+Zestawy:
+    offline  - bez usług (format ramek, weryfikacja JWT)
+    services - lokalne Redis / Postgres / Elasticsearch (fan-out, ingest, wyszukiwanie)
+    server   - działający serwer z danymi z `benchmarks.seed` (REST, WebSocket fan-out)
+    cluster  - kilka procesów serwera uruchamianych przez test (dostarczanie między workerami)
+
+    python -m benchmarks.run --suite offline services --output bench-results/$(git rev-parse --short HEAD).json
+    python -m benchmarks.run --compare bench-results/abc1234.json bench-results/def5678.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from typing import Dict, List
+
+SUITES: Dict[str, List[List[str]]] = {
+    "offline": [
+        ["benchmarks.wire_format"],
+        ["benchmarks.jwt_verify"],
+    ],
+    "services": [
+        ["benchmarks.pubsub_fanout"],
+        ["benchmarks.broadcast_backpressure"],
+        ["benchmarks.ingest_throughput"],
+        ["benchmarks.search_latency", "--sizes", "10000", "100000"],
+        ["benchmarks.rate_limit"],
+    ],
+    "server": [
+        ["benchmarks.rest_scenarios"],
+        ["benchmarks.ws_fanout"],
+        ["benchmarks.ws_fanout", "--encoding", "msgpack"],
+    ],
+    "cluster": [
+        ["benchmarks.multiworker_check"],
+    ],
+}
+
+# Pola porównywane przez --compare (większe = lepsze tylko dla przepustowości)
+HIGHER_IS_BETTER = ("per_sec", "rps", "throughput")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def run_suites(suites: List[str]) -> List[dict]:
+    results = []
+    for suite in suites:
+        for command in SUITES[suite]:
+            print(f"# {' '.join(command)}", file=sys.stderr)
+            proc = subprocess.run([sys.executable, "-m", *command], capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(proc.stderr, file=sys.stderr)
+                results.append({"benchmark": command[0], "args": command[1:], "error": proc.returncode})
+                continue
+            for line in proc.stdout.splitlines():
+                if line.startswith("{"):
+                    results.append({**json.loads(line), "args": command[1:]})
+    return results
+
+
+def flatten(result: dict, prefix: str = "") -> Dict[str, float]:
+    values = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and key != "time":
+            values[f"{prefix}{key}"] = value
+    return values
+
+
+def compare(old_path: str, new_path: str):
+    """Wypisuje zmianę (%) każdej liczbowej wartości benchmarków obecnych w obu plikach"""
+    def load(path):
+        with open(path) as f:
+            data = json.load(f)
+        return {(r["benchmark"], " ".join(r.get("args", []))): flatten(r) for r in data["results"]}
+
+    old, new = load(old_path), load(new_path)
+    for key in sorted(old.keys() & new.keys()):
+        for metric, before in sorted(old[key].items()):
+            after = new[key].get(metric)
+            if after is None or before == after:
+                continue
+            change = (after - before) / before * 100 if before else float("inf")
+            better = (change > 0) == any(marker in metric for marker in HIGHER_IS_BETTER)
+            print(f"{key[0]} {key[1]:<20} {metric:<32} {before:>12} -> {after:>12} ({change:+.1f}%{'' if better else ' !'})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--suite", nargs="+", choices=sorted(SUITES), default=["offline"])
+    parser.add_argument("--output")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    output = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": run_suites(args.suite),
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    else:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
@@ -0,0 +1,68 @@
+"""Benchmark wyszukiwania wiadomości w zależności od rozmiaru indeksu.
+
+Dla kolejnych rozmiarów dokłada syntetyczne wiadomości do osobnego aliasu
+(`bench-messages`) i mierzy opóźnienie zapytania z filtrem + routingiem
+(`search_messages`) oraz dawnego zapytania `match` po chat_id bez routingu.
+
+    ELASTICSEARCH_URL=http://localhost:9200 python -m benchmarks.search_latency --sizes 10000 100000 1000000
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime
+
+from app.search import bulk_indexer, ensure_messages_index, es_client, index_message, search_messages
+from benchmarks.common import percentiles, report
+
+ALIAS = "bench-messages"
+WORDS = ["cześć", "spotkanie", "jutro", "projekt", "kawa", "raport", "deploy", "błąd", "obiad", "wyniki"]
+
+
+async def legacy_search(query: str, chat_id: str):
+    return await es_client.search(index=ALIAS, body={
+        "query": {"bool": {"must": [{"match": {"content": query}}, {"match": {"chat_id": chat_id}}]}}
+    })
+
+
+async def timed(samples, coro):
+    started = time.perf_counter()
+    await coro
+    samples.append(time.perf_counter() - started)
+
+
+async def main(sizes, chats: int, queries: int):
+    await es_client.options(ignore_status=404).indices.delete(index=f"{ALIAS}-*")
+    await ensure_messages_index(ALIAS)
+    indexed = 0
+    for size in sizes:
+        bulk_indexer.start()
+        for message_id in range(indexed, size):
+            content = " ".join(random.choices(WORDS, k=8))
+            await index_message(message_id, str(random.randrange(chats)), "bench", content, datetime.utcnow(), index=ALIAS)
+        await bulk_indexer.stop()
+        await es_client.indices.refresh(index=ALIAS)
+        indexed = size
+
+        filtered, legacy = [], []
+        for _ in range(queries):
+            query, chat_id = random.choice(WORDS), str(random.randrange(chats))
+            await timed(filtered, search_messages(query, chat_id, index=ALIAS))
+            await timed(legacy, legacy_search(query, chat_id))
+        report(
+            "search_latency",
+            index_size=size,
+            chats=chats,
+            filtered_routed_ms=percentiles(filtered),
+            legacy_match_ms=percentiles(legacy),
+        )
+    await es_client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--chats", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, args.chats, args.queries))
@@ -0,0 +1,85 @@
+"""Benchmark formatów ramek WebSocket.
+
+Dla 1000 typowych wiadomości czatu porównuje stdlib `json`, orjson (podprotokół
+chat.v1.json) i MessagePack (chat.v1.msgpack): bajty na łączu - bez kompresji
+i po per-message-deflate (zlib z zachowaniem kontekstu, jak w rozszerzeniu
+WebSocket) - oraz czas CPU serializacji na 1000 wiadomości.
+
+Nie wymaga żadnych usług:
+    python -m benchmarks.wire_format --messages 1000 --rounds 20
+"""
+import argparse
+import json
+import random
+import string
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from app.wire import CODECS
+from benchmarks.common import report
+
+
+def sample_events(count: int):
+    started = datetime.utcnow()
+    words = ["".join(random.choices(string.ascii_lowercase, k=random.randint(2, 9))) for _ in range(500)]
+    return [
+        {
+            "id": 1_000_000 + i,
+            "chat_id": random.randint(1, 500),
+            "sender": f"user{random.randint(1, 200)}",
+            "content": " ".join(random.choices(words, k=random.randint(3, 25))),
+            "timestamp": (started + timedelta(milliseconds=37 * i)).isoformat(),
+            "stream_id": f"{int(started.timestamp() * 1000) + 37 * i}-0",
+        }
+        for i in range(count)
+    ]
+
+
+def deflated_size(frames) -> int:
+    """Rozmiar po permessage-deflate z context takeover (bez końcowego 00 00 ff ff)"""
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    total = 0
+    for frame in frames:
+        data = frame.encode() if isinstance(frame, str) else frame
+        total += len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+    return total
+
+
+def measure(encode, events, rounds: int):
+    best = None
+    for _ in range(rounds):
+        started = time.process_time()
+        frames = [encode(event) for event in events]
+        elapsed = time.process_time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    raw = sum(len(f.encode() if isinstance(f, str) else f) for f in frames)
+    return {
+        "bytes": raw,
+        "bytes_deflate": deflated_size(frames),
+        "encode_cpu_ms_per_1k": round(best * 1000 * 1000 / len(events), 3),
+    }
+
+
+def main(messages: int, rounds: int):
+    random.seed(0)
+    events = sample_events(messages)
+    encoders = {
+        "stdlib_json": json.dumps,
+        "orjson": CODECS["json"].encode,
+        "msgpack": CODECS["msgpack"].encode,
+    }
+    report(
+        "wire_format",
+        messages=messages,
+        rounds=rounds,
+        **{name: measure(encode, events, rounds) for name, encode in encoders.items()},
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    main(args.messages, args.rounds)
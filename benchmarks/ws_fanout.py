@@ -0,0 +1,126 @@
+"""Fan-out WebSocket na działającym serwerze (ROOMS x MEMBERS połączeń).
+
+Każdy uczestnik pokoju otwiera połączenie `/ws` i subskrybuje pokój; pierwszy
+uczestnik każdego pokoju wysyła MESSAGES wiadomości co INTERVAL_MS. Mierzymy
+czas zestawienia połączeń, opóźnienie od wysłania do odebrania u każdego
+uczestnika i liczbę dostarczonych ramek względem oczekiwanej.
+
+    python -m benchmarks.seed --chats 100 --messages 0 --rooms 50 --room-members 40
+    # Bez limitów częstotliwości - mierzymy serwer, a nie limiter
+    RATE_LIMIT_ENABLED=false JWT_PUBLIC_KEY="$(python -m benchmarks.jwt_fixture)" uvicorn app.main:app --port 8000 &
+    python -m benchmarks.ws_fanout --first-chat 1 --rooms 50 --members 40 --encoding msgpack
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import websockets
+
+from app.wire import CODECS
+from benchmarks.common import percentiles, report
+from benchmarks.jwt_fixture import make_token
+
+SUBPROTOCOLS = {"json": "chat.v1.json", "msgpack": "chat.v1.msgpack"}
+
+
+class Member:
+    def __init__(self, url: str, chat_id: int, user_id: str, encoding: str, run_id: str, latencies: list):
+        self.url = url
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.codec = CODECS[encoding]
+        self.subprotocol = SUBPROTOCOLS[encoding]
+        self.run_id = run_id
+        self.latencies = latencies
+        self.subscribed = asyncio.Event()
+        self.ws = None
+        self.reader = None
+
+    async def connect(self):
+        token = make_token(self.user_id, self.user_id)
+        self.ws = await websockets.connect(f"{self.url}/ws?token={token}", subprotocols=[self.subprotocol], max_size=None)
+        self.reader = asyncio.create_task(self._read())
+        await self.send({"type": "subscribe", "chat_id": self.chat_id})
+        await self.subscribed.wait()
+
+    async def send(self, frame: dict):
+        await self.ws.send(self.codec.encode(frame))
+
+    async def _read(self):
+        async for data in self.ws:
+            frame = self.codec.decode(data)
+            if frame.get("type") == "subscribed":
+                self.subscribed.set()
+            elif "content" in frame and frame["content"].startswith("{"):
+                content = json.loads(frame["content"])
+                if content.get("run") == self.run_id:
+                    self.latencies.append(time.time() - content["sent_at"])
+
+    async def close(self):
+        self.reader.cancel()
+        await self.ws.close()
+
+
+async def main(args):
+    run_id = uuid.uuid4().hex
+    latencies, connect_times = [], []
+    members = [
+        Member(args.url, chat_id, f"bench-member-{m}", args.encoding, run_id, latencies)
+        for chat_id in range(args.first_chat, args.first_chat + args.rooms)
+        for m in range(args.members)
+    ]
+    limit = asyncio.Semaphore(args.connect_concurrency)
+
+    async def connect(member: Member):
+        async with limit:
+            started = time.perf_counter()
+            await member.connect()
+            connect_times.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(connect(member) for member in members))
+    senders = members[:: args.members]
+
+    for _ in range(args.messages):
+        sent_at = time.time()
+        await asyncio.gather(*(
+            sender.send({
+                "type": "message",
+                "chat_id": sender.chat_id,
+                "content": json.dumps({"run": run_id, "sent_at": sent_at}),
+            })
+            for sender in senders
+        ))
+        await asyncio.sleep(args.interval_ms / 1000)
+
+    expected = len(members) * args.messages
+    deadline = time.perf_counter() + 30
+    while len(latencies) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    await asyncio.gather(*(member.close() for member in members))
+
+    report(
+        "ws_fanout",
+        rooms=args.rooms,
+        members=args.members,
+        messages=args.messages,
+        encoding=args.encoding,
+        delivered=len(latencies),
+        expected=expected,
+        connect_ms=percentiles(connect_times),
+        latency_ms=percentiles(latencies),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="ws://localhost:8000")
+    parser.add_argument("--first-chat", type=int, default=1)
+    parser.add_argument("--rooms", type=int, default=50)
+    parser.add_argument("--members", type=int, default=40)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--interval-ms", type=float, default=50)
+    parser.add_argument("--encoding", choices=sorted(SUBPROTOCOLS), default="json")
+    parser.add_argument("--connect-concurrency", type=int, default=100)
+    asyncio.run(main(parser.parse_args()))